@@ -2,20 +2,81 @@ import os
 import smtplib
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
+import re
+import base64
+import binascii
+import threading
 import imaplib
 import email
+from datetime import datetime, timezone
 from email.header import decode_header
+from imap_pool import IMAPPool
+from mail_cache import MailCache
 
 load_dotenv()
 
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+IMAP_HOST = os.getenv("IMAP_HOST", "imap.gmail.com")
+IMAP_POOL_SIZE = int(os.getenv("IMAP_POOL_SIZE", "2"))
 
-def connect_imap():
-    """Connect to the IMAP server."""
-    imap = imaplib.IMAP4_SSL("imap.gmail.com")
-    imap.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-    return imap
+# How much of each message body to download for previews
+SNIPPET_LENGTH = 100
+PREVIEW_BYTES = int(os.getenv("EMAIL_PREVIEW_BYTES", "2048"))
+FETCH_CHUNK_SIZE = 500
+SEARCH_RESULT_LIMIT = int(os.getenv("EMAIL_SEARCH_LIMIT", "25"))
+
+# Local mailbox cache; set MAIL_CACHE_PATH to an empty string to disable it
+MAILBOX = "INBOX"
+MAIL_CACHE_PATH = os.getenv(
+    "MAIL_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mail_cache.sqlite3")
+)
+MAIL_CACHE_SYNC_INTERVAL = float(os.getenv("MAIL_CACHE_SYNC_INTERVAL", "30"))
+MAIL_CACHE_BACKFILL = int(os.getenv("MAIL_CACHE_BACKFILL", "200"))
+
+SUMMARY_HEADERS = "SUBJECT FROM DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING"
+SUMMARY_FETCH_ITEMS = f"(UID FLAGS BODY.PEEK[HEADER.FIELDS ({SUMMARY_HEADERS})] BODY.PEEK[TEXT]<0.{PREVIEW_BYTES}>)"
+SUBJECT_FETCH_ITEMS = "(UID BODY.PEEK[HEADER.FIELDS (SUBJECT)])"
+
+FETCH_START_RE = re.compile(r"^\d+ \(")
+UID_RE = re.compile(r"\bUID (\d+)")
+FLAGS_RE = re.compile(r"\bFLAGS \(([^)]*)\)")
+STATUS_RE = re.compile(r"\b(MESSAGES|UIDNEXT|UIDVALIDITY|HIGHESTMODSEQ) (\d+)")
+
+# Query syntax for search_emails: optional field prefix, then a quoted phrase or a bare word
+SEARCH_TERM_RE = re.compile(r'(?:(subject|from|body|text):)?(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+SEARCH_FIELDS = {"subject": "SUBJECT", "from": "FROM", "body": "BODY", "text": "TEXT"}
+
+_imap_pool = None
+_imap_pool_lock = threading.Lock()
+_mail_cache = None
+_mail_cache_lock = threading.Lock()
+
+def get_imap_pool():
+    """Return the shared IMAP connection pool, creating it on first use."""
+    global _imap_pool
+    with _imap_pool_lock:
+        if _imap_pool is None:
+            _imap_pool = IMAPPool(IMAP_HOST, EMAIL_ADDRESS, EMAIL_PASSWORD, size=IMAP_POOL_SIZE)
+        return _imap_pool
+
+def close_imap_pool():
+    """Log out all pooled IMAP connections."""
+    global _imap_pool
+    with _imap_pool_lock:
+        if _imap_pool is not None:
+            _imap_pool.close()
+            _imap_pool = None
+
+def get_mail_cache():
+    """Return the shared mailbox cache, or None if caching is disabled."""
+    global _mail_cache
+    if not MAIL_CACHE_PATH:
+        return None
+    with _mail_cache_lock:
+        if _mail_cache is None:
+            _mail_cache = MailCache(MAIL_CACHE_PATH)
+        return _mail_cache
 
 def send_email(to_email, subject, body):
     """Send email via Gmail SMTP."""
@@ -30,11 +91,318 @@ def send_email(to_email, subject, body):
 
     return f"✅ Email sent to {to_email}."
 
-def read_emails(filters):
+def _decode_subject(raw_subject):
+    """Decode a possibly RFC 2047 encoded Subject header into text."""
+    if not raw_subject:
+        return ""
+    parts = []
+    for value, charset in decode_header(raw_subject):
+        if isinstance(value, bytes):
+            try:
+                value = value.decode(charset or "utf-8", errors="ignore")
+            except LookupError:
+                value = value.decode("utf-8", errors="ignore")
+        parts.append(value)
+    return "".join(parts)
+
+def _decode_text_part(part):
+    """Decode a text part, tolerating base64 payloads cut off by a partial fetch."""
+    if part.get("Content-Transfer-Encoding", "").strip().lower() == "base64":
+        raw = "".join(str(part.get_payload(decode=False) or "").split())
+        raw = raw[:len(raw) // 4 * 4]
+        try:
+            payload = base64.b64decode(raw)
+        except (binascii.Error, ValueError):
+            payload = b""
+    else:
+        payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+    except LookupError:
+        return payload.decode("utf-8", errors="ignore")
+
+def _extract_plain_text(msg):
+    """Return the first text/plain body of a message, or an empty string."""
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/plain":
+                return _decode_text_part(part)
+        return ""
+    return _decode_text_part(msg)
+
+def _since_timestamp(value):
+    """Parse a SINCE filter value into a UTC midnight timestamp, or None."""
+    for date_format in ("%Y-%m-%d", "%d-%b-%Y"):
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    return None
+
+def _imap_date(value):
+    """Convert YYYY-MM-DD (as produced by the AI) to the DD-Mon-YYYY form IMAP expects."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%d-%b-%Y")
+    except ValueError:
+        return value
+
+def _parse_fetch_response(msg_data):
+    """
+    Group the items of a batched UID FETCH response by message.
+
+    imaplib returns a flat list where each literal is a (prefix, bytes)
+    tuple and the closing parenthesis of a message is a separate bytes
+    item. Items may come in any order, so each message is keyed by the
+    UID found in its prefixes.
+
+    Returns:
+        list: One dict per message with uid, flags and the fetched sections
+    """
+    messages = []
+    current = None
+    for item in msg_data:
+        if isinstance(item, tuple):
+            prefix, literal = item[0].decode(errors="ignore"), item[1]
+        elif isinstance(item, bytes):
+            prefix, literal = item.decode(errors="ignore"), None
+        else:
+            continue
+
+        if FETCH_START_RE.match(prefix):
+            current = {"uid": None, "flags": None, "header": b"", "text": b"", "full": b""}
+            messages.append(current)
+        if current is None:
+            continue
+
+        uid_match = UID_RE.search(prefix)
+        if uid_match:
+            current["uid"] = uid_match.group(1)
+        flags_match = FLAGS_RE.search(prefix)
+        if flags_match:
+            current["flags"] = flags_match.group(1).split()
+
+        if literal is not None:
+            section = prefix.rsplit("{", 1)[0]
+            if "HEADER" in section:
+                current["header"] = literal
+            elif "TEXT" in section:
+                current["text"] = literal
+            elif "BODY[]" in section or "RFC822" in section:
+                current["full"] = literal
+    return [message for message in messages if message["uid"]]
+
+def _summarize(fetched):
+    """Turn one parsed FETCH item into the email dict used by the chat layer."""
+    msg = email.message_from_bytes(fetched["full"] or fetched["header"] + fetched["text"])
+    summary = {
+        "uid": fetched["uid"],
+        "subject": _decode_subject(msg["Subject"]),
+        "from": msg.get("From"),
+        "date": msg.get("Date"),
+        "snippet": _extract_plain_text(msg)[:SNIPPET_LENGTH]
+    }
+    if fetched["flags"] is not None:
+        summary["flags"] = fetched["flags"]
+    if fetched["full"]:
+        summary["full_body"] = _extract_plain_text(msg)
+    return summary
+
+def _fetch_summaries(imap, uids, include_body=False):
+    """
+    Fetch subject, sender, date and a snippet for many messages at once.
+
+    Only the needed header fields and the first PREVIEW_BYTES of the body
+    are requested (with BODY.PEEK so nothing is marked as read), in one
+    UID FETCH per FETCH_CHUNK_SIZE messages. With include_body the whole
+    message is downloaded instead so `full_body` can be filled in.
+
+    Returns:
+        list: Email dicts in the same order as `uids`
+    """
+    items = SUMMARY_FETCH_ITEMS if not include_body else "(UID BODY.PEEK[])"
+    by_uid = {}
+    for i in range(0, len(uids), FETCH_CHUNK_SIZE):
+        chunk = uids[i:i + FETCH_CHUNK_SIZE]
+        status, msg_data = imap.uid("FETCH", ",".join(chunk), items)
+        if status != "OK":
+            continue
+        for fetched in _parse_fetch_response(msg_data):
+            by_uid[fetched["uid"]] = _summarize(fetched)
+    return [by_uid[uid] for uid in uids if uid in by_uid]
+
+def _load_summaries(imap, uids):
+    """
+    Return summaries for `uids`, serving what the cache has and fetching
+    the rest in one batch (which is then cached too).
+    """
+    cache = get_mail_cache()
+    state = cache.get_state(MAILBOX) if cache else None
+    if state is None:
+        return _fetch_summaries(imap, uids)
+
+    by_uid = cache.get_emails(MAILBOX, state["uidvalidity"], uids)
+    missing = [uid for uid in uids if uid not in by_uid]
+    if missing:
+        fetched = _fetch_summaries(imap, missing)
+        cache.upsert_emails(MAILBOX, state["uidvalidity"], fetched)
+        by_uid.update((item["uid"], item) for item in fetched)
+    return [by_uid[uid] for uid in uids if uid in by_uid]
+
+def sync_mailbox(force=False):
+    """
+    Bring the local mailbox cache up to date with the server.
+
+    Does nothing if the cache is disabled, or if it was synced less than
+    MAIL_CACHE_SYNC_INTERVAL seconds ago and `force` is not set.
+
+    Returns:
+        dict: The cached mailbox state, or None if caching is disabled
+    """
+    cache = get_mail_cache()
+    if cache is None:
+        return None
+    if not force and cache.is_fresh(MAILBOX, MAIL_CACHE_SYNC_INTERVAL):
+        return cache.get_state(MAILBOX)
+    return get_imap_pool().run(lambda imap: _sync_mailbox(imap, cache))
+
+def _sync_mailbox(imap, cache):
+    """
+    Incrementally sync MAILBOX into `cache`.
+
+    1. STATUS gives UIDVALIDITY, UIDNEXT, MESSAGES (and HIGHESTMODSEQ with
+       CONDSTORE). A new UIDVALIDITY drops the cached mailbox.
+    2. First sync backfills the newest MAIL_CACHE_BACKFILL messages; later
+       syncs fetch only UIDs at or above the last UIDNEXT.
+    3. Flag changes come from FETCH (CHANGEDSINCE modseq) on CONDSTORE
+       servers, otherwise from a UID SEARCH UNSEEN over the cached range.
+    4. If MESSAGES does not add up, cached UIDs the server no longer has
+       are treated as expunged and removed.
+    """
+    condstore = "CONDSTORE" in imap.capabilities
+    items = "(MESSAGES UIDNEXT UIDVALIDITY HIGHESTMODSEQ)" if condstore else "(MESSAGES UIDNEXT UIDVALIDITY)"
+    status, data = imap.status(MAILBOX, items)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"STATUS {MAILBOX} failed: {data}")
+    server = {key.lower(): int(value) for key, value in STATUS_RE.findall(data[0].decode())}
+    uidvalidity = server["uidvalidity"]
+
+    state = cache.get_state(MAILBOX)
+    if state and state["uidvalidity"] != uidvalidity:
+        print(f"⚠️ UIDVALIDITY of {MAILBOX} changed, rebuilding the mail cache")
+        cache.reset_mailbox(MAILBOX)
+        state = None
+
+    # New messages
+    if state is None:
+        status, messages = imap.uid("SEARCH", "ALL")
+        all_uids = [uid.decode() for uid in messages[0].split()] if status == "OK" else []
+        new_uids = all_uids[-MAIL_CACHE_BACKFILL:]
+        floor_uid = int(new_uids[0]) if new_uids else server["uidnext"]
+        complete = len(all_uids) <= MAIL_CACHE_BACKFILL
+    else:
+        floor_uid, complete = state["floor_uid"], state["complete"]
+        new_uids = []
+        if server["uidnext"] > state["uidnext"]:
+            status, messages = imap.uid("SEARCH", f"UID {state['uidnext']}:*")
+            if status == "OK":
+                new_uids = [uid.decode() for uid in messages[0].split() if int(uid) >= state["uidnext"]]
+    if new_uids:
+        cache.upsert_emails(MAILBOX, uidvalidity, _fetch_summaries(imap, new_uids))
+
+    if state is not None and floor_uid < state["uidnext"]:
+        known_range = f"{floor_uid}:{state['uidnext'] - 1}"
+
+        # Flag changes on already cached messages
+        if condstore and state["highestmodseq"] and server["highestmodseq"] > state["highestmodseq"]:
+            status, data = imap.uid("FETCH", known_range, "(UID FLAGS)", f"(CHANGEDSINCE {state['highestmodseq']})")
+            if status == "OK":
+                cache.update_flags(MAILBOX, uidvalidity, {
+                    fetched["uid"]: fetched["flags"]
+                    for fetched in _parse_fetch_response(data) if fetched["flags"] is not None
+                })
+        elif not condstore:
+            status, messages = imap.uid("SEARCH", "UNSEEN", f"UID {known_range}")
+            if status == "OK":
+                unseen = [uid.decode() for uid in messages[0].split()]
+                cache.set_unseen(MAILBOX, uidvalidity, unseen, floor_uid, state["uidnext"] - 1)
+
+        # Expunged messages
+        if server["messages"] != state["messages"] + len(new_uids):
+            status, messages = imap.uid("SEARCH", f"UID {floor_uid}:*")
+            if status == "OK":
+                on_server = {int(uid) for uid in messages[0].split()}
+                gone = cache.cached_uids(MAILBOX, uidvalidity) - on_server
+                cache.remove(MAILBOX, uidvalidity, [uid for uid in gone if uid >= floor_uid])
+
+    cache.set_state(
+        MAILBOX,
+        uidvalidity=uidvalidity,
+        uidnext=server["uidnext"],
+        highestmodseq=server.get("highestmodseq"),
+        floor_uid=floor_uid,
+        complete=int(complete),
+        messages=server["messages"]
+    )
+    return cache.get_state(MAILBOX)
+
+def fetch_email_body(email_uid):
+    """Return the plain-text body of a single email by UID, from the cache when possible."""
+    email_uid = str(email_uid)
+    cache = get_mail_cache()
+    state = cache.get_state(MAILBOX) if cache else None
+    if state is not None:
+        body = cache.get_body(MAILBOX, state["uidvalidity"], email_uid)
+        if body is not None:
+            return body
+
+    def _fetch(imap):
+        emails = _fetch_summaries(imap, [email_uid], include_body=True)
+        return emails[0]["full_body"] if emails else ""
+
+    body = get_imap_pool().run(_fetch)
+    if state is not None:
+        cache.set_body(MAILBOX, state["uidvalidity"], email_uid, body)
+    return body
+
+def read_emails(filters, include_body=False):
     """Read emails with optional filters like from, unread, since."""
-    imap = connect_imap()
-    imap.select("inbox")
+    emails = _read_cached_emails(filters)
+    if emails is None:
+        emails = get_imap_pool().run(lambda imap: _read_emails(imap, filters))
+    if include_body:
+        emails = [dict(item, full_body=fetch_email_body(item["uid"])) for item in emails]
+    return emails
+
+def _read_cached_emails(filters, limit=5):
+    """
+    Answer read_emails from the local cache.
+
+    Returns None when the cache cannot give a complete answer: caching is
+    disabled, the SINCE date is unparseable, or fewer than `limit` cached
+    messages match and older, uncached messages might match too.
+    """
+    state = sync_mailbox()
+    if state is None:
+        return None
+    since_ts = None
+    if filters.get("since"):
+        since_ts = _since_timestamp(filters["since"])
+        if since_ts is None:
+            return None
 
+    emails = get_mail_cache().query(
+        MAILBOX, state["uidvalidity"],
+        sender=filters.get("from"),
+        unread=bool(filters.get("unread")),
+        since_ts=since_ts,
+        min_uid=None if state["complete"] else state["floor_uid"],
+        limit=limit
+    )
+    if len(emails) < limit and not state["complete"]:
+        return None
+    return emails
+
+def _read_emails(imap, filters):
     # Build search criteria
     criteria = []
     if filters.get("from"):
@@ -42,101 +410,168 @@ def read_emails(filters):
     if filters.get("unread"):
         criteria.append('UNSEEN')
     if filters.get("since"):
-        criteria.append(f'SINCE "{filters["since"]}"')
+        criteria.append(f'SINCE "{_imap_date(filters["since"])}"')
     if not criteria:
         criteria = ["ALL"]
 
-    search_query = " ".join(criteria)
-    status, messages = imap.search(None, *criteria)
-
-    email_data = []
-    if status == "OK":
-        for num in messages[0].split()[-5:]:  # get last 5 matching emails
-            _, msg_data = imap.fetch(num, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    subject = decode_header(msg["Subject"])[0][0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode()
-                    from_ = msg.get("From")
-                    date_ = msg.get("Date")
-                    snippet = ""
-                    full_body = ""
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/plain":
-                                full_body = part.get_payload(decode=True).decode(errors="ignore")
-                                snippet = full_body[:100]
-                                break
-                    else:
-                        full_body = msg.get_payload(decode=True).decode(errors="ignore")
-                        snippet = full_body[:100]
-                    email_data.append({
-                        "uid": num.decode(),
-                        "subject": subject,
-                        "from": from_,
-                        "date": date_,
-                        "snippet": snippet,
-                        "full_body": full_body  # Add the full body here
-                    })
-    imap.logout()
-    return email_data
+    status, messages = imap.uid("SEARCH", *criteria)
+    if status != "OK":
+        return []
+
+    uids = [uid.decode() for uid in messages[0].split()[-5:]]  # get last 5 matching emails
+    return _load_summaries(imap, uids)
 
 def delete_email(email_uid):
     """Delete an email by its IMAP UID."""
-    imap = connect_imap()
-    imap.select("inbox")
-    imap.store(email_uid, '+FLAGS', '\\Deleted')
-    imap.expunge()
-    imap.logout()
+    def _delete(imap):
+        imap.uid("STORE", str(email_uid), '+FLAGS', '(\\Deleted)')
+        imap.expunge()
+
+    get_imap_pool().run(_delete)
+    cache = get_mail_cache()
+    state = cache.get_state(MAILBOX) if cache else None
+    if state is not None:
+        cache.remove(MAILBOX, state["uidvalidity"], [email_uid])
     return f"🗑️ Deleted email with UID {email_uid}."
 
-def search_emails(query, first_only=False, last_only=False):
-    """Search emails by subject keyword."""
-    imap = connect_imap()
-    imap.select("inbox")
-    status, messages = imap.search(None, "ALL")
-    results = []
-
-    if status == "OK":
-        uids = messages[0].split()
-        if first_only:
-            uids = reversed(uids)  # oldest first
-        else:
-            uids = uids[::-1]  # newest first
-
-        for num in uids:
-            _, msg_data = imap.fetch(num, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    subject = decode_header(msg["Subject"])[0][0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode()
-                    if query.lower() in subject.lower():
-                        from_ = msg.get("From")
-                        date_ = msg.get("Date")
-                        snippet = ""
-                        if msg.is_multipart():
-                            for part in msg.walk():
-                                if part.get_content_type() == "text/plain":
-                                    snippet = part.get_payload(decode=True).decode(errors="ignore")[:100]
-                                    break
-                        else:
-                            snippet = msg.get_payload(decode=True).decode(errors="ignore")[:100]
-                        results.append({
-                            "uid": num.decode(),
-                            "subject": subject,
-                            "from": from_,
-                            "date": date_,
-                            "snippet": snippet
-                        })
-                        if first_only or last_only:
-                            imap.logout()
-                            return results
-    imap.logout()
-    return results
+def _quote_imap_string(value):
+    """Quote a value as an IMAP quoted string."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def build_search_criteria(query):
+    """
+    Translate a search query into an IMAP SEARCH key.
+
+    Plain words are matched as one phrase against the subject, which keeps
+    the old "substring of the subject" behaviour. `from:`, `subject:` and
+    `body:`/`text:` prefixes target other fields (quote multi-word values),
+    and alternatives separated by an upper-case OR become an OR tree.
+
+    Example:
+        'invoice OR from:"Stripe" receipt' ->
+        'OR SUBJECT "invoice" (FROM "Stripe" SUBJECT "receipt")'
+
+    Returns:
+        str: The search key, or None if the query cannot be sent as ASCII
+    """
+    if not query.strip() or not query.isascii():
+        return None
+
+    alternatives = []
+    for alternative in re.split(r"\s+OR\s+", query.strip()):
+        keys = []
+        words = []
+        for field, quoted, bare in SEARCH_TERM_RE.findall(alternative):
+            value = quoted or bare
+            if field:
+                keys.append(f"{SEARCH_FIELDS[field.lower()]} {_quote_imap_string(value)}")
+            elif value:
+                words.append(value)
+        if words:
+            keys.append(f"SUBJECT {_quote_imap_string(' '.join(words))}")
+        if keys:
+            alternatives.append(keys[0] if len(keys) == 1 else f"({' '.join(keys)})")
+
+    if not alternatives:
+        return None
+    criteria = alternatives[-1]
+    for key in reversed(alternatives[:-1]):
+        criteria = f"OR {key} {criteria}"
+    return criteria
+
+def search_emails(query, first_only=False, last_only=False, limit=SEARCH_RESULT_LIMIT):
+    """
+    Search emails, best match first.
+
+    Cached mail is searched locally through the full-text index (subjects,
+    senders and bodies, BM25-ranked) without any IMAP round-trip. The
+    server is asked when the index has no hit, when the oldest match is
+    wanted and older mail is not cached, or when the cache only holds the
+    newest messages and has fewer than `limit` hits: the server's matches
+    among the older, uncached mail then fill up the list after the ranked
+    cached ones.
+    """
+    state = sync_mailbox()
+    if state is not None and not (first_only and not state["complete"]):
+        results = get_mail_cache().search_index(MAILBOX).search(
+            query, limit=None if first_only or last_only else limit
+        )
+        # The cache holds the newest mail, so its newest match is the newest overall
+        if results and (first_only or last_only):
+            pick = min if first_only else max
+            return [pick(results, key=lambda item: int(item["uid"]))]
+        if results and (state["complete"] or len(results) >= limit):
+            return results
+        if results:
+            older = get_imap_pool().run(
+                lambda imap: _search_emails(imap, query, False, False, limit, below_uid=state["floor_uid"])
+            )
+            seen = {item["uid"] for item in results}
+            return results + [item for item in older if item["uid"] not in seen][:limit - len(results)]
+    return get_imap_pool().run(lambda imap: _search_emails(imap, query, first_only, last_only, limit))
+
+def _search_emails(imap, query, first_only, last_only, limit, below_uid=None):
+    criteria = build_search_criteria(query)
+    if criteria is None:
+        return _scan_subjects(imap, query, first_only, last_only, limit)
+    if below_uid is not None:
+        if int(below_uid) <= 1:
+            return []
+        criteria = f"UID 1:{int(below_uid) - 1} {criteria}"
+
+    try:
+        status, messages = imap.uid("SEARCH", criteria)
+    except imaplib.IMAP4.error as e:
+        print(f"⚠️ Server-side search failed ({e}), scanning subjects locally")
+        status = "NO"
+    if status != "OK":
+        return _scan_subjects(imap, query, first_only, last_only, limit)
+
+    uids = sorted(messages[0].split(), key=int)
+    if first_only:
+        uids = uids[:1]  # oldest match
+    elif last_only:
+        uids = uids[-1:]  # newest match
+    else:
+        uids = uids[::-1][:limit]  # newest first
+    return _load_summaries(imap, [uid.decode() for uid in uids])
+
+def _scan_subjects(imap, query, first_only, last_only, limit):
+    """Fallback search: match the query against every subject on the client side."""
+    cache = get_mail_cache()
+    state = cache.get_state(MAILBOX) if cache else None
+    if state is not None and state["complete"]:
+        results = cache.query(
+            MAILBOX, state["uidvalidity"], subject_contains=query,
+            oldest_first=first_only, limit=1 if first_only or last_only else limit
+        )
+        return results if first_only else results[::-1]
+
+    status, messages = imap.uid("SEARCH", "ALL")
+    if status != "OK":
+        return []
+
+    uids = [uid.decode() for uid in messages[0].split()]
+    if not first_only:
+        uids = uids[::-1]  # newest first, otherwise oldest first
+
+    # Match on subjects alone, then fetch previews only for the hits
+    matches = []
+    for i in range(0, len(uids), FETCH_CHUNK_SIZE):
+        chunk = uids[i:i + FETCH_CHUNK_SIZE]
+        status, msg_data = imap.uid("FETCH", ",".join(chunk), SUBJECT_FETCH_ITEMS)
+        if status != "OK":
+            continue
+        subjects = {
+            fetched["uid"]: _decode_subject(email.message_from_bytes(fetched["header"])["Subject"])
+            for fetched in _parse_fetch_response(msg_data)
+        }
+        for uid in chunk:
+            if query.lower() in subjects.get(uid, "").lower():
+                matches.append(uid)
+                if first_only or last_only or len(matches) >= limit:
+                    return _load_summaries(imap, matches)
+    return _load_summaries(imap, matches)
 
 def format_emails_as_text(emails):
     """Format list of emails into a pretty text block for chat."""
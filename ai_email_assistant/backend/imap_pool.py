@@ -0,0 +1,165 @@
+import imaplib
+import queue
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+# Errors that mean the socket or the IMAP session is no longer usable.
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, ssl.SSLError, socket.error, EOFError)
+
+
+class _PooledConnection:
+    """An authenticated IMAP connection plus the state we track for reuse."""
+
+    def __init__(self, imap):
+        self.imap = imap
+        self.mailbox = None
+        self.last_used = time.monotonic()
+
+
+class IMAPPool:
+    """
+    Thread-safe pool of authenticated IMAP connections.
+
+    Connections are logged in once and handed out through `session()`.
+    Each connection remembers which mailbox it has selected, so repeated
+    calls against INBOX skip the SELECT round-trip. Idle connections are
+    probed with NOOP before reuse and transparently replaced when the
+    server has dropped them.
+
+    Args:
+        host (str): IMAP server hostname
+        user (str): Login name
+        password (str): Login password
+        size (int): Maximum number of open connections
+        noop_after (float): Seconds of idleness after which a NOOP health check runs
+        max_idle (float): Seconds of idleness after which a connection is recycled
+    """
+
+    def __init__(self, host, user, password, size=2, noop_after=30, max_idle=600):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.size = size
+        self.noop_after = noop_after
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"connects": 0, "reuses": 0, "reconnects": 0, "selects": 0}
+
+    def _connect(self):
+        imap = imaplib.IMAP4_SSL(self.host)
+        imap.login(self.user, self.password)
+        with self._lock:
+            self.stats["connects"] += 1
+        return _PooledConnection(imap)
+
+    def _discard(self, conn):
+        try:
+            conn.imap.logout()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        idle = time.monotonic() - conn.last_used
+        if idle > self.max_idle:
+            return False
+        if idle < self.noop_after:
+            return True
+        try:
+            status, _ = conn.imap.noop()
+            return status == "OK"
+        except CONNECTION_ERRORS + (imaplib.IMAP4.error,):
+            return False
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_healthy(conn):
+                    with self._lock:
+                        self.stats["reuses"] += 1
+                    return conn
+                with self._lock:
+                    self.stats["reconnects"] += 1
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def _select(self, conn, mailbox):
+        if conn.mailbox == mailbox:
+            return
+        status, data = conn.imap.select(mailbox)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+        conn.mailbox = mailbox
+        with self._lock:
+            self.stats["selects"] += 1
+
+    @contextmanager
+    def session(self, mailbox="INBOX"):
+        """
+        Borrow a connection with `mailbox` selected.
+
+        The connection goes back to the pool when the block exits. If the
+        block raises a connection-level error the connection is thrown
+        away instead, so the next caller gets a fresh login.
+
+        Yields:
+            imaplib.IMAP4_SSL: A logged-in connection with `mailbox` selected
+        """
+        conn = self._acquire()
+        broken = False
+        try:
+            self._select(conn, mailbox)
+            yield conn.imap
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def run(self, operation, mailbox="INBOX", retries=1):
+        """
+        Run `operation(imap)` on a pooled connection.
+
+        If the server dropped the connection mid-operation, the call is
+        retried on a new connection up to `retries` times.
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.session(mailbox) as imap:
+                    return operation(imap)
+            except CONNECTION_ERRORS as e:
+                if attempt == retries:
+                    raise
+                print(f"⚠️ IMAP connection lost ({e}), reconnecting...")
+
+    def close(self):
+        """Log out every idle connection and stop pooling new ones."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -0,0 +1,278 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from dotenv import load_dotenv
+from mail_index import tokenize
+
+load_dotenv()
+
+# Answer mechanical commands locally instead of asking the AI which action to run
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") != "0"
+# Classifier probability a pattern match needs before it is trusted
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.9"))
+
+EMAIL_ADDRESS_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+NUMBER_RE = re.compile(r"\d+")
+TRAILING_RE = r"(?:,?\s+please)?\s*[.!?]*$"
+POLITE_RE = r"^(?:(?:please|pls|hey|ok|okay)\s+)?(?:(?:can|could|would|will)\s+you\s+)?(?:please\s+)?"
+MAIL_WORDS = r"(?:e-?mails?|mails?|messages|inbox)"
+SINCE_WORDS = r"(?:\d{4}-\d{2}-\d{2}|today|yesterday|last\s+week)"
+SINCE_WORDS_RE = re.compile(SINCE_WORDS, re.IGNORECASE)
+
+# "show my unread emails from john@x.com since yesterday"
+READ_RE = re.compile(
+    POLITE_RE
+    + r"(?:read|show|check|list|get|fetch|open|display)\s+(?:me\s+)?(?:(?:my|the|all|all\s+my)\s+)?"
+    + r"(?:(?:latest|last|recent|newest)\s+)?(?:(?P<unread>unread|new)\s+)?" + MAIL_WORDS
+    + r"(?:\s+from\s+(?P<sender>[^\s,]+(?:\s+[^\s,]+){0,2}?))?"
+    + r"(?:\s+(?:since|after)\s+(?P<since>" + SINCE_WORDS + r"))?" + TRAILING_RE,
+    re.IGNORECASE
+)
+# "any new emails?", "do I have unread mail"
+UNREAD_RE = re.compile(
+    POLITE_RE + r"(?:do\s+i\s+have\s+)?(?:any\s+)?(?P<unread>unread|new)\s+" + MAIL_WORDS + TRAILING_RE,
+    re.IGNORECASE
+)
+# "find emails about the Stripe invoice", "search for messages from Alice"; the
+# mail word is required so that "find a good restaurant" goes to the AI
+SEARCH_RE = re.compile(
+    POLITE_RE
+    + r"(?:search|find|look\s+for|look\s+up)\s+(?:for\s+)?(?:(?:my|an?|the|any|all)\s+)?"
+    + r"(?:(?P<pick>first|last|oldest|newest|latest)\s+)?" + MAIL_WORDS + r"\s+"
+    + r"(?:(?:about|regarding|on|containing|mentioning|with|for)\s+)?(?P<query>\S.*?)" + TRAILING_RE,
+    re.IGNORECASE
+)
+# "delete 123", "remove email #123", "trash message with id 123"
+DELETE_RE = re.compile(
+    POLITE_RE
+    + r"(?:delete|remove|trash)\s+(?:the\s+)?(?:(?:e-?mail|mail|message)\s+)?(?:(?:with\s+)?(?:the\s+)?(?:id|uid)\s*)?#?"
+    + r"(?P<uid>\d+)" + TRAILING_RE,
+    re.IGNORECASE
+)
+
+# Search pick for "find the first/last email about ..."
+PICKS = {"first": "oldest", "oldest": "oldest", "last": "newest", "newest": "newest", "latest": "newest"}
+
+# Words that mean a sender capture actually swallowed a topic ("from john about invoices")
+NOT_SENDER_WORDS = {"about", "regarding", "with", "containing", "mentioning", "that", "which", "and", "or", "to"}
+
+# Labelled example messages the classifier is trained on at import time.
+# "send_email" and "chat" exist so that messages merely mentioning a
+# command word ("send Bob an email saying delete it") are not routed.
+TRAINING_EXAMPLES = {
+    "read_emails": [
+        "read my emails", "show my inbox", "check my email", "show me my latest emails",
+        "read my unread emails", "list unread messages", "any new emails", "do i have new mail",
+        "show emails from john@example.com", "read emails from alice since yesterday",
+        "get my recent messages", "check my inbox please", "open my mail", "show unread mail from stripe",
+        "fetch my emails since 2025-07-01", "display my new messages", "read the latest emails",
+        "read my emails from last week", "show emails from yesterday", "check my mail from 2025-07-01",
+        "show my unread messages from today"
+    ],
+    "search_emails": [
+        "search emails about stripe payments", "find the invoice email", "look for messages from alice",
+        "search for flight confirmation", "find emails regarding the contract", "find my receipt from amazon",
+        "search my mail for project update", "look up the email about the meeting",
+        "find the first email from paypal", "search for the last message about rent",
+        "find emails mentioning the budget", "search inbox for password reset"
+    ],
+    "delete_email": [
+        "delete 123", "delete email 4521", "remove message 88", "trash email 31",
+        "delete the email with id 77", "please delete message #902", "remove email uid 15", "delete mail 7",
+        "can you delete email 12 please"
+    ],
+    "send_email": [
+        "send an email to bob", "email alice about the meeting", "write to john@example.com",
+        "send a message to my boss saying i will be late", "compose an email to the team",
+        "reply to sarah", "draft an email asking for the invoice", "send bob an email saying delete the old files",
+        "tell alice to find the contract", "write an email to read@example.com"
+    ],
+    "chat": [
+        "hello", "hi there", "how are you", "what can you do", "thanks", "who are you",
+        "what is the weather today", "tell me a joke", "explain quantum computing",
+        "what should i read next", "how do i delete my account", "can you find me a good restaurant",
+        "search the web for news", "summarize this for me", "what time is it"
+    ]
+}
+
+
+def _features(text):
+    """Word and bigram features, with addresses and numbers reduced to placeholders."""
+    text = NUMBER_RE.sub(" 0 ", EMAIL_ADDRESS_RE.sub(" addr ", text or ""))
+    words = tokenize(text)
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class NaiveBayesIntentClassifier:
+    """
+    Multinomial naive Bayes over word and bigram features with add-alpha
+    smoothing. Small enough to train at import and classify a message in
+    microseconds.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.labels = []
+        self._log_priors = {}
+        self._log_likelihoods = {}
+        self._log_unseen = {}
+        self._vocabulary = set()
+
+    def fit(self, examples):
+        """
+        Train on labelled messages.
+
+        Args:
+            examples (dict): Label -> list of example messages
+        """
+        counts = defaultdict(Counter)
+        for label, messages in examples.items():
+            for message in messages:
+                counts[label].update(_features(message))
+        vocabulary = set().union(*counts.values())
+        total_examples = sum(len(messages) for messages in examples.values())
+
+        self.labels = list(examples)
+        for label in self.labels:
+            denominator = sum(counts[label].values()) + self.alpha * len(vocabulary)
+            self._log_priors[label] = math.log(len(examples[label]) / total_examples)
+            self._log_likelihoods[label] = {
+                feature: math.log((count + self.alpha) / denominator) for feature, count in counts[label].items()
+            }
+            self._log_unseen[label] = math.log(self.alpha / denominator)
+        self._vocabulary = vocabulary
+        return self
+
+    def predict_proba(self, text):
+        """Label -> probability for a message; features never seen in training are ignored."""
+        features = [feature for feature in _features(text) if feature in self._vocabulary]
+        scores = {}
+        for label in self.labels:
+            likelihoods, unseen = self._log_likelihoods[label], self._log_unseen[label]
+            scores[label] = self._log_priors[label] + sum(likelihoods.get(feature, unseen) for feature in features)
+        top = max(scores.values())
+        exps = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exps.values())
+        return {label: value / total for label, value in exps.items()}
+
+    def classify(self, text):
+        """Most likely label and its probability."""
+        probabilities = self.predict_proba(text)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+
+classifier = NaiveBayesIntentClassifier().fit(TRAINING_EXAMPLES)
+
+_stats_lock = threading.Lock()
+_stats = {"messages": 0, "routed": 0, "fallbacks": 0, "total_ms": 0.0, "by_action": Counter()}
+
+
+def _since_date(value):
+    """YYYY-MM-DD for a SINCE value: a date as given, or today/yesterday/last week."""
+    value = " ".join(value.lower().split())
+    offsets = {"today": 0, "yesterday": 1, "last week": 7}
+    if value in offsets:
+        return (date.today() - timedelta(days=offsets[value])).isoformat()
+    return value
+
+
+def _search_query(text):
+    """Turn "from Alice Smith" into the from:"Alice Smith" search syntax; other text is kept as is."""
+    match = re.match(r"from\s+(.+)$", text, re.IGNORECASE)
+    if not match:
+        return text
+    sender = match.group(1).strip()
+    return f'from:"{sender}"' if " " in sender else f"from:{sender}"
+
+
+def match_intent(text):
+    """
+    Match a message against the command patterns.
+
+    Returns:
+        dict: The email tool call, {"name": ..., "arguments": {...}}, or None
+    """
+    text = " ".join((text or "").split())
+
+    match = DELETE_RE.match(text)
+    if match:
+        return {"name": "delete_email", "arguments": {"email_id": match.group("uid")}}
+
+    match = READ_RE.match(text) or UNREAD_RE.match(text)
+    if match:
+        filters = {}
+        groups = match.groupdict()
+        sender = groups.get("sender")
+        if sender and SINCE_WORDS_RE.fullmatch(sender):
+            # "emails from last week" is a date, not a sender
+            if groups.get("since"):
+                return None
+            groups["since"], sender = sender, None
+        if sender:
+            if NOT_SENDER_WORDS & set(sender.lower().split()):
+                return None
+            filters["from"] = sender
+        if groups.get("unread"):
+            filters["unread"] = True
+        if groups.get("since"):
+            filters["since"] = _since_date(groups["since"])
+        return {"name": "read_emails", "arguments": filters}
+
+    match = SEARCH_RE.match(text)
+    if match:
+        arguments = {"query": _search_query(match.group("query"))}
+        if match.group("pick"):
+            arguments["pick"] = PICKS[match.group("pick").lower()]
+        return {"name": "search_emails", "arguments": arguments}
+    return None
+
+
+def route_intent(text):
+    """
+    Decide locally whether a chat message is a mechanical email command.
+
+    A message is routed only when a command pattern extracts the action and
+    its arguments and the classifier independently agrees on that action
+    with at least INTENT_MIN_CONFIDENCE; anything else is left to the AI.
+
+    Args:
+        text (str): The user's message
+
+    Returns:
+        dict: The email tool call to run, {"name": ..., "arguments": {...}}, or None
+    """
+    if not INTENT_FAST_PATH:
+        return None
+    start = time.perf_counter()
+    action = match_intent(text)
+    confidence = None
+    if action:
+        label, confidence = classifier.classify(text)
+        if label != action["name"] or confidence < INTENT_MIN_CONFIDENCE:
+            action = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    with _stats_lock:
+        _stats["messages"] += 1
+        _stats["total_ms"] += elapsed_ms
+        if action:
+            _stats["routed"] += 1
+            _stats["by_action"][action["name"]] += 1
+        else:
+            _stats["fallbacks"] += 1
+    if action:
+        print(f"⚡ Intent fast-path: {action['name']} (confidence {confidence:.2f}, {elapsed_ms:.2f} ms)")
+    return action
+
+
+def intent_stats():
+    """How many messages were routed locally vs left to the AI, and the routing time."""
+    with _stats_lock:
+        stats = {**_stats, "by_action": dict(_stats["by_action"])}
+    stats["avg_ms"] = stats["total_ms"] / stats["messages"] if stats["messages"] else None
+    return stats
@@ -0,0 +1,280 @@
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from mail_index import MailIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailbox_state (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    uidnext INTEGER NOT NULL,
+    highestmodseq INTEGER,
+    floor_uid INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    date_ts REAL,
+    snippet TEXT,
+    body TEXT,
+    flags TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (mailbox, uidvalidity, date_ts);
+"""
+
+STATE_FIELDS = ("uidvalidity", "uidnext", "highestmodseq", "floor_uid", "complete", "messages", "synced_at")
+
+
+def _timestamp(date_header):
+    """Parse a Date header into a POSIX timestamp, or None if it is malformed."""
+    if not date_header:
+        return None
+    try:
+        return parsedate_to_datetime(date_header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _row_to_email(row):
+    return {
+        "uid": str(row["uid"]),
+        "subject": row["subject"],
+        "from": row["sender"],
+        "date": row["date"],
+        "snippet": row["snippet"]
+    }
+
+
+class MailCache:
+    """
+    On-disk store of parsed email summaries and bodies.
+
+    Messages are keyed by (mailbox, UIDVALIDITY, UID) so a UIDVALIDITY
+    change on the server invalidates everything cached for that mailbox.
+    `mailbox_state` remembers how far the cache has been synced: the
+    UIDNEXT and HIGHESTMODSEQ seen last time, the lowest UID that was
+    backfilled (`floor_uid`) and whether that backfill covers the whole
+    mailbox (`complete`).
+
+    Each mailbox also gets a full-text MailIndex, built from the stored
+    rows on first use and kept current by every write below.
+
+    All methods are thread-safe; one SQLite connection is shared behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self._indexes = {}
+
+    def search_index(self, mailbox):
+        """Return the full-text index of a mailbox, building it from disk if needed."""
+        with self._lock:
+            index = self._indexes.get(mailbox)
+            if index is not None:
+                return index
+            index = MailIndex()
+            rows = self._db.execute(
+                "SELECT m.* FROM messages m JOIN mailbox_state s "
+                "ON m.mailbox = s.mailbox AND m.uidvalidity = s.uidvalidity WHERE m.mailbox = ?",
+                (mailbox,)
+            ).fetchall()
+            for row in rows:
+                index.add(_row_to_email(row), body=row["body"])
+            self._indexes[mailbox] = index
+            return index
+
+    def _indexed(self, mailbox):
+        """The mailbox index if it has been built already (call with the lock held)."""
+        return self._indexes.get(mailbox)
+
+    def get_state(self, mailbox):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM mailbox_state WHERE mailbox = ?", (mailbox,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def is_fresh(self, mailbox, max_age):
+        """True if the mailbox was synced less than `max_age` seconds ago."""
+        state = self.get_state(mailbox)
+        return bool(state) and time.time() - state["synced_at"] < max_age
+
+    def set_state(self, mailbox, **state):
+        state.setdefault("synced_at", time.time())
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO mailbox_state (mailbox, {', '.join(STATE_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' for _ in STATE_FIELDS)})",
+                (mailbox, *(state[field] for field in STATE_FIELDS))
+            )
+
+    def reset_mailbox(self, mailbox):
+        """Forget everything cached for a mailbox (e.g. after a UIDVALIDITY change)."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages WHERE mailbox = ?", (mailbox,))
+            self._db.execute("DELETE FROM mailbox_state WHERE mailbox = ?", (mailbox,))
+            self._indexes.pop(mailbox, None)
+
+    def upsert_emails(self, mailbox, uidvalidity, emails):
+        """Store email summaries as returned by email_utils, keeping any cached body."""
+        rows = [
+            (
+                mailbox, uidvalidity, int(item["uid"]), item.get("subject"), item.get("from"),
+                item.get("date"), _timestamp(item.get("date")), item.get("snippet"),
+                item.get("full_body"), " ".join(item.get("flags") or [])
+            )
+            for item in emails
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (mailbox, uidvalidity, uid, subject, sender, date, date_ts, snippet, body, flags) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (mailbox, uidvalidity, uid) DO UPDATE SET "
+                "subject = excluded.subject, sender = excluded.sender, date = excluded.date, "
+                "date_ts = excluded.date_ts, snippet = excluded.snippet, "
+                "body = COALESCE(excluded.body, messages.body), flags = excluded.flags",
+                rows
+            )
+            index = self._indexed(mailbox)
+            if index is not None:
+                for item in emails:
+                    index.add(item, body=item.get("full_body"))
+
+    def update_flags(self, mailbox, uidvalidity, flags_by_uid):
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE messages SET flags = ? WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(" ".join(flags), mailbox, uidvalidity, int(uid)) for uid, flags in flags_by_uid.items()]
+            )
+
+    def set_unseen(self, mailbox, uidvalidity, unseen_uids, first_uid, last_uid):
+        """
+        Rewrite the \\Seen flag of cached messages in [first_uid, last_uid]
+        from the result of a server-side UNSEEN search over that range.
+        """
+        unseen = {int(uid) for uid in unseen_uids}
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT uid, flags FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid BETWEEN ? AND ?",
+                (mailbox, uidvalidity, first_uid, last_uid)
+            ).fetchall()
+            updates = []
+            for row in rows:
+                flags = [flag for flag in row["flags"].split() if flag != "\\Seen"]
+                if row["uid"] not in unseen:
+                    flags.append("\\Seen")
+                if " ".join(flags) != row["flags"]:
+                    updates.append((" ".join(flags), mailbox, uidvalidity, row["uid"]))
+            self._db.executemany(
+                "UPDATE messages SET flags = ? WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                updates
+            )
+
+    def cached_uids(self, mailbox, uidvalidity):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid FROM messages WHERE mailbox = ? AND uidvalidity = ?",
+                (mailbox, uidvalidity)
+            ).fetchall()
+        return {row["uid"] for row in rows}
+
+    def remove(self, mailbox, uidvalidity, uids):
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(mailbox, uidvalidity, int(uid)) for uid in uids]
+            )
+            index = self._indexed(mailbox)
+            if index is not None:
+                for uid in uids:
+                    index.remove(uid)
+
+    def get_emails(self, mailbox, uidvalidity, uids):
+        """Return cached summaries for `uids`, keyed by UID string."""
+        if not uids:
+            return {}
+        placeholders = ", ".join("?" for _ in uids)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid IN ({placeholders})",
+                (mailbox, uidvalidity, *(int(uid) for uid in uids))
+            ).fetchall()
+        return {str(row["uid"]): _row_to_email(row) for row in rows}
+
+    def query(self, mailbox, uidvalidity, sender=None, unread=False, since_ts=None,
+              subject_contains=None, min_uid=None, oldest_first=False, limit=5):
+        """
+        Filter cached summaries the way IMAP SEARCH would.
+
+        Pass the mailbox's `floor_uid` as `min_uid` when the backfill is not
+        complete, so stray older messages cached by one-off fetches cannot
+        stand in for uncached ones.
+
+        Returns:
+            list: Matching email dicts in chronological order, at most `limit`
+                  (taken from the newest end unless `oldest_first`)
+        """
+        clauses = ["mailbox = ?", "uidvalidity = ?"]
+        params = [mailbox, uidvalidity]
+        if min_uid is not None:
+            clauses.append("uid >= ?")
+            params.append(min_uid)
+        if sender:
+            clauses.append("INSTR(LOWER(sender), ?) > 0")
+            params.append(sender.lower())
+        if unread:
+            clauses.append("(' ' || flags || ' ') NOT LIKE '% \\Seen %'")
+        if since_ts is not None:
+            clauses.append("date_ts >= ?")
+            params.append(since_ts)
+        if subject_contains:
+            clauses.append("INSTR(LOWER(subject), ?) > 0")
+            params.append(subject_contains.lower())
+        order = "ASC" if oldest_first else "DESC"
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM messages WHERE {' AND '.join(clauses)} ORDER BY uid {order} LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        emails = [_row_to_email(row) for row in rows]
+        return emails if oldest_first else emails[::-1]
+
+    def get_body(self, mailbox, uidvalidity, uid):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (mailbox, uidvalidity, int(uid))
+            ).fetchone()
+        return row["body"] if row else None
+
+    def set_body(self, mailbox, uidvalidity, uid, body):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE messages SET body = ? WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (body, mailbox, uidvalidity, int(uid))
+            )
+            index = self._indexed(mailbox)
+            row = self._db.execute(
+                "SELECT * FROM messages WHERE mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (mailbox, uidvalidity, int(uid))
+            ).fetchone()
+            if index is not None and row is not None:
+                index.add(_row_to_email(row), body=body)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
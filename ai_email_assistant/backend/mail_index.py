@@ -0,0 +1,184 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Field name -> BM25 weight. "text" in a query means "any field".
+FIELD_WEIGHTS = {"subject": 2.0, "from": 1.5, "body": 1.0}
+FIELD_ALIASES = {"subject": ("subject",), "from": ("from",), "body": ("body",), "text": tuple(FIELD_WEIGHTS)}
+
+# One query clause: optional field prefix, then a quoted phrase or a bare word
+CLAUSE_RE = re.compile(r'(?:(subject|from|body|text):)?(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+
+
+def tokenize(text):
+    """Split text into case-folded word tokens."""
+    return TOKEN_RE.findall((text or "").casefold())
+
+
+def parse_query(query):
+    """
+    Parse a search query into alternatives of clauses.
+
+    The syntax matches email_utils.build_search_criteria: alternatives are
+    separated by an upper-case OR, each clause is a word or a quoted phrase
+    with an optional subject:/from:/body:/text: prefix.
+
+    Returns:
+        list: One list of (fields, tokens) clauses per alternative
+    """
+    alternatives = []
+    for alternative in re.split(r"\s+OR\s+", query.strip()):
+        clauses = []
+        for field, quoted, bare in CLAUSE_RE.findall(alternative):
+            fields = FIELD_ALIASES[field.lower()] if field else FIELD_ALIASES["text"]
+            if quoted:
+                tokens = tokenize(quoted)
+                if tokens:
+                    clauses.append((fields, tokens))
+            else:
+                clauses.extend((fields, [token]) for token in tokenize(bare))
+        if clauses:
+            alternatives.append(clauses)
+    return alternatives
+
+
+class MailIndex:
+    """
+    In-memory inverted index over email subjects, senders and bodies.
+
+    Postings are kept per field as term -> {uid: [positions]}, which
+    gives BM25 term statistics and lets phrase clauses check adjacency.
+    Every clause of an alternative must match (AND); alternatives are
+    OR-ed and a document keeps its best score. Scores are the sum over
+    clauses and fields of field-weighted BM25.
+
+    Thread-safe: all access goes through one lock.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = {field: defaultdict(dict) for field in FIELD_WEIGHTS}
+            self._lengths = {field: {} for field in FIELD_WEIGHTS}
+            self._total_length = dict.fromkeys(FIELD_WEIGHTS, 0)
+            self._doc_terms = {}
+            self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, email_data, body=None):
+        """
+        Index (or re-index) one email.
+
+        Args:
+            email_data (dict): Email summary with uid, subject, from, date and snippet
+            body (str, optional): Decoded body; the snippet is indexed when missing
+        """
+        uid = str(email_data["uid"])
+        texts = {
+            "subject": email_data.get("subject"),
+            "from": email_data.get("from"),
+            "body": body if body is not None else email_data.get("snippet")
+        }
+        with self._lock:
+            self._remove(uid)
+            self._docs[uid] = {key: email_data.get(key) for key in ("uid", "subject", "from", "date", "snippet")}
+            self._docs[uid]["uid"] = uid
+            self._doc_terms[uid] = {}
+            for field, text in texts.items():
+                tokens = tokenize(text)
+                positions = defaultdict(list)
+                for position, token in enumerate(tokens):
+                    positions[token].append(position)
+                for token, token_positions in positions.items():
+                    self._postings[field][token][uid] = token_positions
+                self._doc_terms[uid][field] = list(positions)
+                self._lengths[field][uid] = len(tokens)
+                self._total_length[field] += len(tokens)
+
+    def remove(self, uid):
+        with self._lock:
+            self._remove(str(uid))
+
+    def _remove(self, uid):
+        if uid not in self._docs:
+            return
+        del self._docs[uid]
+        for field, tokens in self._doc_terms.pop(uid).items():
+            postings = self._postings[field]
+            for token in tokens:
+                del postings[token][uid]
+                if not postings[token]:
+                    del postings[token]
+            self._total_length[field] -= self._lengths[field].pop(uid, 0)
+
+    def _clause_matches(self, field, tokens):
+        """Return {uid: term frequency} for a word or phrase clause in one field."""
+        postings = self._postings[field]
+        if any(token not in postings for token in tokens):
+            return {}
+        if len(tokens) == 1:
+            return {uid: len(positions) for uid, positions in postings[tokens[0]].items()}
+
+        candidates = set(postings[tokens[0]])
+        for token in tokens[1:]:
+            candidates &= set(postings[token])
+        matches = {}
+        for uid in candidates:
+            starts = set(postings[tokens[0]][uid])
+            for offset, token in enumerate(tokens[1:], 1):
+                starts &= {position - offset for position in postings[token][uid]}
+                if not starts:
+                    break
+            if starts:
+                matches[uid] = len(starts)
+        return matches
+
+    def _bm25(self, field, frequencies):
+        doc_count = len(self._docs)
+        idf = math.log(1 + (doc_count - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+        average_length = self._total_length[field] / doc_count or 1
+        weight = FIELD_WEIGHTS[field]
+        scores = {}
+        for uid, frequency in frequencies.items():
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[field][uid] / average_length)
+            scores[uid] = weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query, limit=25):
+        """
+        Rank indexed emails against a query.
+
+        Returns:
+            list: Email dicts, best match first (newer UIDs win ties)
+        """
+        best = {}
+        with self._lock:
+            if not self._docs:
+                return []
+            for clauses in parse_query(query):
+                scores = None
+                for fields, tokens in clauses:
+                    clause_scores = defaultdict(float)
+                    for field in fields:
+                        for uid, score in self._bm25(field, self._clause_matches(field, tokens)).items():
+                            clause_scores[uid] += score
+                    if scores is None:
+                        scores = dict(clause_scores)
+                    else:
+                        scores = {uid: scores[uid] + clause_scores[uid] for uid in scores if uid in clause_scores}
+                    if not scores:
+                        break
+                for uid, score in (scores or {}).items():
+                    best[uid] = max(best.get(uid, 0.0), score)
+            ranked = sorted(best, key=lambda uid: (best[uid], int(uid)), reverse=True)[:limit]
+            return [dict(self._docs[uid]) for uid in ranked]
@@ -1,15 +1,35 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from ai_utils import ask_ai_with_history
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from ai_utils import (
+    ask_ai_with_history_async,
+    stream_ai_events,
+    close_ai_client,
+    get_llm_stats,
+    sse_event,
+    function_tool,
+    parse_tool_call,
+    tool_call_message,
+    tool_result_message
+)
 from email_utils import (
     send_email,
     read_emails,
     search_emails,
     delete_email,
-    format_emails_as_text
+    fetch_email_body,
+    format_emails_as_text,
+    close_imap_pool
 )
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.session_store import create_session_store
+from intent_router import route_intent, intent_stats
+from shared.context_window import context_messages, compact_history, clip_to_tokens, PAYLOAD_TOKEN_BUDGET
+from shared.resilience import upstream_stats
+import asyncio
 import json
-import re
+import os
 
 app = FastAPI()
 
@@ -22,139 +42,272 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize global variables
-chat_history = [
-    {"role": "system", "content": (
-        "You are a smart AI assistant. "
-        "You help the user send, read, search, and delete emails. "
-        "If the user asks for anything non-email-related, talk like you don't even know like you are an ai email agent, do research for the user and just assist out like a futuristic ai.\n\n"
-        "To send an email:\n"
-        "{\n"
-        "  \"action\": \"send_email\",\n"
-        "  \"to\": \"recipient@example.com\",\n"
-        "  \"subject\": \"Subject line\",\n"
-        "  \"body\": \"Email body\"\n"
-        "}\n\n"
-        "To read:\n"
-        "{\n"
-        "  \"action\": \"read_emails\",\n"
-        "  \"filters\": {\"from\": \"john@example.com\", \"unread\": true, \"since\": \"2025-07-01\"}\n"
-        "}\n\n"
-        "To search:\n"
-        "{\n"
-        "  \"action\": \"search_emails\",\n"
-        "  \"query\": \"Stripe payments\"\n"
-        "}\n\n"
-        "To delete:\n"
-        "{\n"
-        "  \"action\": \"delete_email\",\n"
-        "  \"email_id\": \"12345\"\n"
-        "}\n\n"
-        "If the user asks a non-email-related question, respond with a friendly message like 'I am an email assistant. How can I assist you with emails today?' or just talk to the user like you're not an email assistant if they ask, but always remind him or her that your objective is to send emails, read emails, search emails, and delete emails."
-    )}
-]
+@app.on_event("shutdown")
+async def shutdown_clients():
+    """Log out of pooled IMAP connections and close the session store and LLM client when the server stops."""
+    await run_in_threadpool(close_imap_pool)
+    await run_in_threadpool(sessions.close)
+    await close_ai_client()
+
+# Conversations are kept per session (chat history, pending draft and search)
+sessions = create_session_store(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3"))
+
+SYSTEM_MESSAGE = {"role": "system", "content": (
+    "You are a smart AI assistant. "
+    "You help the user send, read, search, and delete emails. "
+    "If the user asks for anything non-email-related, talk like you don't even know like you are an ai email agent, do research for the user and just assist out like a futuristic ai.\n\n"
+    "Use the send_email, read_emails, search_emails and delete_email tools for email actions. Call them directly instead of "
+    "describing them, and call several at once when the user asks for several things.\n"
+    "Search queries: plain words search email subjects and text, best match first. Prefix terms with from:, subject: or body: to search other fields, "
+    "quote multi-word values (from:\"Stripe Billing\"), and join alternatives with OR.\n\n"
+    "If the user asks a non-email-related question, respond with a friendly message like 'I am an email assistant. How can I assist you with emails today?' or just talk to the user like you're not an email assistant if they ask, but always remind him or her that your objective is to send emails, read emails, search emails, and delete emails."
+)}
 
+# Email actions the AI can call; arguments are type-checked against these schemas before running
+EMAIL_TOOLS = [
+    function_tool(
+        "send_email",
+        "Draft an email. The user confirms it with 'send' before it goes out.",
+        {
+            "to": {"type": "string", "description": "Recipient address"},
+            "subject": {"type": "string", "description": "Subject line"},
+            "body": {"type": "string", "description": "Email body"}
+        },
+        required=("to", "body")
+    ),
+    function_tool(
+        "read_emails",
+        "List the latest emails, optionally filtered.",
+        {
+            "from": {"type": "string", "description": "Sender address or name"},
+            "unread": {"type": "boolean", "description": "Only unread emails"},
+            "since": {"type": "string", "description": "Only emails since this date (YYYY-MM-DD)"}
+        }
+    ),
+    function_tool(
+        "search_emails",
+        "Search emails and read the best match so you can answer about it.",
+        {
+            "query": {"type": "string", "description": "Search query, e.g. 'Stripe payments' or from:\"Stripe Billing\""},
+            "pick": {"type": "string", "enum": ["best", "oldest", "newest"],
+                     "description": "Which match to read: best (default), oldest or newest"}
+        },
+        required=("query",)
+    ),
+    function_tool(
+        "delete_email",
+        "Delete an email by its ID.",
+        {"email_id": {"type": "string", "description": "The email's ID"}},
+        required=("email_id",)
+    )
+]
 
-# Global variables for managing email drafts and pending searches
-pending_email_draft = None
-pending_search_query = None  # Initialize the variable here
+def chat_messages(session):
+    """The messages sent to the AI: system prompt, digest of older turns and the recent history."""
+    return context_messages(SYSTEM_MESSAGE, session)
 
-def extract_json(text):
-    """Extract first JSON block from a string."""
-    if "{" not in text:
+def fast_path_reply(user_input):
+    """
+    The tool call for a mechanical command recognised locally (see
+    intent_router), as an AI reply, or None when the AI has to decide.
+    """
+    action = route_intent(user_input)
+    if action is None:
         return None
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        json_str = match.group(0)
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            json_str = json_str.replace("'", '"')
-            return json.loads(json_str)
-    return None
+    call = parse_tool_call("local_0", action["name"], json.dumps(action["arguments"]), EMAIL_TOOLS)
+    return {"content": "", "tool_calls": [call]}
 
 
 @app.post("/chat")
 async def chat_endpoint(req: Request):
-    global pending_email_draft, pending_search_query
     data = await req.json()
     user_input = data.get("message", "")
+    session = await run_in_threadpool(sessions.load, data.get("session_id"))
+
+    try:
+        pending_reply = await handle_pending_flows(session, user_input)
+        if pending_reply is not None:
+            return {**pending_reply, "session_id": session.id}
+
+        # Normal flow
+        session.history.append({"role": "user", "content": user_input})
+        ai_reply = fast_path_reply(user_input) or await ask_ai_with_history_async(chat_messages(session), EMAIL_TOOLS)
+        return {**await complete_chat_turn(session, user_input, ai_reply), "session_id": session.id}
+    finally:
+        await run_in_threadpool(sessions.save, session)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: Request):
+    """
+    Streaming variant of /chat, sent as server-sent events:
+    - token: {"text": ...} for each piece of the AI reply as it is generated
+    - done: the same payload /chat returns; its reply replaces the streamed text
+
+    Email actions start as soon as their tool call has streamed in; their
+    result arrives in the done event. Commands answered by the intent
+    fast-path send no tokens, only the done event.
+    """
+    data = await req.json()
+    user_input = data.get("message", "")
+    session = await run_in_threadpool(sessions.load, data.get("session_id"))
+
+    async def events():
+        try:
+            pending_reply = await handle_pending_flows(session, user_input)
+            if pending_reply is not None:
+                yield sse_event("done", {**pending_reply, "session_id": session.id})
+                return
+
+            session.history.append({"role": "user", "content": user_input})
+            ai_reply = fast_path_reply(user_input)
+            started = {}
+            if ai_reply is None:
+                reply_parts, tool_calls = [], []
+                async for kind, value in stream_ai_events(chat_messages(session), EMAIL_TOOLS):
+                    if kind == "text":
+                        reply_parts.append(value)
+                        yield sse_event("token", {"text": value})
+                    else:
+                        tool_calls.append(value)
+                        started[value["id"]] = asyncio.create_task(run_tool_call(session, value))
+                ai_reply = {"content": "".join(reply_parts), "tool_calls": tool_calls}
+
+            try:
+                result = await complete_chat_turn(session, user_input, ai_reply, started)
+            except Exception as e:
+                result = {"reply": f"⚠️ Something went wrong: {e}"}
+            yield sse_event("done", {**result, "session_id": session.id})
+        finally:
+            await run_in_threadpool(sessions.save, session)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def handle_pending_flows(session, user_input):
+    """Answer the message from a pending draft or search, or return None if nothing is pending."""
+    pending_email_draft = session.state.get("pending_email_draft")
 
     # Handle pending send flow
     if pending_email_draft:
         if user_input.strip().lower() == "send":
             try:
-                send_email(
+                await run_in_threadpool(
+                    send_email,
                     pending_email_draft["to"],
                     pending_email_draft.get("subject", ""),
                     pending_email_draft["body"]
                 )
                 response_text = f"✅ Email sent to {pending_email_draft['to']}!"
-                pending_email_draft = None
+                session.state.pop("pending_email_draft", None)
                 return {"reply": response_text}
             except Exception as e:
                 return {"reply": f"⚠️ Failed to send email: {e}"}
         elif user_input.strip().lower() == "edit":
-            pending_email_draft = None
+            session.state.pop("pending_email_draft", None)
             return {"reply": "✍️ Draft cleared. What would you like the email to say instead?"}
         else:
             return {"reply": "💡 You have a draft pending. Type 'send' to send it or 'edit' to start over."}
 
     # Handle pending search flow
-    if pending_search_query is not None:
+    if session.state.get("pending_search_query") is not None:
         query = user_input.strip()
-        results = search_emails(query, first_only=False, last_only=False)
-        pending_search_query = None
+        results = await run_in_threadpool(search_emails, query, first_only=False, last_only=False)
+        session.state.pop("pending_search_query", None)
         return {"reply": format_emails_as_text(results)}
 
-    # Normal flow
-    chat_history.append({"role": "user", "content": user_input})
-    ai_reply = ask_ai_with_history(chat_history)
-
-    if "⚠️ Error" in ai_reply:
-        return {"reply": ai_reply}  # Display error message to user
-
-    chat_history.append({"role": "assistant", "content": ai_reply})
-
-    # Try to parse JSON for email actions
-    email_data = extract_json(ai_reply)
-    if email_data:
-        action = email_data.get("action")
-        if action == "send_email":
-            if email_data.get("to") and email_data.get("body"):
-                pending_email_draft = email_data
-                return {"reply": (
-                    f"📄 Draft ready:\n\n"
-                    f"To: {email_data['to']}\n"
-                    f"Subject: {email_data.get('subject', '')}\n"
-                    f"Body: {email_data['body']}\n\n"
-                    f"✅ Type 'send' to send this email, or 'edit' to change it."
-                )}
-            else:
-                return {"reply": "⚠️ Missing recipient or body. Please clarify."}
-
-        elif action == "read_emails":
-            filters = email_data.get("filters", {})
-            emails = read_emails(filters)
+    return None
+
+async def run_tool_call(session, call):
+    """
+    Run one email tool call.
+
+    Returns:
+        dict: "reply" (text for the user) or "content" (a result the AI answers from)
+    """
+    if call["error"]:
+        print(f"⚠️ Tool call {call['name']} not run: {call['error']}")
+        if call["name"] == "send_email":
+            return {"reply": "⚠️ Missing recipient or body. Please clarify."}
+        return {"content": f"ERROR: {call['error']}. Ask the user for whatever is missing."}
+    arguments = call["arguments"]
+    try:
+        if call["name"] == "send_email":
+            session.state["pending_email_draft"] = arguments
+            return {"reply": (
+                f"📄 Draft ready:\n\n"
+                f"To: {arguments['to']}\n"
+                f"Subject: {arguments.get('subject', '')}\n"
+                f"Body: {arguments['body']}\n\n"
+                f"✅ Type 'send' to send this email, or 'edit' to change it."
+            )}
+
+        if call["name"] == "read_emails":
+            emails = await run_in_threadpool(read_emails, arguments)
             return {"reply": format_emails_as_text(emails)}
 
-        elif action == "search_emails":
-            query = email_data.get("query", "")
-            first_only = "first" in user_input.lower() or "oldest" in user_input.lower() or "sort" in email_data
-            last_only = "last" in user_input.lower() or "newest" in email_data
-            results = search_emails(query, first_only=first_only, last_only=last_only)
-
-            if results:
-                email_to_analyze = results[0]  # Pick the first result
-                email_body = email_to_analyze.get("full_body", "")
-                ai_response = ask_ai_with_history(chat_history + [{"role": "user", "content": email_body}])
-                return {"reply": ai_response}
-
-            return {"reply": "📭 No emails found."}
-
-        elif action == "delete_email":
-            uid = email_data.get("email_id")
-            result = delete_email(uid)
-            return {"reply": result}
-    
-    return {"reply": ai_reply}
+        if call["name"] == "search_emails":
+            pick = arguments.get("pick", "best")
+            results = await run_in_threadpool(
+                search_emails, arguments["query"], first_only=pick == "oldest", last_only=pick == "newest"
+            )
+            if not results:
+                return {"reply": "📭 No emails found."}
+            email_to_analyze = results[0]  # Pick the first result
+            email_body = await run_in_threadpool(fetch_email_body, email_to_analyze["uid"])
+            # The body is sent for this answer only and never stored in the history
+            email_body = clip_to_tokens(email_body, PAYLOAD_TOKEN_BUDGET)
+            return {"content": (
+                f"Subject: {email_to_analyze['subject']}\nFrom: {email_to_analyze['from']}\n"
+                f"Date: {email_to_analyze['date']}\n\n{email_body}"
+            )}
+
+        if call["name"] == "delete_email":
+            return {"reply": await run_in_threadpool(delete_email, arguments["email_id"])}
+    except Exception as e:
+        print(f"❌ Error running {call['name']}: {e}")
+        return {"reply": f"⚠️ Something went wrong: {e}"}
+
+async def complete_chat_turn(session, user_input, ai_reply, started=None):
+    """Run the email tools the AI called, if any, and return the /chat response payload."""
+    content = ai_reply["content"]
+    if "⚠️ Error" in content:
+        return {"reply": content}  # Display error message to user
+
+    reply = content
+    tool_calls = ai_reply["tool_calls"]
+    if tool_calls:
+        # Independent actions run at once; calls started while streaming are awaited
+        started = started or {}
+        outcomes = await asyncio.gather(*(started.get(call["id"]) or run_tool_call(session, call) for call in tool_calls))
+        replies = [outcome["reply"] for outcome in outcomes if "reply" in outcome]
+        if len(replies) < len(outcomes):
+            # Emails found by a search are sent for this answer only
+            answer = await ask_ai_with_history_async(
+                chat_messages(session) + [tool_call_message(content, tool_calls)] + [
+                    tool_result_message(call, outcome.get("content") or outcome["reply"])
+                    for call, outcome in zip(tool_calls, outcomes)
+                ],
+                EMAIL_TOOLS,
+                tool_choice="none"
+            )
+            replies.append(answer["content"])
+        reply = "\n\n".join(part for part in [content.strip(), *replies] if part)
+
+    session.history.append({"role": "assistant", "content": reply})
+    compact_history(session)
+    return {"reply": reply}
+
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint that also reports LLM call latency"""
+    return {
+        "status": "healthy",
+        "llm": get_llm_stats(),
+        "intents": intent_stats(),
+        "upstreams": upstream_stats(),
+        "sessions": sessions.stats
+    }
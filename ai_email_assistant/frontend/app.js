@@ -2,6 +2,9 @@ const chatBox = document.getElementById('chat-box');
 const userInput = document.getElementById('user-input');
 const sendButton = document.querySelector('button');
 
+// ✅ The backend keeps one conversation per session id; remember ours across reloads
+let sessionId = localStorage.getItem('emailSessionId');
+
 async function sendMessage() {
   const message = userInput.value.trim();
   if (!message) return;
@@ -13,18 +16,33 @@ async function sendMessage() {
   const aiBubble = addLoadingBubble();
 
   try {
-    const response = await fetch('https://ai-project-email-assistant-backend.onrender.com/chat', {
+    const response = await fetch('https://ai-project-email-assistant-backend.onrender.com/chat/stream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ message })
+      body: JSON.stringify({ message, session_id: sessionId })
     });
 
-    const data = await response.json();
-    typeWriter(aiBubble, data.reply, () => {
-      disableInput(false);
-      userInput.focus();
-      playReplySound();
+    // Tokens are shown as they arrive; the final reply replaces them
+    let streamedText = '';
+    let reply = null;
+    await readEventStream(response, (eventName, data) => {
+      if (eventName === 'token') {
+        streamedText += data.text;
+        updateMessage(aiBubble, streamedText);
+      } else if (eventName === 'done') {
+        reply = data.reply;
+        if (data.session_id && data.session_id !== sessionId) {
+          sessionId = data.session_id;
+          localStorage.setItem('emailSessionId', sessionId);
+        }
+      }
     });
+
+    if (reply === null) throw new Error('Stream ended without a reply');
+    updateMessage(aiBubble, reply);
+    disableInput(false);
+    userInput.focus();
+    playReplySound();
   } catch (err) {
     updateMessage(aiBubble, '❌ Could not reach the server.');
     disableInput(false);
@@ -32,6 +50,33 @@ async function sendMessage() {
   }
 }
 
+// ✅ Read a server-sent event stream, calling onEvent(name, data) per event
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      if (data) onEvent(eventName, JSON.parse(data));
+    }
+  }
+}
+
 function disableInput(state) {
   userInput.disabled = state;
   sendButton.disabled = state;
@@ -64,21 +109,6 @@ function updateMessage(element, newText) {
   chatBox.scrollTop = chatBox.scrollHeight;
 }
 
-function typeWriter(element, text, callback, i = 0) {
-  const base = `<strong>AI:</strong> `;
-  const htmlContent = marked.parse(text);
-
-  if (i < htmlContent.length) {
-    element.innerHTML = base + htmlContent.substring(0, i + 3);
-    chatBox.scrollTop = chatBox.scrollHeight;
-    setTimeout(() => typeWriter(element, text, callback, i + 3), 70);
-  } else {
-    element.innerHTML = base + htmlContent;
-    chatBox.scrollTop = chatBox.scrollHeight;
-    if (callback) callback();
-  }
-}
-
 function playReplySound() {
   const audio = new Audio("https://freesound.org/data/previews/341/341695_5260876-lq.mp3");
   audio.play();
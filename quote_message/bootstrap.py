@@ -0,0 +1,13 @@
+"""Make the repository's shared package importable and load this app's .env before it is imported."""
+import os
+import sys
+from dotenv import load_dotenv
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(APP_DIR)
+
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+# The shared modules read their settings when imported, so this app's .env must be loaded first
+load_dotenv(os.path.join(APP_DIR, ".env"))
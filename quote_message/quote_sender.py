@@ -6,6 +6,8 @@ from openai import OpenAI
 import schedule
 from email.mime.text import MIMEText
 import smtplib
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.resilience import get_upstream, CircuitOpenError
 
 # Load secrets
 load_dotenv()
@@ -19,6 +21,10 @@ client = OpenAI(
 # Telegram credentials
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Sending is not idempotent: only retry when Telegram never got the message or refused it (429)
+telegram = get_upstream("telegram", timeout=10.0, retries=3)
 
 # Gmail credentials
 SENDER_EMAIL = os.getenv("EMAIL_ADDRESS")
@@ -42,12 +48,19 @@ def generate_quote():
 
 def send_to_telegram(message):
     """Send the quote to Telegram."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {
         "chat_id": CHAT_ID,
         "text": message
     }
-    response = requests.post(url, data=payload)
+    try:
+        response = telegram.call(
+            requests.post, url, data=payload, timeout=telegram.timeout,
+            idempotent=False, retry_if=lambda response: response.status_code == 429
+        )
+    except (requests.RequestException, CircuitOpenError) as e:
+        print("❌ Failed to send message:", e)
+        return
     if response.ok:
         print("✅ Quote sent to Telegram.")
     else:
@@ -0,0 +1,9 @@
+"""
+Modules used by more than one app: the OpenRouter chat client, upstream
+resilience, session storage, the context-window budget and the AI
+response cache.
+
+Each app imports them as `shared.<module>` after importing its own
+bootstrap module, which puts the repository root on sys.path and loads
+the app's .env first (the modules read their settings at import time).
+"""
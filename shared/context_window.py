@@ -0,0 +1,150 @@
+import math
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Token budget for the conversation history sent with each request (the
+# system message comes on top); older turns are folded into a digest.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", "400"))
+# Answered messages longer than this are cut down to an excerpt
+BULKY_MESSAGE_TOKENS = int(os.getenv("BULKY_MESSAGE_TOKENS", "400"))
+EXCERPT_TOKENS = 120
+# Cap for a one-off payload (e.g. an email body) sent alongside the history
+PAYLOAD_TOKEN_BUDGET = int(os.getenv("PAYLOAD_TOKEN_BUDGET", "2000"))
+DIGEST_LINE_TOKENS = 40
+# The latest exchanges are always sent in full
+KEEP_RECENT_MESSAGES = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+# How tool results are written into prompts: "compact" (pipe-separated rows
+# under a one-line legend) or "markdown" (labelled blocks)
+PROMPT_FORMAT = os.getenv("PROMPT_FORMAT", "compact").strip().lower()
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _ENCODING = None
+
+# Fallback estimate: a token per short word, long words split every 4 characters,
+# one per punctuation mark
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+_prompt_tokens = {}
+_prompt_tokens_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Count the tokens of `text` locally (exactly with tiktoken, estimated otherwise)."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return sum(math.ceil(len(piece) / 4) for piece in _PIECE_RE.findall(text))
+
+
+def measure_prompt(label, text):
+    """Count the tokens of a prompt block, add them to the per-label totals and return the block."""
+    tokens = count_tokens(text)
+    with _prompt_tokens_lock:
+        totals = _prompt_tokens.setdefault(label, {"calls": 0, "tokens": 0})
+        totals["calls"] += 1
+        totals["tokens"] += tokens
+    print(f"🧮 {label}: {tokens} tokens")
+    return text
+
+
+def prompt_token_stats():
+    """Per-label prompt block sizes: calls, total and average tokens."""
+    with _prompt_tokens_lock:
+        return {
+            label: {**totals, "average": round(totals["tokens"] / totals["calls"])}
+            for label, totals in _prompt_tokens.items()
+        }
+
+
+def clip_to_tokens(text, max_tokens, marker=" …[trimmed]"):
+    """Cut `text` down to roughly `max_tokens` tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text, disallowed_special=())[:max_tokens]) + marker
+    kept = 0
+    for match in _PIECE_RE.finditer(text):
+        kept += math.ceil(len(match.group()) / 4)
+        if kept > max_tokens:
+            return text[:match.start()].rstrip() + marker
+    return text
+
+
+def _digest_line(message):
+    speaker = "User" if message["role"] == "user" else "Assistant"
+    text = " ".join((message.get("content") or "").split())
+    return f"- {speaker}: {clip_to_tokens(text, DIGEST_LINE_TOKENS, marker=' …')}"
+
+
+def compact_history(session, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Keep a session's history within a token budget.
+
+    Two passes, both rewriting `session.history` in place:
+    1. Answered messages outside the last KEEP_RECENT_MESSAGES that are
+       longer than BULKY_MESSAGE_TOKENS (search results, email listings)
+       are cut to a short excerpt, so a bulky payload is sent in full only
+       while it is being discussed.
+    2. While the history is over `budget`, the oldest messages are removed
+       and summarized as one line each in a rolling digest kept in
+       `session.state["digest"]`, itself capped at DIGEST_TOKEN_BUDGET.
+
+    Args:
+        session (Session): The conversation to compact
+        budget (int): Maximum history tokens, digest included
+
+    Returns:
+        int: Tokens of the compacted history plus digest
+    """
+    history = session.history
+    for index, message in enumerate(history[:-KEEP_RECENT_MESSAGES]):
+        content = message.get("content") or ""
+        if count_tokens(content) > BULKY_MESSAGE_TOKENS:
+            history[index] = {**message, "content": clip_to_tokens(content, EXCERPT_TOKENS)}
+
+    digest_lines = session.state.get("digest") or []
+    digest_tokens = count_tokens("\n".join(digest_lines))
+    sizes = [count_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS for message in history]
+    total = sum(sizes)
+
+    dropped = 0
+    while total + digest_tokens > budget and len(history) - dropped > 1:
+        digest_lines.append(_digest_line(history[dropped]))
+        total -= sizes[dropped]
+        dropped += 1
+        digest_tokens = count_tokens("\n".join(digest_lines))
+        while digest_tokens > DIGEST_TOKEN_BUDGET and len(digest_lines) > 1:
+            digest_lines.pop(0)
+            digest_tokens = count_tokens("\n".join(digest_lines))
+
+    if dropped:
+        del history[:dropped]
+        session.state["digest"] = digest_lines
+    return total + digest_tokens
+
+
+def context_messages(system_message, session, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Compact the session and build the messages to send: the system message,
+    the digest of earlier turns (if any) and the recent history.
+    """
+    tokens = compact_history(session, budget)
+    messages = [system_message]
+    if session.state.get("digest"):
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation:\n" + "\n".join(session.state["digest"])
+        })
+    messages.extend(session.history)
+    print(f"🧮 History tokens: {tokens} (budget {budget})")
+    return messages
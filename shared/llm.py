@@ -0,0 +1,457 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import httpx
+from dotenv import load_dotenv
+from shared.resilience import get_upstream, retryable_status, CircuitOpenError
+
+load_dotenv()
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Connection pool and timeout tuning for the OpenRouter client
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+# Retries for failed or rate-limited calls, and the circuit breaker in front of OpenRouter
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+# Send a duplicate of a non-streamed call still unanswered after this many seconds
+# (then after the 95th percentile of recent latencies; "0" turns hedging off)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "10"))
+
+# Errors that end a call: the upstream failed or its circuit breaker is open
+LLM_ERRORS = (httpx.HTTPError, TimeoutError, CircuitOpenError)
+
+try:
+    import h2  # noqa: F401  (httpx only needs it to be importable)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMClient:
+    """
+    Long-lived OpenRouter chat client.
+
+    One async httpx client is created up front and reused
+    for every call, so DNS, TCP and TLS setup are paid once per pooled
+    connection instead of once per chat turn. HTTP/2 is used when the h2
+    package is installed, otherwise HTTP/1.1 keep-alive.
+
+    Every call is timed; `stats()` reports call counts and latencies.
+    Calls go through the "llm" upstream policy (see shared.resilience.Upstream):
+    transient failures and 429/5xx responses are retried with backoff, a
+    failing OpenRouter trips a circuit breaker that fails calls fast, and
+    slow non-streamed calls are hedged with a duplicate request.
+    """
+
+    def __init__(self, url, api_key, model, timeout=LLM_TIMEOUT, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 max_connections=LLM_MAX_CONNECTIONS, keepalive_expiry=LLM_KEEPALIVE_EXPIRY, http2=LLM_HTTP2):
+        self.url = url
+        self.model = model
+        options = {
+            "headers": {
+                "Authorization": f"Bearer {api_key}",
+                "HTTP-Referer": "http://localhost",
+                "X-Title": "AIEmailAssistant"
+            },
+            "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            "http2": http2 and HTTP2_AVAILABLE
+        }
+        self.upstream = get_upstream(
+            "llm", timeout=timeout, retries=LLM_RETRIES, failure_threshold=LLM_BREAKER_THRESHOLD,
+            hedge_delay=LLM_HEDGE_DELAY
+        )
+        self._async_client = httpx.AsyncClient(**options)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "total_ms": 0.0, "last_ms": None, "min_ms": None,
+                       "last_first_token_ms": None, "http_version": None}
+
+    def _body(self, messages, stream=False, tools=None, tool_choice=None):
+        body = {"model": self.model, "messages": messages}
+        if tools:
+            body["tools"] = tools
+            body["tool_choice"] = tool_choice or "auto"
+            body["parallel_tool_calls"] = True
+        if stream:
+            body["stream"] = True
+        return body
+
+    def _record(self, started, response=None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["total_ms"] += elapsed_ms
+            self._stats["last_ms"] = elapsed_ms
+            if self._stats["min_ms"] is None or elapsed_ms < self._stats["min_ms"]:
+                self._stats["min_ms"] = elapsed_ms
+            if response is None:
+                self._stats["errors"] += 1
+            else:
+                self._stats["http_version"] = response.http_version
+        print(f"⏱️ LLM call took {elapsed_ms:.0f} ms" + (f" ({response.http_version})" if response is not None else " (failed)"))
+
+    async def acomplete(self, messages, tools=None, tool_choice=None):
+        """
+        Send a chat completion request and return the reply.
+
+        Without `tools` the reply is the text (or a '⚠️ Error' string). With
+        `tools` (see function_tool) it is an assistant message dict
+        {"content": text, "tool_calls": [...]}, each call as returned by
+        parse_tool_call.
+        """
+        started = time.perf_counter()
+        try:
+            response = await self.upstream.acall(
+                self._async_client.post, self.url, json=self._body(messages, tools=tools, tool_choice=tool_choice),
+                retry_if=retryable_status, hedge=True
+            )
+        except LLM_ERRORS as e:
+            self._record(started)
+            return _reply(f"⚠️ Error: LLM request failed: {e or type(e).__name__}", tools)
+        self._record(started, response)
+        return _parse_ai_message(response, tools) if tools else _parse_ai_response(response)
+
+    async def astream(self, messages):
+        """
+        Stream a chat completion, yielding text deltas as they arrive.
+
+        Errors are yielded as a single '⚠️ Error' string so callers can
+        treat streamed and non-streamed replies alike.
+        """
+        async for kind, value in self.astream_events(messages):
+            if kind == "text":
+                yield value
+
+    async def astream_events(self, messages, tools=None, tool_choice=None):
+        """
+        Stream a chat completion with tools, yielding ("text", delta) events
+        as text arrives and a ("tool_call", call) event as soon as each tool
+        call is complete (see ToolCallAssembler), so callers can start
+        running it while the model is still generating the rest.
+
+        Opening the stream is retried like other calls; once tokens flow a
+        failure ends the stream, since its start was already sent on.
+        """
+        started = time.perf_counter()
+        first_token_ms = None
+        assembler = ToolCallAssembler(tools)
+        body = self._body(messages, stream=True, tools=tools, tool_choice=tool_choice)
+
+        async def open_stream():
+            response = await self._async_client.send(self._async_client.build_request("POST", self.url, json=body), stream=True)
+            if response.status_code != 200:
+                await response.aread()  # Releases the connection before a retry
+            return response
+
+        try:
+            response = await self.upstream.acall(open_stream, retry_if=retryable_status)
+            try:
+                if response.status_code != 200:
+                    self._record(started, response)
+                    yield "text", _parse_ai_response(response)
+                    return
+                async for line in response.aiter_lines():
+                    # SSE: "data: {...}" lines, ": comment" keep-alives, "data: [DONE]" at the end
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(payload)
+                    except ValueError:
+                        continue
+                    if "error" in chunk:
+                        yield "text", f"⚠️ Error: {chunk['error'].get('message', 'Unknown error')}"
+                        break
+                    choices = chunk.get("choices") or [{}]
+                    delta = choices[0].get("delta") or {}
+                    if first_token_ms is None and (delta.get("content") or delta.get("tool_calls")):
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        with self._lock:
+                            self._stats["last_first_token_ms"] = first_token_ms
+                    if delta.get("content"):
+                        yield "text", delta["content"]
+                    for call in assembler.feed(delta.get("tool_calls") or []):
+                        yield "tool_call", call
+                for call in assembler.finish():
+                    yield "tool_call", call
+                self._record(started, response)
+            finally:
+                await response.aclose()
+        except LLM_ERRORS as e:
+            self._record(started)
+            yield "text", f"⚠️ Error: LLM request failed: {e or type(e).__name__}"
+
+    def stats(self):
+        """Call count, error count and latency figures (ms) since startup."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_ms"] = stats["total_ms"] / stats["calls"] if stats["calls"] else None
+        return stats
+
+    async def aclose(self):
+        await self._async_client.aclose()
+
+
+class CachedLLM:
+    """
+    An LLMClient behind a ResponseCache: replies to a request answered
+    recently come from the cache, and new replies are stored in it.
+
+    Args:
+        client (LLMClient): The client that calls the model
+        cache (ResponseCache, optional): The reply cache (None turns caching off)
+    """
+
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache
+
+    def _scope(self, tools, tool_choice):
+        """What besides the messages shapes a reply: the model and the tools on offer."""
+        if not tools:
+            return self.client.model
+        signature = json.dumps([tools, tool_choice], sort_keys=True)
+        return f"{self.client.model}|{hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]}"
+
+    def _cached(self, chat_history, tools=None, tool_choice=None):
+        return self.cache.get(self._scope(tools, tool_choice), chat_history) if self.cache else None
+
+    def _store(self, chat_history, reply, started, tools=None, tool_choice=None):
+        if self.cache:
+            self.cache.put(self._scope(tools, tool_choice), chat_history, reply, (time.perf_counter() - started) * 1000)
+
+    async def ask(self, chat_history, tools=None, tool_choice=None):
+        """
+        Reply to the conversation, from the response cache when the same request
+        was answered recently. With `tools` the reply is an assistant message
+        dict (see LLMClient.acomplete); cached replies must not be modified.
+        """
+        reply = self._cached(chat_history, tools, tool_choice)
+        if reply is None:
+            started = time.perf_counter()
+            reply = await self.client.acomplete(chat_history, tools, tool_choice)
+            self._store(chat_history, reply, started, tools, tool_choice)
+        return reply
+
+    async def stream_events(self, chat_history, tools=None, tool_choice=None):
+        """
+        Async iterator over ("text", delta) and ("tool_call", call) events of a
+        streamed completion (see LLMClient.astream_events). A cached reply is
+        replayed as one text event followed by its tool calls.
+        """
+        reply = self._cached(chat_history, tools, tool_choice)
+        if reply is not None:
+            text = reply if isinstance(reply, str) else reply["content"]
+            if text:
+                yield "text", text
+            for call in [] if isinstance(reply, str) else reply["tool_calls"]:
+                yield "tool_call", call
+            return
+        started = time.perf_counter()
+        parts, calls = [], []
+        async for kind, value in self.client.astream_events(chat_history, tools, tool_choice):
+            (parts if kind == "text" else calls).append(value)
+            yield kind, value
+        self._store(chat_history, _reply("".join(parts), tools, calls), started, tools, tool_choice)
+
+    def stats(self):
+        """Timing statistics of the LLM client and the response cache."""
+        return {**self.client.stats(), "cache": self.cache.stats() if self.cache else None}
+
+    async def aclose(self):
+        """Close the LLM HTTP client."""
+        await self.client.aclose()
+
+def _reply(text, tools, tool_calls=()):
+    """A reply in the form callers expect: the text, or a message dict when tools were offered."""
+    return {"content": text, "tool_calls": list(tool_calls)} if tools else text
+
+def _parse_ai_response(response):
+    message = _parse_ai_message(response)
+    return message if isinstance(message, str) else message["content"]
+
+def _parse_ai_message(response, tools=None):
+    # Parse the body exactly once
+    try:
+        response_json = response.json()
+    except ValueError:
+        return _reply(f"⚠️ Error: LLM returned a non-JSON response (HTTP {response.status_code})", tools)
+
+    # Handle error responses gracefully
+    if 'error' in response_json:
+        print("AI Error Response:", response_json)
+        error_message = response_json['error'].get('message', 'Unknown error')
+        return _reply(f"⚠️ Error: {error_message}", tools)
+
+    # Return the standard AI response if no errors
+    try:
+        message = response_json["choices"][0]["message"]
+    except (KeyError, IndexError, TypeError):
+        return _reply(f"⚠️ Unexpected response format: {response_json}", tools)
+    tool_calls = [
+        parse_tool_call(call.get("id"), (call.get("function") or {}).get("name"),
+                        (call.get("function") or {}).get("arguments"), tools, index)
+        for index, call in enumerate(message.get("tool_calls") or [])
+    ]
+    return {"content": message.get("content") or "", "tool_calls": tool_calls}
+
+def function_tool(name, description, properties, required=()):
+    """
+    An OpenRouter (OpenAI-style) function tool definition.
+
+    Args:
+        name (str): Function name the model calls
+        description (str): When and why to call it
+        properties (dict): Argument name -> JSON schema ("type", "description", optional "enum")
+        required (iterable): Names of the arguments that must be given
+    """
+    return {"type": "function", "function": {
+        "name": name,
+        "description": description,
+        "parameters": {"type": "object", "properties": properties, "required": list(required),
+                       "additionalProperties": False}
+    }}
+
+def _coerce(value, schema):
+    """Convert an argument to its schema type; raises ValueError when it cannot be."""
+    kind = schema.get("type")
+    if kind == "integer":
+        if isinstance(value, bool) or not (isinstance(value, int) or (isinstance(value, (str, float)) and float(value) == int(float(value)))):
+            raise ValueError("expected an integer")
+        value = int(float(value))
+    elif kind == "number":
+        if isinstance(value, bool):
+            raise ValueError("expected a number")
+        value = float(value)
+    elif kind == "boolean":
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+        elif not isinstance(value, bool):
+            raise ValueError("expected true or false")
+    elif kind == "string":
+        if isinstance(value, (dict, list)):
+            raise ValueError("expected a string")
+        value = str(value).strip()
+    if "enum" in schema:
+        matches = [option for option in schema["enum"] if str(option).lower() == str(value).lower()]
+        if not matches:
+            raise ValueError(f"expected one of {', '.join(map(str, schema['enum']))}")
+        value = matches[0]
+    return value
+
+def parse_tool_call(call_id, name, raw_arguments, tools, index=0):
+    """
+    Decode and type-check a tool call against the offered tools.
+
+    Arguments are converted to their schema types (a "2" for an integer
+    becomes 2, enums match case-insensitively); unknown arguments and empty
+    optional ones are dropped.
+
+    Returns:
+        dict: {"id", "name", "arguments" (dict), "raw_arguments" (str),
+            "error" (None, or why the call cannot be run)}
+    """
+    raw_arguments = raw_arguments or "{}"
+    call = {"id": call_id or f"call_{index}", "name": name or "", "arguments": {},
+            "raw_arguments": raw_arguments, "error": None}
+    schemas = {tool["function"]["name"]: tool["function"]["parameters"] for tool in tools or []}
+    if call["name"] not in schemas:
+        call["error"] = f"unknown tool '{call['name']}'"
+        return call
+    try:
+        arguments = json.loads(raw_arguments)
+    except ValueError:
+        call["error"] = "arguments are not valid JSON"
+        return call
+    if not isinstance(arguments, dict):
+        call["error"] = "arguments must be a JSON object"
+        return call
+
+    schema = schemas[call["name"]]
+    problems = []
+    for argument, value in arguments.items():
+        if argument not in schema["properties"] or value is None or value == "":
+            continue
+        try:
+            call["arguments"][argument] = _coerce(value, schema["properties"][argument])
+        except (TypeError, ValueError) as e:
+            problems.append(f"{argument}: {e}")
+    problems += [f"{argument}: missing" for argument in schema.get("required", []) if argument not in call["arguments"]]
+    if problems:
+        call["error"] = "invalid arguments (" + "; ".join(problems) + ")"
+    return call
+
+def tool_call_message(content, tool_calls):
+    """The assistant message that made `tool_calls`, for sending their results back."""
+    return {"role": "assistant", "content": content or None, "tool_calls": [
+        {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["raw_arguments"]}}
+        for call in tool_calls
+    ]}
+
+def tool_result_message(call, content):
+    """The message carrying a tool call's result back to the AI."""
+    return {"role": "tool", "tool_call_id": call["id"], "content": content}
+
+def _is_json_object(text):
+    try:
+        return isinstance(json.loads(text), dict)
+    except ValueError:
+        return False
+
+class ToolCallAssembler:
+    """
+    Rebuild tool calls from streamed deltas.
+
+    Each call is handed over as soon as it is complete, so it can start
+    running while the model is still generating: when its arguments parse
+    as a whole JSON object (nothing valid can follow the closing brace),
+    when the next call starts, or at the latest when the stream ends.
+    """
+
+    def __init__(self, tools):
+        self.tools = tools
+        self._calls = {}
+        self._emitted = set()
+
+    def _emit(self, index):
+        self._emitted.add(index)
+        call = self._calls[index]
+        return parse_tool_call(call["id"], call["name"], call["arguments"], self.tools, index)
+
+    def feed(self, deltas):
+        """Add the tool_calls entries of one stream delta; return the calls that are now complete."""
+        ready = []
+        for delta in deltas:
+            index = delta.get("index", 0)
+            ready += [self._emit(earlier) for earlier in sorted(self._calls) if earlier < index and earlier not in self._emitted]
+            call = self._calls.setdefault(index, {"id": None, "name": "", "arguments": ""})
+            function = delta.get("function") or {}
+            call["id"] = delta.get("id") or call["id"]
+            call["name"] += function.get("name") or ""
+            call["arguments"] += function.get("arguments") or ""
+            if (index not in self._emitted and call["name"] and call["arguments"].rstrip().endswith("}")
+                    and _is_json_object(call["arguments"])):
+                ready.append(self._emit(index))
+        return ready
+
+    def finish(self):
+        """The calls not handed over yet, once the stream has ended."""
+        return [self._emit(index) for index in sorted(self._calls) if index not in self._emitted]
+
+def sse_event(event, data):
+    """Encode one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
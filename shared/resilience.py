@@ -0,0 +1,375 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+# Responses worth another attempt: timeouts, rate limits and server-side failures
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Latencies kept per upstream for percentiles and the hedge delay
+LATENCY_WINDOW = 200
+# Samples needed before the hedge delay follows the observed latency
+HEDGE_MIN_SAMPLES = 20
+
+# Errors that say the upstream is slow or unreachable, not that the request was wrong
+TRANSIENT_ERRORS = (TimeoutError, asyncio.TimeoutError, ConnectionError)
+# Errors raised before the request reached the upstream: safe to retry even when it is not idempotent
+UNSENT_ERRORS = ()
+if httpx is not None:
+    TRANSIENT_ERRORS += (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+    UNSENT_ERRORS += (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+if requests is not None:
+    TRANSIENT_ERRORS += (requests.Timeout, requests.ConnectionError)
+    UNSENT_ERRORS += (requests.ConnectTimeout,)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+def retryable_status(response):
+    """True for an HTTP response (requests or httpx) whose status is worth retrying."""
+    return response.status_code in RETRY_STATUSES
+
+
+def backoff_delay(attempt, base, cap):
+    """Seconds to wait before retry `attempt` (0-based): exponential, capped, with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    Closed: calls go through; `failure_threshold` transient failures in a
+    row open the breaker. Open: calls fail at once with CircuitOpenError
+    for `reset_timeout` seconds. Half-open: one probe call goes through
+    (the others still fail fast); its success closes the breaker, its
+    failure opens it again, and a probe that ends in neither (cancelled)
+    lets the next call probe instead. Thread-safe.
+
+    Args:
+        name (str): Upstream name used in log output
+        failure_threshold (int): Consecutive failures that open the breaker (0 = never)
+        reset_timeout (float): Seconds the breaker stays open before a probe
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.stats["rejected"] += 1
+            retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open, next try in {retry_in:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ {self.name} circuit closed")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """Let another call probe after one that ended without a result (e.g. cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failure_threshold and self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.stats["opened"] += 1
+                print(f"🚧 {self.name} circuit open after {self._failures} failures; failing fast for {self.reset_timeout:g}s")
+
+
+class Upstream:
+    """
+    Timeout, retry, circuit-breaker and hedging policy for one upstream service.
+
+    `call` and `acall` run a request with it: transient errors (timeouts,
+    connection failures) and results `retry_if` rejects (e.g.
+    retryable_status) are retried up to `retries` times with jittered
+    exponential backoff, and every such failure counts towards the circuit
+    breaker. A call that is not idempotent is only retried when the
+    request cannot have reached the upstream (connection never made, or a
+    result `retry_if` says was refused). `timeout` is the per-attempt time
+    limit: callers pass it to their HTTP client, and `acall` also enforces
+    it on the whole attempt.
+
+    Args:
+        name (str): Upstream name used in log output and stats
+        timeout (float): Seconds one attempt may take
+        retries (int): Extra attempts after a transient failure
+        backoff_base (float): Backoff before the first retry, doubled for each further one
+        backoff_cap (float): Maximum backoff
+        failure_threshold (int): Consecutive failures that open the circuit breaker (0 = never)
+        reset_timeout (float): Seconds the breaker stays open before a probe call
+        hedge_delay (float): Seconds before a hedged call starts its first duplicate
+            until enough latencies are known (0 = no hedging)
+        hedge_quantile (float): Latency quantile the hedge delay follows afterwards
+        hedge_min_delay (float): Lower bound of the adaptive hedge delay
+    """
+
+    def __init__(self, name, timeout=10.0, retries=2, backoff_base=0.25, backoff_cap=4.0, failure_threshold=5,
+                 reset_timeout=30.0, hedge_delay=0.0, hedge_quantile=0.95, hedge_min_delay=1.0):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _next_retry(self, attempt, idempotent, error=None):
+        """Backoff before the next attempt, or None when the failure must not be retried."""
+        if attempt >= self.retries:
+            return None
+        if error is not None and not idempotent and not isinstance(error, UNSENT_ERRORS):
+            return None
+        self._count("retries")
+        return backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+
+    def _succeeded(self, started):
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+        self.breaker.record_success()
+
+    def _failed(self, what, delay):
+        self._count("failures")
+        self.breaker.record_failure()
+        if delay is not None:
+            print(f"🔁 {self.name}: {what}; retrying in {delay:.2f}s")
+
+    def call(self, func, *args, idempotent=True, retry_if=None, **kwargs):
+        """
+        Call `func(*args, **kwargs)` under this policy.
+
+        Args:
+            func (callable): Makes one attempt (e.g. requests.post)
+            idempotent (bool): Whether repeating a request that reached the upstream is harmless
+            retry_if (callable, optional): Predicate on a result that makes it a transient failure
+
+        Returns:
+            The first accepted result, or the last result once retries run out
+
+        Raises:
+            CircuitOpenError: The breaker is open; the upstream was not called
+            Exception: The last error when it was not transient or retries ran out
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except TRANSIENT_ERRORS as e:
+                delay = self._next_retry(attempt, idempotent, e)
+                self._failed(repr(e), delay)
+                if delay is None:
+                    raise
+            except Exception:
+                # The upstream answered; the request itself was the problem
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Interrupted before the upstream answered: no verdict on its health
+                self.breaker.release_probe()
+                raise
+            else:
+                if not (retry_if and retry_if(result)):
+                    self._succeeded(started)
+                    return result
+                delay = self._next_retry(attempt, idempotent)
+                self._failed(f"HTTP {getattr(result, 'status_code', '?')}", delay)
+                if delay is None:
+                    return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, func, *args, idempotent=True, retry_if=None, hedge=False, **kwargs):
+        """
+        Async version of `call` for a coroutine function. Each attempt is
+        limited to `timeout` seconds; with `hedge` it is a hedged request
+        (see `hedged`).
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                if hedge and self.hedge_delay:
+                    result = await asyncio.wait_for(self.hedged(lambda: func(*args, **kwargs)), self.timeout)
+                else:
+                    result = await asyncio.wait_for(func(*args, **kwargs), self.timeout)
+            except TRANSIENT_ERRORS as e:
+                delay = self._next_retry(attempt, idempotent, e)
+                self._failed(repr(e) if str(e) else type(e).__name__, delay)
+                if delay is None:
+                    raise
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Cancelled (e.g. the client disconnected): a half-open breaker must not wait on this probe forever
+                self.breaker.release_probe()
+                raise
+            else:
+                if not (retry_if and retry_if(result)):
+                    self._succeeded(started)
+                    return result
+                delay = self._next_retry(attempt, idempotent)
+                self._failed(f"HTTP {getattr(result, 'status_code', '?')}", delay)
+                if delay is None:
+                    return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def current_hedge_delay(self):
+        """The configured hedge delay until HEDGE_MIN_SAMPLES latencies are known, then the hedge quantile."""
+        with self._lock:
+            samples = len(self._latencies)
+        if samples < HEDGE_MIN_SAMPLES:
+            return self.hedge_delay
+        return max(self.hedge_min_delay, self.latency_quantile(self.hedge_quantile))
+
+    async def hedged(self, make_call, copies=2):
+        """
+        Await `make_call()`, starting a duplicate whenever the hedge delay
+        passes without a result, up to `copies` in flight. The first
+        successful result wins and the other copies are cancelled; an error
+        is raised only once every copy has failed. Only for idempotent
+        requests whose tail latency is worth paying for twice.
+        """
+        first = asyncio.ensure_future(make_call())
+        pending = {first}
+        launched = 1
+        error = None
+        try:
+            while pending:
+                timeout = self.current_hedge_delay() if launched < copies else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._count("hedge_wins")
+                            print(f"🏁 {self.name}: hedged request won")
+                        return task.result()
+                    error = task.exception()
+                if not done and launched < copies:
+                    print(f"🪁 {self.name}: no reply after {timeout:.1f}s, sending a hedged request")
+                    pending.add(asyncio.ensure_future(make_call()))
+                    launched += 1
+                    self._count("hedges")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def latency_quantile(self, quantile):
+        """Latency (seconds) at `quantile` of the recent successful attempts, or None."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+    def info(self):
+        """Call, failure, retry and hedge counters, breaker state and latency percentiles (ms)."""
+        with self._lock:
+            stats = dict(self.stats)
+        p50, p95 = self.latency_quantile(0.5), self.latency_quantile(0.95)
+        return {
+            **stats,
+            **self.breaker.stats,
+            "breaker": self.breaker.state,
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None
+        }
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name, **defaults):
+    """
+    The shared Upstream policy for `name`, created on first use.
+
+    `defaults` are Upstream arguments; each can be overridden with an
+    environment variable named after the upstream, e.g. TAVILY_TIMEOUT,
+    TAVILY_RETRIES, TAVILY_BREAKER_THRESHOLD, TAVILY_BREAKER_RESET and
+    LLM_HEDGE_DELAY.
+    """
+    with _upstreams_lock:
+        if name not in _upstreams:
+            prefix = name.upper()
+            settings = dict(defaults)
+            for option, variable, kind in (
+                ("timeout", "TIMEOUT", float), ("retries", "RETRIES", int),
+                ("backoff_base", "BACKOFF_BASE", float), ("backoff_cap", "BACKOFF_CAP", float),
+                ("failure_threshold", "BREAKER_THRESHOLD", int), ("reset_timeout", "BREAKER_RESET", float),
+                ("hedge_delay", "HEDGE_DELAY", float)
+            ):
+                value = os.getenv(f"{prefix}_{variable}")
+                if value is not None:
+                    settings[option] = kind(value)
+            _upstreams[name] = Upstream(name, **settings)
+        return _upstreams[name]
+
+
+def upstream_stats():
+    """Stats of every upstream used so far, by name."""
+    with _upstreams_lock:
+        upstreams = dict(_upstreams)
+    return {name: upstream.info() for name, upstream in upstreams.items()}
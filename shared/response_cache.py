@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache AI replies for repeated prompts ("0" turns it off)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(3600)))
+# Only the system messages and this many latest messages make up the cache key
+RESPONSE_CACHE_TAIL = int(os.getenv("RESPONSE_CACHE_TAIL", "6"))
+# Semantic tier: reuse the reply to a reworded last message in the same context. Off by
+# default: on a first turn the context is only the system prompt, shared by every user
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") != "0"
+SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_THRESHOLD", "0.9"))
+SEMANTIC_TOP_K = 3
+EMBEDDING_DIMENSIONS = 1024
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_WORD_RE = re.compile(r"\w+")
+# Filler words a rewording may add or drop; every other word must stay the same
+FILLER_WORDS = frozenset({
+    "a", "an", "the", "my", "me", "i", "you", "your", "please", "pls", "can", "could", "would", "will",
+    "just", "hi", "hey", "ok", "okay", "thanks", "thank"
+})
+
+
+def _canonical(messages):
+    """Role, content and tool calls of each message, in a stable JSON form."""
+    return json.dumps(
+        [[message.get("role"), message.get("content") or "", message.get("tool_calls"), message.get("tool_call_id")]
+         for message in messages],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+
+
+def _reply_text(reply):
+    """The text of a reply, which is either a string or an assistant message dict."""
+    return reply if isinstance(reply, str) else (reply.get("content") or "")
+
+
+def _content_words(text):
+    """The words of `text` that carry meaning, in order ("Show me my emails!" -> ("show", "emails"))."""
+    return tuple(word for word in _WORD_RE.findall((text or "").casefold()) if word not in FILLER_WORDS)
+
+
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _context(messages, tail=RESPONSE_CACHE_TAIL):
+    """The messages a reply is assumed to depend on: every system message plus the latest `tail`."""
+    system = [message for message in messages if message.get("role") == "system"]
+    rest = [message for message in messages if message.get("role") != "system"]
+    return system + rest[-tail:] if tail else system + rest
+
+
+def embed(text, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Hashed bag-of-features embedding: words and the character trigrams of
+    each word are hashed into `dimensions` buckets, and the vector is
+    L2-normalised so a dot product is the cosine similarity.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD_RE.findall((text or "").casefold()):
+        features = [word] + [word[i:i + 3] for i in range(max(len(word) - 2, 1))]
+        for feature in features:
+            bucket = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[bucket % dimensions] += 1.0 if feature == word else 0.5
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    """
+    Two-tier cache of AI replies.
+
+    Exact tier: the key is a SHA-256 of the model and the canonical form
+    of the context (system messages and the latest RESPONSE_CACHE_TAIL
+    messages). Entries expire after `ttl` seconds and the least recently
+    used one is evicted once `maxsize` are held.
+
+    Semantic tier (needs numpy): entries are also filed under the context
+    without its last message. A lookup that misses the exact tier embeds
+    the last message and takes the top-k cosine matches among entries with
+    the same earlier context; the best one at or above `threshold` with
+    the same content words in the same order is returned, so a rewording
+    ("show me my emails please" / "Show my emails") hits but a change of
+    meaning ("my unread emails" / "my emails", "Paris" / "Porto", "3 days" /
+    "4 days") does not. Replies that carry tool calls are only served by
+    the exact tier. Embeddings sit in one preallocated matrix, one row per
+    entry.
+
+    A reply is either the text or an assistant message dict (with tool
+    calls); cached dicts are shared between callers and must be treated as
+    read-only. Error replies are never stored. Thread-safe.
+
+    Args:
+        maxsize (int): Maximum number of entries
+        ttl (float): Seconds an entry stays valid
+        name (str): Label used in log output
+        query_text (callable): Picks the text to embed out of the last message
+        semantic (bool): Enable the semantic tier
+        threshold (float): Minimum cosine similarity for a semantic hit
+        tail (int): Latest non-system messages the key covers (0 = all)
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, name="llm", query_text=None,
+                 semantic=SEMANTIC_CACHE, threshold=SEMANTIC_THRESHOLD, tail=RESPONSE_CACHE_TAIL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.tail = tail
+        self.query_text = query_text or (lambda text: text)
+        self.semantic = semantic and np is not None
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.semantic:
+            self._vectors = np.zeros((maxsize, EMBEDDING_DIMENSIONS), dtype=np.float32)
+            self._namespaces = np.zeros(maxsize, dtype=np.uint64)
+            self._rows = np.zeros(maxsize, dtype=bool)
+            self._row_keys = [None] * maxsize
+            self._free_rows = list(range(maxsize - 1, -1, -1))
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                       "saved_ms": 0.0}
+
+    def _keys(self, model, messages):
+        """(exact key, semantic namespace, text to embed) for a request."""
+        context = _context(messages, self.tail)
+        key = _digest(model, _canonical(context))
+        namespace = int(_digest(model, _canonical(context[:-1]))[:16], 16)
+        last = (context[-1].get("content") or "") if context else ""
+        return key, namespace, self.query_text(last)
+
+    def _drop(self, key):
+        """Remove an entry and free its embedding row (call with the lock held)."""
+        entry = self._entries.pop(key)
+        if entry["row"] is not None:
+            self._rows[entry["row"]] = False
+            self._row_keys[entry["row"]] = None
+            self._free_rows.append(entry["row"])
+
+    def _semantic_lookup(self, namespace, query, vector, now):
+        """Best fresh entry for a reworded query in the same context (call with the lock held)."""
+        candidates = np.flatnonzero(self._rows & (self._namespaces == np.uint64(namespace)))
+        if not len(candidates):
+            return None
+        similarities = self._vectors[candidates] @ vector
+        top = np.argsort(similarities)[::-1][:SEMANTIC_TOP_K]
+        words = _content_words(query)
+        for index in top:
+            if similarities[index] < self.threshold:
+                break
+            entry = self._entries[self._row_keys[candidates[index]]]
+            if now - entry["stored_at"] < self.ttl and entry["words"] == words:
+                return entry, float(similarities[index])
+        return None
+
+    def get(self, model, messages):
+        """
+        The cached reply for this request, or None.
+
+        `model` identifies everything besides the messages that shapes the
+        reply (model name, offered tools).
+        """
+        key, namespace, query = self._keys(model, messages)
+        vector = embed(query) if self.semantic else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["stored_at"] >= self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                self._stats["saved_ms"] += entry["elapsed_ms"]
+                print(f"♻️ {self.name} response cache hit (exact)")
+                return entry["reply"]
+            match = self._semantic_lookup(namespace, query, vector, now) if self.semantic else None
+            if match is not None:
+                entry, similarity = match
+                self._stats["semantic_hits"] += 1
+                self._stats["saved_ms"] += entry["elapsed_ms"]
+                print(f"♻️ {self.name} response cache hit (similarity {similarity:.2f})")
+                return entry["reply"]
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, model, messages, reply, elapsed_ms):
+        """Store a reply and how long the AI took to produce it; error replies are skipped."""
+        text = _reply_text(reply)
+        if text.startswith("⚠️") or "⚠️ Error" in text:
+            return
+        if not text and not (isinstance(reply, dict) and reply.get("tool_calls")):
+            return
+        key, namespace, query = self._keys(model, messages)
+        vector = embed(query) if self.semantic else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while len(self._entries) >= self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+            row = None
+            # A tool call is an action with arguments; only the exact request may reuse it
+            if self.semantic and not (isinstance(reply, dict) and reply.get("tool_calls")):
+                row = self._free_rows.pop()
+                self._vectors[row] = vector
+                self._namespaces[row] = np.uint64(namespace)
+                self._rows[row] = True
+                self._row_keys[row] = key
+            self._entries[key] = {"reply": reply, "words": _content_words(query), "stored_at": time.monotonic(),
+                                  "elapsed_ms": elapsed_ms, "row": row}
+            self._stats["stores"] += 1
+
+    def stats(self):
+        """Hit counts, hit rate and the AI time saved by hits (ms)."""
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), semantic=self.semantic)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else None
+        return stats
@@ -0,0 +1,278 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where conversations live: "memory" (one worker only), a SQLite file path
+# or sqlite:///path (all workers on one machine), or redis://... (many machines).
+# Unset, each app keeps a SQLite file of its own (see create_session_store)
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL")
+SESSION_HOT_SIZE = int(os.getenv("SESSION_HOT_SIZE", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class Session:
+    """
+    One user's conversation.
+
+    `history` holds the chat messages without the system prompt, `state`
+    any other per-user values (e.g. a pending email draft). Both must be
+    JSON-serializable. `version` is the backend version the session was
+    loaded at and is only maintained by SessionStore.
+    """
+
+    def __init__(self, session_id, history=None, state=None, version=0):
+        self.id = session_id
+        self.history = history if history is not None else []
+        self.state = state if state is not None else {}
+        self.version = version
+
+    def to_json(self):
+        return json.dumps({"history": self.history, "state": self.state}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, session_id, payload, version):
+        data = json.loads(payload)
+        return cls(session_id, data.get("history"), data.get("state"), version)
+
+
+class MemoryBackend:
+    """Process-local backend. Sessions are not shared, so run a single worker with it."""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def _live(self, session_id):
+        row = self._rows.get(session_id)
+        if row and time.time() - row[2] > self.ttl:
+            del self._rows[session_id]
+            return None
+        return row
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._live(session_id)
+        return (row[0], row[1]) if row else None
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._live(session_id)
+        return row[1] if row else None
+
+    def put(self, session_id, payload):
+        with self._lock:
+            row = self._live(session_id)
+            version = row[1] + 1 if row else 1
+            self._rows[session_id] = (payload, version, time.time())
+        return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._rows.pop(session_id, None)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Sessions in a SQLite file, shared by every worker process on the machine.
+
+    WAL mode lets readers and the single writer proceed concurrently;
+    expired sessions are purged every `purge_every` writes.
+    """
+
+    def __init__(self, path, ttl=SESSION_TTL, purge_every=500):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, payload TEXT NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload, version FROM sessions WHERE id = ? AND updated_at > ?",
+                (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version FROM sessions WHERE id = ? AND updated_at > ?",
+                (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, session_id, payload):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "INSERT INTO sessions (id, payload, version, updated_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (id) DO UPDATE SET payload = excluded.payload, "
+                "version = sessions.version + 1, updated_at = excluded.updated_at RETURNING version",
+                (session_id, payload, now)
+            ).fetchone()
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._db.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.ttl,))
+        return row[0]
+
+    def delete(self, session_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisBackend:
+    """
+    Sessions in Redis, shared across machines. Each session is a hash with
+    its payload and a version counter; Redis expires it after `ttl` seconds
+    without writes. Needs the `redis` package.
+    """
+
+    def __init__(self, url, ttl=SESSION_TTL, prefix="session:"):
+        import redis
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, session_id):
+        payload, version = self._redis.hmget(self.prefix + session_id, "payload", "version")
+        return (payload.decode("utf-8"), int(version)) if payload is not None else None
+
+    def version(self, session_id):
+        version = self._redis.hget(self.prefix + session_id, "version")
+        return int(version) if version is not None else None
+
+    def put(self, session_id, payload):
+        key = self.prefix + session_id
+        pipe = self._redis.pipeline()
+        pipe.hincrby(key, "version", 1)
+        pipe.hset(key, "payload", payload)
+        pipe.expire(key, self.ttl)
+        version, _, _ = pipe.execute()
+        return version
+
+    def delete(self, session_id):
+        self._redis.delete(self.prefix + session_id)
+
+    def close(self):
+        self._redis.close()
+
+
+class SessionStore:
+    """
+    Session-keyed conversation store: an in-process LRU hot tier in front
+    of a shared backend.
+
+    The hot tier keeps recently used Session objects so most turns skip
+    reading and decoding the stored payload. Because another worker may
+    have written the session since, a hot entry is only used when its
+    version still matches the backend's (a single-key lookup); otherwise
+    the session is reloaded. Saves write through to the backend, and the
+    last writer wins.
+
+    Args:
+        backend: MemoryBackend, SQLiteBackend, RedisBackend or anything with
+                 get/version/put/delete/close
+        hot_size (int): Maximum number of sessions kept in the hot tier
+    """
+
+    def __init__(self, backend, hot_size=SESSION_HOT_SIZE):
+        self.backend = backend
+        self.hot_size = hot_size
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hot_hits": 0, "backend_loads": 0, "created": 0, "saves": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _remember(self, session):
+        with self._lock:
+            self._hot[session.id] = session
+            self._hot.move_to_end(session.id)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+    def load(self, session_id=None):
+        """
+        Return the session for `session_id`; a fresh one (with a new id)
+        when the id is missing, malformed or unknown.
+        """
+        if not session_id or not SESSION_ID_RE.match(session_id):
+            self._count("created")
+            return Session(new_session_id())
+
+        with self._lock:
+            hot = self._hot.get(session_id)
+        if hot is not None and self.backend.version(session_id) == hot.version:
+            with self._lock:
+                self._hot.move_to_end(session_id)
+            self._count("hot_hits")
+            return hot
+
+        stored = self.backend.get(session_id)
+        if stored is None:
+            self._count("created")
+            return Session(session_id)
+        self._count("backend_loads")
+        session = Session.from_json(session_id, *stored)
+        self._remember(session)
+        return session
+
+    def save(self, session):
+        session.version = self.backend.put(session.id, session.to_json())
+        self._remember(session)
+        self._count("saves")
+
+    def delete(self, session_id):
+        with self._lock:
+            self._hot.pop(session_id, None)
+        if session_id and SESSION_ID_RE.match(session_id):
+            self.backend.delete(session_id)
+
+    def close(self):
+        self.backend.close()
+
+
+def create_session_store(default_path, url=SESSION_STORE_URL):
+    """Build a SessionStore from a SESSION_STORE_URL-style setting, or on the app's SQLite file `default_path`."""
+    url = url or default_path
+    if url == "memory":
+        backend = MemoryBackend()
+    elif url.startswith(("redis://", "rediss://")):
+        backend = RedisBackend(url)
+    else:
+        backend = SQLiteBackend(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+    print(f"💾 Session store: {type(backend).__name__}")
+    return SessionStore(backend)
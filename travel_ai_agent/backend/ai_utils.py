@@ -1,49 +1,34 @@
-import requests
 import os
 from dotenv import load_dotenv
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.llm import (  # noqa: F401  (re-exported for main.py)
+    LLMClient,
+    CachedLLM,
+    OPENROUTER_URL,
+    OPENROUTER_API_KEY,
+    function_tool,
+    parse_tool_call,
+    tool_call_message,
+    tool_result_message,
+    sse_event
+)
+from shared.response_cache import ResponseCache, RESPONSE_CACHE
 
 load_dotenv()
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen/qwen3-30b-a3b-instruct-2507")
 
-def ask_ai_with_history(chat_history):
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "HTTP-Referer": "http://localhost",
-        "X-Title": "AIEmailAssistant"
-    }
-    
-    data = {
-        "model": "qwen/qwen3-30b-a3b-instruct-2507",
-        "messages": chat_history
-    }
+llm_client = LLMClient(OPENROUTER_URL, OPENROUTER_API_KEY, LLM_MODEL)
 
-    response = requests.post(url, json=data, headers=headers)
+# The frontend prefixes every message with the same instructions; only the
+# user's own words after "User query:" are compared for near-duplicates
+def user_query_text(text):
+    return text.rsplit("User query:", 1)[-1]
 
-    # Print the full response to inspect it
-    print("AI Response:", response.json())  # This will show the full response for debugging
+response_cache = ResponseCache(query_text=user_query_text) if RESPONSE_CACHE else None
+llm = CachedLLM(llm_client, response_cache)
 
-    # Handle error responses gracefully
-    response_json = response.json()
-    if 'error' in response_json:
-        error_message = response_json['error'].get('message', 'Unknown error')
-        return f"⚠️ Error: {error_message}"
-
-    # Sanitize the response's "raw" field if present
-    if 'metadata' in response_json.get('error', {}):
-        raw_data = response_json['error']['metadata'].get('raw', '')
-        # Replace single quotes with double quotes for valid JSON
-        if raw_data:
-            raw_data = raw_data.replace("'", '"')
-            try:
-                raw_json = json.loads(raw_data)
-                return raw_json  # You can now safely work with the raw data
-            except json.JSONDecodeError:
-                return f"⚠️ Failed to parse error metadata: {raw_data}"
-
-    # Return the standard AI response if no errors
-    try:
-        return response_json["choices"][0]["message"]["content"]
-    except KeyError:
-        return f"⚠️ Unexpected response format: {response_json}"
+ask_ai_with_history_async = llm.ask
+stream_ai_events = llm.stream_events
+get_llm_stats = llm.stats
+close_ai_client = llm.aclose
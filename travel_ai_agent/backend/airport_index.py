@@ -0,0 +1,450 @@
+import csv
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+# Bundled offline airport data (data/LICENSE.airports): every airport with an
+# IATA code from the airportsdata project, plus the metro-area codes searched
+# as several airports at once
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+AIRPORTS_CSV = os.path.join(DATA_DIR, "airports.csv")
+METRO_AREAS_CSV = os.path.join(DATA_DIR, "metro_areas.csv")
+
+# Candidates kept per trie node, best first; a prefix lookup is then a walk
+# down the trie with no subtree scan
+TRIE_CANDIDATES = 8
+# Keys sharing the most trigrams with a misspelled query that get an edit-distance check
+FUZZY_SHORTLIST = 50
+
+# Nicknames and former names that are neither a city nor an airport name
+ALIASES = {
+    "la": "LAX", "sf": "SFO", "san fran": "SFO", "vegas": "LAS", "nyc": "NYC", "new york city": "NYC",
+    "manhattan": "NYC", "dc": "WAS", "washington dc": "WAS", "philly": "PHL", "bombay": "BOM",
+    "calcutta": "CCU", "madras": "MAA", "peking": "BJS", "saigon": "SGN", "rangoon": "RGN",
+    "kiev": "KBP", "kyiv": "KBP", "constantinople": "IST", "mexico city": "MEX", "cdmx": "MEX",
+    "dubai": "DXB", "abu dhabi": "AUH", "hong kong": "HKG", "singapore": "SIN", "bali": "DPS",
+    "hawaii": "HNL", "honolulu": "HNL", "cancun": "CUN", "lisbon": "LIS", "prague": "PRG",
+    "munich": "MUC", "cologne": "CGN", "florence": "FLR", "venice": "VCE", "naples": "NAP",
+    "athens": "ATH", "vienna": "VIE", "copenhagen": "CPH", "zurich": "ZRH", "geneva": "GVA",
+    "delhi": "DEL", "goa": "GOI"
+}
+
+# Airports closed to passenger flights that the bundled data still lists
+CLOSED_AIRPORTS = frozenset({"TXL", "ISL"})
+
+# Country names and US state abbreviations accepted as a qualifier, as in
+# "Paris, France" or "Portland, ME"; full state and region names come from the data
+COUNTRY_NAMES = {
+    "uk": "GB", "united kingdom": "GB", "great britain": "GB", "britain": "GB", "england": "GB",
+    "scotland": "GB", "wales": "GB", "usa": "US", "us": "US", "united states": "US", "america": "US",
+    "canada": "CA", "mexico": "MX", "brazil": "BR", "argentina": "AR", "france": "FR", "germany": "DE",
+    "spain": "ES", "portugal": "PT", "italy": "IT", "netherlands": "NL", "holland": "NL", "belgium": "BE",
+    "ireland": "IE", "switzerland": "CH", "austria": "AT", "greece": "GR", "turkey": "TR", "denmark": "DK",
+    "sweden": "SE", "norway": "NO", "finland": "FI", "iceland": "IS", "poland": "PL", "russia": "RU",
+    "uae": "AE", "united arab emirates": "AE", "qatar": "QA", "egypt": "EG", "south africa": "ZA",
+    "kenya": "KE", "india": "IN", "china": "CN", "japan": "JP", "south korea": "KR", "korea": "KR",
+    "thailand": "TH", "vietnam": "VN", "indonesia": "ID", "philippines": "PH", "australia": "AU",
+    "new zealand": "NZ", "costa rica": "CR", "colombia": "CO", "peru": "PE", "chile": "CL",
+    "panama": "PA", "cuba": "CU", "dominican republic": "DO", "jamaica": "JM", "puerto rico": "PR",
+    "morocco": "MA", "israel": "IL", "saudi arabia": "SA", "singapore": "SG", "malaysia": "MY",
+    "taiwan": "TW", "croatia": "HR", "czech republic": "CZ", "czechia": "CZ", "hungary": "HU"
+}
+US_STATES = dict(pair.replace("_", " ").split(":") for pair in (
+    "al:Alabama ak:Alaska az:Arizona ar:Arkansas ca:California co:Colorado ct:Connecticut de:Delaware "
+    "fl:Florida ga:Georgia hi:Hawaii id:Idaho il:Illinois in:Indiana ia:Iowa ks:Kansas ky:Kentucky "
+    "la:Louisiana me:Maine md:Maryland ma:Massachusetts mi:Michigan mn:Minnesota ms:Mississippi "
+    "mo:Missouri mt:Montana ne:Nebraska nv:Nevada nh:New_Hampshire nj:New_Jersey nm:New_Mexico "
+    "ny:New_York nc:North_Carolina nd:North_Dakota oh:Ohio ok:Oklahoma or:Oregon pa:Pennsylvania "
+    "ri:Rhode_Island sc:South_Carolina sd:South_Dakota tn:Tennessee tx:Texas ut:Utah vt:Vermont "
+    "va:Virginia wa:Washington wv:West_Virginia wi:Wisconsin wy:Wyoming dc:District_of_Columbia"
+).split())
+
+# Busiest hubs, preferred when a city name matches several airports
+MAJOR_AIRPORTS = frozenset(
+    "ATL DFW DEN ORD LAX JFK LAS MCO MIA CLT SEA PHX EWR SFO IAH BOS FLL MSP LGA DTW PHL SLC BWI DCA SAN "
+    "IAD TPA BNA AUS HNL PDX STL MCI YYZ YVR YUL MEX CUN GRU GIG EZE SCL BOG LIM PTY LHR LGW CDG ORY AMS "
+    "FRA MUC MAD BCN FCO MXP ZRH VIE CPH ARN OSL HEL DUB BRU LIS ATH IST SVO DXB DOH AUH JED RUH CAI JNB "
+    "SJC OAK CPT NBO ADD LOS DEL BOM BLR MAA HYD CCU SIN KUL BKK CGK MNL HKG TPE PEK PVG CAN SZX ICN NRT HND KIX "
+    "SYD MEL BNE PER AKL".split()
+)
+
+GENERIC_WORDS = frozenset({"airport", "airports", "international", "intl", "the", "aeropuerto", "aeroport"})
+MINOR_AIRPORT_WORDS = frozenset({
+    "heliport", "seaplane", "base", "airstrip", "strip", "station", "army", "naval", "ranch"
+})
+CODE_RE = re.compile(r"[A-Za-z]{3}")
+CODE_LIST_RE = re.compile(r"[A-Z]{3}(?:\s+[A-Z]{3})+")
+AIRPORT_SET_SPLIT_RE = re.compile(r"[,/]+")
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_place(text):
+    """Case-fold, strip accents and punctuation, and drop generic words like "airport"."""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    words = _NON_WORD_RE.sub(" ", text.casefold()).split()
+    return " ".join(word for word in words if word not in GENERIC_WORDS)
+
+
+def _importance(name, code):
+    """Static rank of an airport when several match: hubs, then international airports."""
+    words = set(normalize_place(name).split()) | set(_NON_WORD_RE.sub(" ", name.casefold()).split())
+    score = 0
+    if code in MAJOR_AIRPORTS:
+        score += 6
+    if "international" in words or "intl" in words:
+        score += 3
+    if words & MINOR_AIRPORT_WORDS:
+        score -= 4
+    elif {"regional", "municipal", "county", "field"} & words:
+        score -= 1
+    return score
+
+
+_NO_CHILDREN = {}
+
+
+class _TrieNode:
+    """A trie node reached over `label` (one or more characters) from its parent."""
+    __slots__ = ("label", "children", "best", "terminal")
+
+    def __init__(self, label=""):
+        self.label = label
+        self.children = {}
+        self.best = []
+        self.terminal = False
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance counting a swap of neighbours as one edit; `limit` + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(row[j - 1] + 1, previous[j] + 1, previous[j - 1] + cost)
+            if cost and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], previous2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        previous2, previous = previous, row
+    return previous[-1]
+
+
+class AirportIndex:
+    """
+    In-memory airport lookup built from the bundled CSV files.
+
+    Every airport and metro area is indexed under its city, its name and
+    the distinctive words of its name ("heathrow"). Exact keys are a dict
+    probe; prefixes walk a trie whose nodes keep their best few candidates,
+    so no subtree is scanned. Misspellings fall back to a trigram index
+    that shortlists keys for an edit-distance check.
+    """
+
+    def __init__(self, airports_csv=AIRPORTS_CSV, metro_csv=METRO_AREAS_CSV):
+        started = time.perf_counter()
+        self.airports = {}
+        self.metros = {}
+        self._keys = {}
+        self._root = _TrieNode()
+        self._trigrams = {}
+
+        with open(airports_csv, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                code = row["iata"]
+                if code in CLOSED_AIRPORTS:
+                    continue
+                self.airports[code] = {
+                    "code": code, "name": row["name"], "city": row["city"] or row["name"],
+                    "region": row["subd"], "country": row["country"], "kind": "airport"
+                }
+
+        with open(metro_csv, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self.metros[row["code"]] = {
+                    "code": row["code"], "name": f"{row['city']} (all airports)", "city": row["city"],
+                    "region": "", "country": row["country"], "kind": "metro", "airports": row["airports"].split()
+                }
+
+        metro_members = {airport for metro in self.metros.values() for airport in metro["airports"]}
+        for code, airport in self.airports.items():
+            importance = _importance(airport["name"], code) + (2 if code in metro_members else 0)
+            city = normalize_place(airport["city"])
+            name = normalize_place(airport["name"])
+            self._add(city, code, importance + 1)
+            self._add(name, code, importance)
+            for word in set(name.split()):
+                if len(word) > 3 and word != city:
+                    self._add(word, code, importance - 1)
+
+        for code, metro in self.metros.items():
+            self._add(normalize_place(metro["city"]), code, 20)
+        for alias, code in ALIASES.items():
+            self._add(alias, code, 15)
+
+        for key in self._keys:
+            for gram in _trigrams(key):
+                self._trigrams.setdefault(gram, []).append(key)
+        self._freeze(self._root)
+
+        print(f"🗺️ Airport index: {len(self.airports)} airports, {len(self.metros)} metro areas, "
+              f"{len(self._keys)} names in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _add(self, key, code, score):
+        """Index `code` under the normalized `key` with a ranking score."""
+        if not key:
+            return
+        candidate = (score, code)
+        codes = self._keys.setdefault(key, [])
+        for index, (old_score, old_code) in enumerate(codes):
+            if old_code == code:
+                if score > old_score:
+                    codes[index] = candidate
+                break
+        else:
+            codes.append(candidate)
+        codes.sort(reverse=True)
+
+        node = self._root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode(char)
+            node = child
+            best = node.best
+            if len(best) >= TRIE_CANDIDATES and score <= best[-1][0]:
+                continue
+            existing = next((index for index, (_, old_code) in enumerate(best) if old_code == code), None)
+            if existing is not None:
+                if score <= best[existing][0]:
+                    continue
+                del best[existing]
+            position = len(best)
+            while position and best[position - 1][0] < score:
+                position -= 1
+            best.insert(position, candidate)
+            del best[TRIE_CANDIDATES:]
+        node.terminal = True
+
+    @staticmethod
+    def _freeze(root):
+        """
+        Merge chains of single-child nodes into one node with a multi-character
+        label (they share the same candidates), turn candidate lists into
+        tuples and drop empty leaf dicts, to keep the trie small.
+        """
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node.best = tuple(node.best)
+            for char, child in node.children.items():
+                while len(child.children) == 1 and not child.terminal:
+                    (grandchild,) = child.children.values()
+                    grandchild.label = child.label + grandchild.label
+                    child = grandchild
+                node.children[char] = child
+                stack.append(child)
+            if not node.children:
+                node.children = _NO_CHILDREN
+
+    def _prefix_candidates(self, key):
+        """The best (score, code) pairs for keys starting with `key`, or None."""
+        node, position = self._root, 0
+        while position < len(key):
+            node = node.children.get(key[position])
+            if node is None:
+                return None
+            label = node.label
+            if not key.startswith(label, position):
+                # The prefix may end part-way along this node's label
+                return node.best if label.startswith(key[position:]) else None
+            position += len(label)
+        return node.best
+
+    def entry(self, code):
+        """The airport or metro-area record for an IATA code, or None."""
+        code = (code or "").strip().upper()
+        return self.metros.get(code) or self.airports.get(code)
+
+    def lookup(self, text, limit=5):
+        """
+        Find airports and metro areas matching `text`, best first.
+
+        Tries, in order: an upper-case IATA code, an exact city/name/alias
+        match, a lower-case code, a prefix match and finally an
+        edit-distance match (1 typo for short words, 2 for longer ones).
+        So "GOA" is Genoa but "Goa" is the Indian state.
+
+        Args:
+            text (str): Airport code, city, airport name or alias
+            limit (int): Maximum number of candidates
+
+        Returns:
+            list: Airport/metro records, each with a "match" kind added
+        """
+        text = (text or "").strip()
+        is_code = CODE_RE.fullmatch(text) and self.entry(text)
+        if is_code and text.isupper():
+            return [{**self.entry(text), "match": "code"}]
+
+        key = normalize_place(text)
+        if not key:
+            return []
+        if key in self._keys:
+            return self._records(self._keys[key], limit, "exact")
+        if is_code:
+            return [{**self.entry(text), "match": "code"}]
+        candidates = self._prefix_candidates(key) if len(key) >= 3 else None
+        if candidates:
+            return self._records(candidates, limit, "prefix")
+        return self._records(self._fuzzy(key), limit, "fuzzy")
+
+    def _records(self, scored_codes, limit, match):
+        return [{**self.entry(code), "match": match} for _, code in scored_codes[:limit]]
+
+    def _fuzzy(self, key):
+        """(score, code) pairs for keys within a small edit distance of `key`, closest first."""
+        max_distance = 0 if len(key) < 4 else 1 if len(key) <= 6 else 2
+        if not max_distance:
+            return []
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        matches = {}
+        for candidate, _ in shared.most_common(FUZZY_SHORTLIST):
+            distance = edit_distance(key, candidate, max_distance)
+            if distance > max_distance:
+                continue
+            for score, code in self._keys[candidate]:
+                rank = (-distance, score)
+                if rank > matches.get(code, (-99, 0)):
+                    matches[code] = rank
+        ranked = sorted(matches.items(), key=lambda item: item[1], reverse=True)
+        return [(score, code) for code, (_, score) in ranked]
+
+    def _qualifies(self, record, qualifier):
+        """True if `qualifier` names the record's country or state/region, e.g. "France" or "OR"."""
+        if record["kind"] == "metro":
+            members = [self.airports[code] for code in record["airports"] if code in self.airports]
+            return any(self._qualifies(member, qualifier) for member in members)
+        key = normalize_place(qualifier)
+        return key and (
+            key in (normalize_place(record["region"]), record["country"].casefold())
+            or _country_code(key) == record["country"]
+            or (record["country"] == "US" and US_STATES.get(key) == record["region"])
+        )
+
+    def resolve(self, text):
+        """
+        Resolve free text to the code to search: an airport, a metro area,
+        or an airport set ("JFK,EWR") whose parts all resolve.
+
+        Trailing parts that name a country or state ("Paris, France",
+        "Portland, ME") qualify the first place rather than add airports.
+        Parts only form a set when each is a code or an exact city/airport
+        name. A qualifier that fits none of the first place's matches
+        ("San Jose, Narnia") gives no match rather than a guess.
+
+        Returns:
+            str: The IATA code(s), or None if nothing matches
+        """
+        parts = []
+        for part in AIRPORT_SET_SPLIT_RE.split((text or "").strip()):
+            part = part.strip()
+            # "JFK EWR" is a set of codes; "Ho Chi Minh" is one city
+            parts.extend(part.split() if CODE_LIST_RE.fullmatch(part) else [part] if part else [])
+        if not parts:
+            return None
+        candidates = self.lookup(parts[0], limit=TRIE_CANDIDATES)
+        if len(parts) == 1 or not candidates:
+            return candidates[0]["code"] if candidates else None
+
+        qualifiers = parts[1:]
+        for candidate in candidates:
+            if all(self._qualifies(candidate, qualifier) for qualifier in qualifiers):
+                return candidate["code"]
+
+        codes = [candidates[0]["code"]]
+        for part in qualifiers:
+            matches = self.lookup(part, limit=1)
+            if not matches or matches[0]["match"] not in ("code", "exact"):
+                return None
+            if matches[0]["code"] not in codes:
+                codes.append(matches[0]["code"])
+        return ",".join(codes)
+
+def _country_code(key):
+    """The country code a normalized qualifier names, allowing one typo in longer names ("frnace")."""
+    if key in COUNTRY_NAMES:
+        return COUNTRY_NAMES[key]
+    if len(key) >= 5:
+        for name, code in COUNTRY_NAMES.items():
+            if edit_distance(key, name, 1) <= 1:
+                return code
+    return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_airport_index():
+    """The shared AirportIndex, built on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AirportIndex()
+    return _index
+
+
+def load_metro_areas(metro_csv=METRO_AREAS_CSV):
+    """Metro-area code -> airport codes, read from the bundled CSV without building the index."""
+    with open(metro_csv, newline="", encoding="utf-8") as f:
+        return {row["code"]: row["airports"].split() for row in csv.DictReader(f)}
+
+
+def resolve_airport(text):
+    """Resolve a city, airport name, alias or code to IATA code(s); None if unknown."""
+    return get_airport_index().resolve(text)
+
+
+def place_name(text):
+    """
+    The place to search activities for, in one form whoever typed it:
+    a trailing country is dropped ("Paris, France" -> "Paris") and codes
+    become their city ("NYC" -> "New York"); other text is kept as is.
+    """
+    parts = [part.strip() for part in (text or "").split(",") if part.strip()]
+    if not parts:
+        return ""
+    if CODE_RE.fullmatch(parts[0]) and parts[0].isupper():
+        found = get_airport_index().entry(parts[0])
+        if found:
+            return found["city"]
+    while len(parts) > 1 and normalize_place(parts[-1]) in COUNTRY_NAMES:
+        parts.pop()
+    return ", ".join(parts)
+
+
+def suggest_airports(text, limit=3):
+    """Close matches for `text`, as "Name (CODE)" strings, for a "did you mean" reply."""
+    index = get_airport_index()
+    key = normalize_place(text)
+    suggestions = index.lookup(text, limit)
+    if not suggestions and len(key) >= 4:
+        # Retry on the longest word, e.g. "heathroww airport london" -> "heathroww"
+        longest = max(key.split(), key=len)
+        suggestions = index.lookup(longest, limit)
+    return [f"{item['name']} ({item['code']})" for item in suggestions]
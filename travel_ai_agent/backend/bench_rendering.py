@@ -0,0 +1,76 @@
+"""
+Compare building flight result text with `+=` against the generator render
+path (joined once, or streamed to a sink) on a large synthetic result set.
+
+Memory is reported as the tracemalloc peak of one build rather than an
+allocation count: tracemalloc only sees the blocks still alive, and the
+peak is what buffering the whole text (or not) changes.
+
+Usage: python bench_rendering.py [count] [repeats]
+"""
+import sys
+import time
+import tracemalloc
+from flight_models import FlightOption, FlightSegment, Layover
+from rendering import render_to_string, write_fragments
+from serpapi_utils import render_flights
+
+
+def make_flights(count):
+    """Synthetic two-segment flight options."""
+    options = []
+    for i in range(count):
+        segments = (
+            FlightSegment("United", f"UA {1000 + i}", "JFK", "John F. Kennedy International Airport", "2027-05-01 08:00",
+                          "ORD", "Chicago O'Hare International Airport", "2027-05-01 10:30", 150, "Boeing 737", "Economy"),
+            FlightSegment("United", f"UA {2000 + i}", "ORD", "Chicago O'Hare International Airport", "2027-05-01 12:05",
+                          "LHR", "Heathrow Airport", "2027-05-02 01:40", 455, "Boeing 787", "Economy")
+        )
+        options.append(FlightOption(400 + i, 700 + i, segments, (Layover("ORD", "Chicago O'Hare International Airport", 95),),
+                                    512000, 480000, 7))
+    search_info = {"origin": "JFK", "destination": "LHR", "departure_date": "2027-05-01", "adults": 1, "travel_class": "Economy"}
+    return {"search_info": search_info, "best_flights": options, "other_flights": []}
+
+
+def concatenated(fragments):
+    """The previous approach: grow one string with += for every piece."""
+    text = ""
+    for fragment in fragments:
+        text += fragment
+    return text
+
+
+def streamed(fragments):
+    """Stream to a sink that keeps nothing, as print_flights_to_terminal does with stdout."""
+    return write_fragments(fragments, len)
+
+
+def measure(build, flights_data, audience, repeats):
+    """Best time and tracemalloc peak of building one rendering."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        build(render_flights(flights_data, audience))
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    build(render_flights(flights_data, audience))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    flights_data = make_flights(count)
+    print(f"{count} flight options, best of {repeats} runs")
+    for audience in ("ai", "terminal"):
+        size = len(render_to_string(render_flights(flights_data, audience)))
+        print(f"\n{audience} ({size / 1024:.0f} KiB of text)")
+        for name, build in (("+=", concatenated), ("join", render_to_string), ("stream", streamed)):
+            seconds, peak = measure(build, flights_data, audience, repeats)
+            print(f"  {name:<7}{seconds * 1000:8.1f} ms   peak {peak / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Local stand-in for the upstream APIs that injects faults, to exercise the
+retries, timeouts, circuit breakers and hedging in shared/resilience.py.
+
+It answers like OpenRouter (POST /api/v1/chat/completions, streamed or
+not), Tavily (POST /search), SerpAPI (GET /search) and Telegram
+(POST /bot<token>/sendMessage). Each request gets one fault, drawn from
+the rates given, or taken in order from --script first:
+
+    ok      normal answer
+    503     the --status error (503 unless set)
+    429     rate limited
+    slow    normal answer after --slow-seconds
+    hang    no answer for an hour
+    reset   connection closed without an answer
+
+Serve, then point an app at it:
+
+    python fault_stub.py --port 8099 --error-rate 0.3 --slow-rate 0.1
+    OPENROUTER_URL=http://127.0.0.1:8099/api/v1/chat/completions TAVILY_URL=http://127.0.0.1:8099/search \\
+    SERPAPI_URL=http://127.0.0.1:8099 TELEGRAM_API_URL=http://127.0.0.1:8099 uvicorn main:app
+
+or check each behaviour against an in-process stub:
+
+    python fault_stub.py --check
+
+The same behaviours are asserted in tests/test_resilience.py (python -m pytest tests).
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class FaultPlan:
+    """Which fault each request gets: the scripted ones in order, then random by rate."""
+
+    def __init__(self, script=(), error_rate=0.0, status=503, slow_rate=0.0, slow_seconds=3.0, hang_rate=0.0,
+                 reset_rate=0.0):
+        self.script = deque(script)
+        self.error_rate = error_rate
+        self.status = status
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.hang_rate = hang_rate
+        self.reset_rate = reset_rate
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if self.script:
+                return self.script.popleft()
+        draw = random.random()
+        for fault, rate in (("hang", self.hang_rate), ("reset", self.reset_rate), (str(self.status), self.error_rate),
+                            ("slow", self.slow_rate)):
+            if draw < rate:
+                return fault
+            draw -= rate
+        return "ok"
+
+
+def _answer(path, method, body):
+    """The normal answer for a request, as (content type, bytes)."""
+    if path.endswith("/chat/completions"):
+        if body.get("stream"):
+            chunks = [{"choices": [{"delta": {"content": word}}]} for word in ("Stub ", "reply.")]
+            events = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return "text/event-stream", events.encode()
+        reply = {"choices": [{"message": {"role": "assistant", "content": "Stub reply."}}]}
+        return "application/json", json.dumps(reply).encode()
+    if path == "/search" and method == "POST":
+        reply = {"query": body.get("query"), "answer": "Stub answer.", "results": [], "images": []}
+        return "application/json", json.dumps(reply).encode()
+    if path == "/search":
+        return "application/json", json.dumps({"best_flights": [], "other_flights": []}).encode()
+    if path.endswith("/sendMessage"):
+        return "application/json", json.dumps({"ok": True, "result": {"message_id": 1}}).encode()
+    return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw and raw[:1] == b"{" else {}
+        except ValueError:
+            body = {}
+        server = self.server
+        fault = server.plan.next()
+        with server.lock:
+            server.hits[path] += 1
+            server.faults[fault] += 1
+
+        if fault == "hang":
+            time.sleep(3600)
+            return
+        if fault == "reset":
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if fault == "slow":
+            time.sleep(server.plan.slow_seconds)
+        answer = _answer(path, method, body)
+        if fault.isdigit():
+            status, content_type, payload = int(fault), "application/json", json.dumps({"error": {"message": f"Injected {fault}"}}).encode()
+        elif answer is None:
+            status, content_type, payload = 404, "application/json", b'{"error": {"message": "Unknown path"}}'
+        else:
+            status, (content_type, payload) = 200, answer
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def start_stub(plan, port=0):
+    """Serve the stub on a background thread; returns the server (its URL is server.url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.plan = plan
+    server.lock = threading.Lock()
+    server.hits = Counter()
+    server.faults = Counter()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check():
+    """Run each resilience behaviour against a scripted stub and report pass/fail."""
+    import httpx
+    import requests
+    import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+    from shared.resilience import Upstream, CircuitOpenError, retryable_status
+
+    results = []
+
+    def report(name, ok, detail):
+        results.append(ok)
+        print(f"{'✅' if ok else '❌'} {name}: {detail}")
+
+    server = start_stub(FaultPlan(slow_seconds=1.5))
+    search_url = f"{server.url}/search"
+
+    def scripted(*faults):
+        server.plan.script.extend(faults)
+
+    # Retry: two 503s, then an answer
+    scripted("503", "503", "ok")
+    upstream = Upstream("retry", timeout=2, retries=2, backoff_base=0.05)
+    response = upstream.call(requests.post, search_url, json={"query": "x"}, timeout=upstream.timeout, retry_if=retryable_status)
+    report("retry with backoff", response.status_code == 200 and upstream.stats["retries"] == 2,
+           f"HTTP {response.status_code} after {upstream.stats['retries']} retries")
+
+    # Timeout: a hung upstream costs one timeout per attempt, not the worker
+    scripted("hang", "ok")
+    upstream = Upstream("timeout", timeout=0.5, retries=1, backoff_base=0.05)
+    started = time.perf_counter()
+    response = upstream.call(requests.post, search_url, json={"query": "x"}, timeout=upstream.timeout)
+    elapsed = time.perf_counter() - started
+    report("per-attempt timeout", response.ok and elapsed < 1.5, f"answered after {elapsed:.2f}s despite a hung attempt")
+
+    # Not idempotent: a read timeout may mean the message went out, so no retry
+    scripted("hang", "ok")
+    upstream = Upstream("telegram", timeout=0.5, retries=3, backoff_base=0.05)
+    try:
+        upstream.call(requests.post, f"{server.url}/botX/sendMessage", data={"text": "x"}, timeout=upstream.timeout,
+                      idempotent=False)
+        sent = True
+    except requests.Timeout:
+        sent = False
+    report("no retry of non-idempotent sends", not sent and upstream.stats["retries"] == 0, "read timeout raised, not resent")
+    server.plan.script.clear()
+
+    # Circuit breaker: opens after 3 failures, fails fast, then a probe closes it
+    upstream = Upstream("breaker", timeout=1, retries=0, failure_threshold=3, reset_timeout=0.5)
+    scripted("503", "503", "503")
+    for _ in range(3):
+        upstream.call(requests.post, search_url, json={}, timeout=upstream.timeout, retry_if=retryable_status)
+    hits = sum(server.hits.values())
+    started = time.perf_counter()
+    try:
+        upstream.call(requests.post, search_url, json={}, timeout=upstream.timeout)
+        failed_fast = False
+    except CircuitOpenError:
+        failed_fast = sum(server.hits.values()) == hits
+    fast_ms = (time.perf_counter() - started) * 1000
+    time.sleep(0.6)
+    probe = upstream.call(requests.post, search_url, json={}, timeout=upstream.timeout)
+    report("circuit breaker", failed_fast and probe.ok and upstream.breaker.state == "closed",
+           f"open after 3 failures, rejected in {fast_ms:.2f} ms without a request, closed by a probe")
+
+    # Hedging: a slow first attempt loses to a duplicate sent after the hedge delay
+    async def hedge():
+        upstream = Upstream("hedge", timeout=5, retries=0, hedge_delay=0.3)
+        async with httpx.AsyncClient() as client:
+            scripted("slow", "ok")
+            started = time.perf_counter()
+            response = await upstream.acall(client.post, f"{server.url}/api/v1/chat/completions", json={}, hedge=True)
+            return response, time.perf_counter() - started, upstream
+    response, elapsed, upstream = asyncio.run(hedge())
+    report("hedged request", response.status_code == 200 and elapsed < 1.0 and upstream.stats["hedge_wins"] == 1,
+           f"answered in {elapsed:.2f}s while the first attempt took {server.plan.slow_seconds:g}s")
+
+    # The LLM client end to end: retried 503 (non-streamed) and a retried stream open
+    import ai_utils
+    client = ai_utils.LLMClient(f"{server.url}/api/v1/chat/completions", "key", "model")
+    client.upstream = Upstream("llm-check", timeout=5, retries=2, backoff_base=0.05)
+
+    async def llm():
+        scripted("503", "ok")
+        reply = await client.acomplete([{"role": "user", "content": "hi"}])
+        scripted("reset", "ok")
+        streamed = [delta async for delta in client.astream([{"role": "user", "content": "hi"}])]
+        await client.aclose()
+        return reply, "".join(streamed)
+    reply, streamed = asyncio.run(llm())
+    report("LLM client retries", reply == "Stub reply." and streamed == "Stub reply.",
+           f"{reply!r} / streamed {streamed!r} after {client.upstream.stats['retries']} retries")
+
+    server.shutdown()
+    print(f"\n{sum(results)}/{len(results)} checks passed")
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--script", default="", help="Comma-separated faults for the first requests, e.g. 503,503,ok")
+    parser.add_argument("--check", action="store_true", help="Run the resilience checks and exit")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check() else 1)
+
+    plan = FaultPlan([fault for fault in args.script.split(",") if fault], args.error_rate, args.status, args.slow_rate,
+                     args.slow_seconds, args.hang_rate, args.reset_rate)
+    server = start_stub(plan, args.port)
+    print(f"🧪 Fault stub listening on {server.url}")
+    try:
+        while True:
+            time.sleep(10)
+            with server.lock:
+                print(f"📊 requests {dict(server.hits)}, faults {dict(server.faults)}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
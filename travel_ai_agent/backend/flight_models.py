@@ -0,0 +1,146 @@
+import sys
+from dataclasses import dataclass
+
+
+def _text(value):
+    """Intern a repeated string (airline, airport, aircraft) so every result shares one copy."""
+    return sys.intern(value) if isinstance(value, str) and value else None
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _compact(fields):
+    """Drop unset fields from an API dict."""
+    return {key: value for key, value in fields.items() if value is not None and value != ()}
+
+
+@dataclass(slots=True)
+class FlightSegment:
+    """One leg of a flight option."""
+    airline: str
+    flight_number: str | None = None
+    departure_id: str | None = None
+    departure_name: str | None = None
+    departure_time: str | None = None
+    arrival_id: str | None = None
+    arrival_name: str | None = None
+    arrival_time: str | None = None
+    duration: int | None = None
+    airplane: str | None = None
+    travel_class: str | None = None
+
+    @classmethod
+    def from_serpapi(cls, flight):
+        departure = flight.get("departure_airport") or {}
+        arrival = flight.get("arrival_airport") or {}
+        return cls(
+            airline=_text(flight.get("airline")) or "Unknown",
+            flight_number=flight.get("flight_number") or None,
+            departure_id=_text(departure.get("id")),
+            departure_name=_text(departure.get("name")),
+            departure_time=departure.get("time") or None,
+            arrival_id=_text(arrival.get("id")),
+            arrival_name=_text(arrival.get("name")),
+            arrival_time=arrival.get("time") or None,
+            duration=_number(flight.get("duration")),
+            airplane=_text(flight.get("airplane")),
+            travel_class=_text(flight.get("travel_class"))
+        )
+
+    def to_api(self):
+        return _compact({
+            "airline": self.airline,
+            "flight_number": self.flight_number,
+            "from": self.departure_id,
+            "to": self.arrival_id,
+            "departs": self.departure_time,
+            "arrives": self.arrival_time,
+            "duration": self.duration,
+            "airplane": self.airplane
+        })
+
+
+@dataclass(slots=True)
+class Layover:
+    """A connection between two segments."""
+    airport_id: str | None = None
+    name: str | None = None
+    duration: int | None = None
+    overnight: bool = False
+
+    @classmethod
+    def from_serpapi(cls, layover):
+        return cls(
+            airport_id=_text(layover.get("id")),
+            name=_text(layover.get("name")),
+            duration=_number(layover.get("duration")),
+            overnight=bool(layover.get("overnight"))
+        )
+
+    def to_api(self):
+        return _compact({
+            "airport": self.airport_id,
+            "duration": self.duration,
+            "overnight": self.overnight or None
+        })
+
+
+@dataclass(slots=True)
+class FlightOption:
+    """
+    One bookable itinerary from a Google Flights search.
+
+    Only the fields the app reads are kept; logos, booking tokens and
+    "N/A" placeholders are not stored. Missing values are None.
+    """
+    price: int | None = None
+    total_duration: int | None = None
+    segments: tuple = ()
+    layovers: tuple = ()
+    emissions: int | None = None
+    typical_emissions: int | None = None
+    emissions_difference_percent: int | None = None
+
+    @classmethod
+    def from_serpapi(cls, option):
+        """
+        Build a FlightOption from a raw SerpAPI "best_flights"/"other_flights" entry.
+
+        Returns:
+            FlightOption: The parsed option, or None if it has no flights
+        """
+        flights = option.get("flights") or []
+        if not flights:
+            return None
+        carbon = option.get("carbon_emissions") or {}
+        return cls(
+            price=_number(option.get("price")),
+            total_duration=_number(option.get("total_duration")),
+            segments=tuple(FlightSegment.from_serpapi(flight) for flight in flights),
+            layovers=tuple(Layover.from_serpapi(layover) for layover in option.get("layovers") or []),
+            emissions=_number(carbon.get("this_flight")),
+            typical_emissions=_number(carbon.get("typical_for_this_route")),
+            emissions_difference_percent=_number(carbon.get("difference_percent"))
+        )
+
+    @property
+    def stops(self):
+        return max(len(self.segments) - 1, 0)
+
+    @property
+    def airline(self):
+        return self.segments[0].airline if self.segments else "Unknown"
+
+    def to_api(self):
+        """Lean JSON form for API responses: unset fields left out, airports as codes."""
+        return _compact({
+            "price": self.price,
+            "total_duration": self.total_duration,
+            "stops": self.stops,
+            "segments": [segment.to_api() for segment in self.segments],
+            "layovers": [layover.to_api() for layover in self.layovers] or None,
+            "emissions": self.emissions,
+            "emissions_difference_percent": self.emissions_difference_percent
+        })
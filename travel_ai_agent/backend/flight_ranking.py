@@ -0,0 +1,267 @@
+import os
+import re
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Flight options sent to the AI per search; the API response keeps them all
+TOP_K_FLIGHTS = int(os.getenv("TOP_K_FLIGHTS", "5"))
+
+# Default importance of each criterion in the combined score (lower score = better)
+DEFAULT_WEIGHTS = {"price": 1.0, "duration": 0.5, "stops": 0.3, "emissions": 0.1}
+PREFERRED_WEIGHT = 3.0
+
+# Departure windows in minutes after midnight: (from, until)
+DEPARTURE_WINDOWS = {
+    "early morning": (0, 7 * 60),
+    "morning": (5 * 60, 12 * 60),
+    "afternoon": (12 * 60, 17 * 60),
+    "evening": (17 * 60, 22 * 60),
+    "night": (20 * 60, 24 * 60),
+    "red-eye": (21 * 60, 24 * 60)
+}
+
+# Words in the user's message that shift the ranking towards one criterion
+PREFERENCE_PATTERNS = {
+    "price": re.compile(r"\b(cheap\w*|budget|lowest (?:price|fare)|least expensive|affordable)\b", re.I),
+    "duration": re.compile(r"\b(fast\w*|quick\w*|short\w*|least time)\b", re.I),
+    # Whole words only: "economy" is a cabin and "Greenville" a city, not a green preference
+    "emissions": re.compile(
+        r"\b(green(?:er|est)?|eco[- ]?friendly|ecological(?:ly)?|environment(?:al(?:ly)?)?[- ]friendly|"
+        r"emissions?|carbon|sustainab\w*)\b", re.I
+    ),
+}
+NONSTOP_RE = re.compile(r"\b(non-?stop|direct)\b", re.I)
+ONE_STOP_RE = re.compile(r"\b(?:at most |max(?:imum)? |no more than )?(?:one|1) stop\b", re.I)
+WINDOW_RE = re.compile(r"\b(early morning|morning|afternoon|evening|night|red-?eye)\b", re.I)
+TIME_RE = re.compile(r"(\d{1,2}):(\d{2})\s*$")
+
+RELAXED_LABELS = {
+    "airlines": "airline", "departure_window": "departure time", "max_price": "price limit",
+    "max_stops": "number of stops", "exclude_airlines": "excluded airlines"
+}
+
+# When no option passes every filter, filters are dropped in this order until some do
+RELAX_ORDER = ("airlines", "departure_window", "max_price", "max_stops", "exclude_airlines")
+
+
+class FlightTable:
+    """
+    Column view of flight options for vectorized ranking: one numpy array
+    per criterion, NaN where SerpAPI gave no value.
+
+    Args:
+        options (list): FlightOption objects
+    """
+
+    def __init__(self, options):
+        self.options = list(options)
+        count = len(self.options)
+        self.price = np.full(count, np.nan)
+        self.duration = np.full(count, np.nan)
+        self.stops = np.zeros(count)
+        self.emissions = np.full(count, np.nan)
+        self.departure = np.full(count, np.nan)
+        self.airline = np.empty(count, dtype=object)
+        for index, option in enumerate(self.options):
+            if option.price is not None:
+                self.price[index] = option.price
+            if option.total_duration is not None:
+                self.duration[index] = option.total_duration
+            if option.emissions_difference_percent is not None:
+                self.emissions[index] = option.emissions_difference_percent
+            self.stops[index] = option.stops
+            self.departure[index] = _minutes_after_midnight(option.segments[0].departure_time if option.segments else None)
+            self.airline[index] = option.airline.casefold()
+
+    def __len__(self):
+        return len(self.options)
+
+    def column(self, name):
+        return getattr(self, name)
+
+    def mask(self, max_stops=None, max_price=None, departure_window=None, airlines=None, exclude_airlines=None):
+        """
+        Boolean array of the options passing every given filter.
+
+        Args:
+            max_stops (int, optional): Most connections allowed
+            max_price (float, optional): Highest price allowed
+            departure_window (tuple, optional): (from, until) minutes after midnight
+            airlines (iterable, optional): Keep only these airlines (case-insensitive)
+            exclude_airlines (iterable, optional): Drop these airlines
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if max_stops is not None:
+            keep &= self.stops <= max_stops
+        if max_price is not None:
+            keep &= self.price <= max_price
+        if departure_window is not None:
+            start, end = departure_window
+            keep &= (self.departure >= start) & (self.departure < end)
+        if airlines:
+            keep &= np.isin(self.airline, [airline.casefold() for airline in airlines])
+        if exclude_airlines:
+            keep &= ~np.isin(self.airline, [airline.casefold() for airline in exclude_airlines])
+        return keep
+
+    def scores(self, weights=DEFAULT_WEIGHTS):
+        """
+        Weighted sum of each criterion scaled to 0 (best) .. 1 (worst) across
+        the table; a missing value counts as the worst.
+        """
+        total = np.zeros(len(self))
+        for name, weight in weights.items():
+            if weight:
+                total += weight * _scaled(self.column(name))
+        return total
+
+    def pareto_front(self, rows=None, objectives=("price", "duration", "stops")):
+        """
+        Boolean array of the options no other option beats on every objective
+        (at least as good on all, strictly better on one). Missing values
+        count as infinitely bad.
+
+        Args:
+            rows (np.ndarray, optional): Boolean mask of the options to compare; others are never on the front
+            objectives (tuple): Columns to compare, lower is better
+        """
+        rows = np.ones(len(self), dtype=bool) if rows is None else rows
+        values = np.column_stack([np.nan_to_num(self.column(name)[rows], nan=np.inf) for name in objectives])
+        # dominated[i, j]: option j is at least as good as option i everywhere and better somewhere
+        dominated = (
+            (values[None, :, :] <= values[:, None, :]).all(axis=2)
+            & (values[None, :, :] < values[:, None, :]).any(axis=2)
+        )
+        front = np.zeros(len(self), dtype=bool)
+        front[rows] = ~dominated.any(axis=1)
+        return front
+
+
+def _minutes_after_midnight(timestamp):
+    """Minutes after midnight of a SerpAPI "YYYY-MM-DD HH:MM" time, or NaN."""
+    match = TIME_RE.search(timestamp or "")
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else np.nan
+
+
+def _scaled(values):
+    """Min-max scale to 0..1, with NaN (no value) as 1."""
+    scaled = np.ones(len(values))
+    known = ~np.isnan(values)
+    if known.any():
+        low, high = values[known].min(), values[known].max()
+        scaled[known] = (values[known] - low) / (high - low) if high > low else 0.0
+    return scaled
+
+
+def preferences_from_text(text, airlines=()):
+    """
+    Read ranking preferences from the user's message: "cheapest", "fastest",
+    "greenest", "nonstop"/"one stop", a departure window ("morning flights")
+    and airlines from the results that the message names.
+
+    Args:
+        text (str): The user's message
+        airlines (iterable): Airline names present in the results
+
+    Returns:
+        dict: Keyword arguments for rank_flights
+    """
+    text = text or ""
+    preferences = {}
+    weights = dict(DEFAULT_WEIGHTS)
+    for criterion, pattern in PREFERENCE_PATTERNS.items():
+        if pattern.search(text):
+            weights[criterion] = PREFERRED_WEIGHT
+    if weights != DEFAULT_WEIGHTS:
+        preferences["weights"] = weights
+    if NONSTOP_RE.search(text):
+        preferences["max_stops"] = 0
+    elif ONE_STOP_RE.search(text):
+        preferences["max_stops"] = 1
+    window = WINDOW_RE.search(text)
+    if window:
+        name = window.group(1).lower().replace("redeye", "red-eye")
+        preferences["departure_window"] = DEPARTURE_WINDOWS[name]
+    lowered = text.casefold()
+    named = sorted({airline for airline in airlines if airline and airline.casefold() in lowered})
+    if named:
+        preferences["airlines"] = named
+    return preferences
+
+
+def rank_flights(options, limit=TOP_K_FLIGHTS, weights=DEFAULT_WEIGHTS, **filters):
+    """
+    Pick the `limit` most relevant flight options.
+
+    Options failing the filters are dropped; if none pass, filters are
+    relaxed one at a time in RELAX_ORDER until some do. The Pareto-optimal options on price, duration and stops are
+    taken first, best score first, and the remaining places go to the best
+    scoring of the rest. The result is ordered by score.
+
+    Args:
+        options (list): FlightOption objects
+        limit (int): Number of options to return
+        weights (dict): Criterion -> weight for the combined score
+        **filters: max_stops, max_price, departure_window, airlines, exclude_airlines (see FlightTable.mask)
+
+    Returns:
+        tuple: (ranked options, names of the filters that had to be dropped)
+    """
+    table = FlightTable(options)
+    if not len(table):
+        return [], []
+
+    filters = {name: value for name, value in filters.items() if value is not None}
+    relaxed = []
+    keep = table.mask(**filters)
+    for name in RELAX_ORDER:
+        if keep.any():
+            break
+        if name in filters:
+            del filters[name]
+            relaxed.append(name)
+            keep = table.mask(**filters)
+
+    scores = np.where(keep, table.scores(weights), np.inf)
+    front = table.pareto_front(keep)
+    # Pareto options sort ahead of the rest; within each group, lower score first
+    order = np.lexsort((scores, ~front))
+    chosen = order[:min(limit, int(keep.sum()))]
+    chosen = chosen[np.argsort(scores[chosen], kind="stable")]
+    return [table.options[index] for index in chosen], relaxed
+
+
+def select_flights(flights_data, user_text="", limit=TOP_K_FLIGHTS):
+    """
+    Reduce a search result to its `limit` most relevant options for the AI,
+    ranked locally according to the preferences in the user's message.
+
+    Args:
+        flights_data (dict): search_flights / search_flight_date_matrix result
+        user_text (str): The user's message, for preferences
+        limit (int): Number of options to keep
+
+    Returns:
+        dict: A copy with the chosen options as "best_flights", no
+            "other_flights", and in "search_info" the number of options
+            found and the preferences nothing matched
+    """
+    if not flights_data or "error" in flights_data:
+        return flights_data
+    options = flights_data.get("best_flights", []) + flights_data.get("other_flights", [])
+    preferences = preferences_from_text(user_text, {option.airline for option in options})
+    ranked, relaxed = rank_flights(options, limit, **preferences)
+    print(f"🏅 Ranked {len(options)} flight options, sending {len(ranked)}"
+          + (f" (preferences: {', '.join(sorted(preferences))})" if preferences else ""))
+    return {
+        **flights_data,
+        "search_info": {
+            **flights_data.get("search_info", {}),
+            "options_found": len(options),
+            "preferences_relaxed": [RELAXED_LABELS[name] for name in relaxed]
+        },
+        "best_flights": ranked,
+        "other_flights": []
+    }
@@ -1,26 +1,40 @@
-import json
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from ai_utils import ask_ai_with_history
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from ai_utils import (
+    ask_ai_with_history_async, stream_ai_events, close_ai_client, get_llm_stats, sse_event,
+    function_tool, tool_call_message, tool_result_message, user_query_text
+)
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.session_store import create_session_store
+from shared.context_window import context_messages, compact_history, prompt_token_stats
+from airport_index import get_airport_index, place_name
+from flight_ranking import select_flights
+from trip_prefetch import prefetch_trip, prefetcher
+from shared.resilience import upstream_stats
 
 # Import Tavily utilities
 try:
-    from tavily_utils import search_activities, format_activities_response, format_activities_for_user, validate_tavily_api
+    from tavily_utils import search_activities, format_activities_response, format_activities_for_user, validate_tavily_api, activity_cache
 except ImportError:
     # Fallback import if there are path issues
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    from tavily_utils import search_activities, format_activities_response, format_activities_for_user, validate_tavily_api
+    from tavily_utils import search_activities, format_activities_response, format_activities_for_user, validate_tavily_api, activity_cache
 
 # Import Flight utilities
 try:
     from serpapi_utils import (
         search_flights, format_flights_response, 
         format_flights_for_user, validate_serpapi,
-        print_flights_to_terminal
+        print_flights_to_terminal, flight_cache,
+        search_flight_date_matrix, check_flight_search, flights_to_api
     )
 except ImportError:
     # Fallback import if there are path issues
@@ -30,7 +44,8 @@ except ImportError:
     from serpapi_utils import (
         search_flights, format_flights_response, 
         format_flights_for_user, validate_serpapi,
-        print_flights_to_terminal
+        print_flights_to_terminal, flight_cache,
+        search_flight_date_matrix, check_flight_search, flights_to_api
     )
 
 # Load environment variables
@@ -38,6 +53,10 @@ load_dotenv()
 
 app = FastAPI()
 
+# Per-source time limits (seconds) for the searches run when travel data is complete
+FLIGHT_SEARCH_TIMEOUT = float(os.getenv("FLIGHT_SEARCH_TIMEOUT", "25"))
+ACTIVITY_SEARCH_TIMEOUT = float(os.getenv("ACTIVITY_SEARCH_TIMEOUT", "15"))
+
 # Add CORS middleware to allow frontend communication
 app.add_middleware(
     CORSMiddleware,
@@ -47,124 +66,140 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize chat history with improved system message
-chat_history = [
-    {
-        "role": "system", 
-        "content": (
-            "You are TripAI, a smart AI travel assistant. Your job is to collect travel information from users step by step and return it in JSON format when complete, AND to help with activity recommendations and flight searches.\n\n"
-            
-            "ACTIVITY SEARCH CAPABILITY:\n"
-            "When a user asks about activities, attractions, things to do, or travel recommendations for a specific place, you should request a search by responding with:\n"
-            "SEARCH_ACTIVITIES: [location] | [user_query]\n"
-            "Where [location] is the destination they're asking about and [user_query] is their original question.\n"
-            "For example:\n"
-            "- User: 'What are the best things to do in Paris?'\n"
-            "- Your response: 'SEARCH_ACTIVITIES: Paris | What are the best things to do in Paris?'\n"
-            "- User: 'I want activities in Tokyo for families'\n"
-            "- Your response: 'SEARCH_ACTIVITIES: Tokyo | I want activities in Tokyo for families'\n"
-            "- User: 'Tell me about attractions in London'\n"
-            "- Your response: 'SEARCH_ACTIVITIES: London | Tell me about attractions in London'\n\n"
-            
-            "FLIGHT SEARCH CAPABILITY:\n"
-            "When a user asks about flights, mentions wanting to search for flights, or when you have complete travel data, you should request a flight search by responding with:\n"
-            "SEARCH_FLIGHTS: origin|destination|departure_date|return_date|adults|travel_class\n"
-            "For example:\n"
-            "- User: 'Find me flights from JFK to LAX on 2025-03-15'\n"
-            "- Your response: 'SEARCH_FLIGHTS: JFK|LAX|2025-03-15||1|Economy'\n"
-            "- User: 'I need round trip flights from New York to London, leaving March 15 and returning March 22 for 2 people'\n"
-            "- Your response: 'SEARCH_FLIGHTS: JFK|LHR|2025-03-15|2025-03-22|2|Economy'\n"
-            "- User: 'Show me business class flights'\n"
-            "- Your response: 'SEARCH_FLIGHTS: JFK|LAX|2025-03-15|2025-03-22|1|Business'\n\n"
-            
-            "IMPORTANT FLIGHT SEARCH RULES:\n"
-            "- Use empty string (||) for return_date if one-way trip\n"
-            "- Convert city names to airport codes (NYC→JFK, LA→LAX, London→LHR, Paris→CDG, etc.)\n"
-            "- Valid travel classes: Economy, Premium Economy, Business, First\n"
-            "- When you receive FLIGHT_SEARCH_RESULTS, use ONLY that flight data\n"
-            "- Present flight results with prices, times, airlines, and durations clearly\n\n"
-            
-            "CRITICAL: When you receive ACTIVITY_SEARCH_RESULTS or FLIGHT_SEARCH_RESULTS, you MUST use ONLY the information from those search results. Do not add generic information or your own knowledge. Present the search results exactly as they are provided, including:\n"
-            "- The overview/summary from the search\n"
-            "- Each numbered recommendation with its exact title, score, description, and URL\n"
-            "- The available images with their URLs\n"
-            "- The search query that was used\n"
-            "Format this information in a user-friendly way but do not modify or add to the content.\n\n"
-            
-            "COLLECTION PROCESS:\n"
-            "Collect these details in a natural conversation (don't repeat questions if user already provided info):\n"
-            "1. ORIGIN (where they're traveling FROM)\n"
-            "2. DESTINATION (where they're traveling TO)\n"
-            "3. NUMBER OF TRAVELERS\n"
-            "4. DEPARTURE DATE\n"
-            "5. RETURN DATE\n"
-            "6. ACTIVITIES (optional - if they don't have preferences, offer recommendations)\n\n"
-            
-            "IMPORTANT RULES:\n"
-            "- Be conversational and remember what the user has already told you\n"
-            "- If user provides multiple details at once, acknowledge all of them and only ask for what's missing\n"
-            "- Don't repeat questions for information already provided\n"
-            "- Use your intelligence to understand context and determine when users are asking for activity information\n"
-            "- Ask follow-up questions naturally, not like a form\n"
-            "- When you receive search results, YOU MUST USE ONLY THAT DATA - no generic information\n\n"
-            
-            "CONVERSATION STYLE:\n"
-            "- Be natural and engaging, like a helpful travel agent\n"
-            "- Use emojis sparingly\n"
-            "- Vary your language (don't sound robotic)\n"
-            "- If user asks non-travel questions, gently redirect but stay friendly\n"
-            "- Show excitement about destinations and activities\n\n"
-            
-            "AIRPORT CODES & DATES:\n"
-            "- Convert city names to their main airport codes intelligently (e.g., 'New York' → 'JFK', 'Los Angeles' → 'LAX', 'London' → 'LHR')\n"
-            "- Format ALL dates as YYYY-MM-DD (e.g., 'March 15th' → '2025-03-15', '12/25/2025' → '2025-12-25')\n"
-            "- Use your intelligence to parse any date format users provide\n"
-            "- If you're unsure about an airport code, use the most common/main airport for that city\n"
-            "- Handle relative dates intelligently (e.g., 'next Friday', 'in 2 weeks') based on current date context\n\n"
-            
-            "WHEN TO PROVIDE JSON:\n"
-            "Only when you have ALL required information (origin, destination, travelers, departure, return), respond with:\n"
-            "TRAVEL_DATA_COMPLETE\n"
-            "{\"origin\": \"AIRPORT_CODE\", \"destination\": \"AIRPORT_CODE\", \"travelers\": number, \"departure\": \"YYYY-MM-DD\", \"return\": \"YYYY-MM-DD\", \"activities\": \"preferences or recommendations\"}\n\n"
-            
-            "After providing travel data, you can offer to search for flights using the flight search capability.\n\n"
-            "Continue the conversation normally after providing any search results."
-        )
-    }
-]
+@app.on_event("startup")
+async def load_airport_index():
+    """Build the airport index up front so the first flight search doesn't wait for it."""
+    await run_in_threadpool(get_airport_index)
 
-def extract_ai_content(ai_response):
-    """
-    Extract the actual content from AI API response
-    
-    Args:
-        ai_response: Raw AI response (could be dict or string)
+@app.on_event("shutdown")
+async def shutdown_clients():
+    """Close the session store and the shared LLM HTTP client when the server stops."""
+    await run_in_threadpool(sessions.close)
+    await close_ai_client()
+
+# Each user's chat history lives in their own session
+sessions = create_session_store(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3"))
+
+# System message sent ahead of every session's history
+SYSTEM_MESSAGE = {
+    "role": "system", 
+    "content": (
+        "You are TripAI, a smart AI travel assistant. Your job is to collect travel information from users step by step and save it with the save_travel_details tool when complete, AND to help with activity recommendations and flight searches.\n\n"
         
-    Returns:
-        str: The actual AI message content
+        "TOOLS:\n"
+        "- search_activities: when the user asks about activities, attractions, things to do or recommendations for a place\n"
+        "- search_flights: when the user asks about flights or wants prices; set flex_days (1-3) when they are flexible or ask about cheaper nearby dates\n"
+        "- save_travel_details: as soon as you know ALL of origin, destination, travelers, departure and return\n"
+        "Call the tools directly instead of announcing them, and call several in the same turn when the request needs them "
+        "(e.g. flights and activities for the same trip). Airports may be given as codes, metro codes (NYC, LON) or city names.\n\n"
+        
+        "CRITICAL: When you receive ACTIVITY_SEARCH_RESULTS or FLIGHT_SEARCH_RESULTS, you MUST use ONLY the information from those search results. Do not add generic information or your own knowledge. Present the search results exactly as they are provided, including:\n"
+        "- The overview/summary from the search\n"
+        "- Each numbered recommendation with its exact title, score, description, and URL\n"
+        "- The available images with their URLs\n"
+        "- The search query that was used\n"
+        "Format this information in a user-friendly way but do not modify or add to the content.\n\n"
+        
+        "COLLECTION PROCESS:\n"
+        "Collect these details in a natural conversation (don't repeat questions if user already provided info):\n"
+        "1. ORIGIN (where they're traveling FROM)\n"
+        "2. DESTINATION (where they're traveling TO)\n"
+        "3. NUMBER OF TRAVELERS\n"
+        "4. DEPARTURE DATE\n"
+        "5. RETURN DATE\n"
+        "6. ACTIVITIES (optional - if they don't have preferences, offer recommendations)\n\n"
+        
+        "IMPORTANT RULES:\n"
+        "- Be conversational and remember what the user has already told you\n"
+        "- If user provides multiple details at once, acknowledge all of them and only ask for what's missing\n"
+        "- Don't repeat questions for information already provided\n"
+        "- Use your intelligence to understand context and determine when users are asking for activity information\n"
+        "- Ask follow-up questions naturally, not like a form\n"
+        "- When you receive search results, YOU MUST USE ONLY THAT DATA - no generic information\n\n"
+        
+        "CONVERSATION STYLE:\n"
+        "- Be natural and engaging, like a helpful travel agent\n"
+        "- Use emojis sparingly\n"
+        "- Vary your language (don't sound robotic)\n"
+        "- If user asks non-travel questions, gently redirect but stay friendly\n"
+        "- Show excitement about destinations and activities\n\n"
+        
+        "AIRPORT CODES & DATES:\n"
+        "- Format ALL dates as YYYY-MM-DD (e.g., 'March 15th' → '2025-03-15', '12/25/2025' → '2025-12-25')\n"
+        "- Use your intelligence to parse any date format users provide\n"
+        "- If you're unsure about an airport code, use the city name\n"
+        "- Handle relative dates intelligently (e.g., 'next Friday', 'in 2 weeks') based on current date context\n\n"
+        
+        "After saving travel details, you can offer to search for flights.\n\n"
+        "Continue the conversation normally after providing any search results."
+    )
+}
+
+def chat_messages(session):
     """
-    # If it's already a string, return it
-    if isinstance(ai_response, str):
-        return ai_response
-    
-    # If it's a dict (API response format), extract the content
-    if isinstance(ai_response, dict):
-        try:
-            # Handle the specific API response format you're using
-            if 'choices' in ai_response and len(ai_response['choices']) > 0:
-                message = ai_response['choices'][0].get('message', {})
-                return message.get('content', str(ai_response))
-            else:
-                return str(ai_response)
-        except (KeyError, IndexError, TypeError):
-            return str(ai_response)
-    
-    return str(ai_response)
+    The messages sent to the AI: the system message, a digest of older turns
+    and as much recent history as fits the token budget.
+    """
+    return context_messages(SYSTEM_MESSAGE, session)
+
+# Place arguments accept everything check_flight_search resolves
+PLACE_DESCRIPTION = (
+    "Airport code, metro code covering every airport of a city (NYC, LON, PAR, TYO), "
+    "comma-separated airports (JFK,EWR) or a city/airport name"
+)
+
+# Tools the AI can call; arguments are type-checked against these schemas before running
+TRAVEL_TOOLS = [
+    function_tool(
+        "search_activities",
+        "Search the web for activities, attractions and things to do at a destination.",
+        {
+            "location": {"type": "string", "description": "The destination, e.g. 'Paris'"},
+            "query": {"type": "string", "description": "The user's request in their own words"}
+        },
+        required=("location",)
+    ),
+    function_tool(
+        "search_flights",
+        "Search live flight prices and schedules.",
+        {
+            "origin": {"type": "string", "description": PLACE_DESCRIPTION},
+            "destination": {"type": "string", "description": PLACE_DESCRIPTION},
+            "departure_date": {"type": "string", "description": "YYYY-MM-DD"},
+            "return_date": {"type": "string", "description": "YYYY-MM-DD; leave out for a one-way trip"},
+            "adults": {"type": "integer", "description": "Number of passengers (1-9)"},
+            "travel_class": {"type": "string", "enum": ["Economy", "Premium Economy", "Business", "First"]},
+            "flex_days": {"type": "integer", "description": (
+                "Only when the user is flexible or asks about nearby dates: search 1-3 days either side of both "
+                "dates in one go (the results include a PRICE BY DATE grid)"
+            )}
+        },
+        required=("origin", "destination", "departure_date")
+    ),
+    function_tool(
+        "save_travel_details",
+        "Save the trip once origin, destination, travelers, departure and return are all known. Flights and "
+        "activities for it are then searched automatically, unless you call those tools in the same turn.",
+        {
+            "origin": {"type": "string", "description": PLACE_DESCRIPTION},
+            "destination": {"type": "string", "description": PLACE_DESCRIPTION},
+            "travelers": {"type": "integer", "description": "Number of travelers"},
+            "departure": {"type": "string", "description": "YYYY-MM-DD"},
+            "return": {"type": "string", "description": "YYYY-MM-DD"},
+            "activities": {"type": "string", "description": "Activity preferences or recommendations"}
+        },
+        required=("origin", "destination", "travelers", "departure", "return")
+    )
+]
+
+# Tools that are started while the AI is still streaming the rest of its reply.
+# save_travel_details waits for the whole reply: it only searches what the
+# other calls of the same turn do not.
+SPECULATIVE_TOOLS = {"search_activities", "search_flights"}
 
 @app.post("/chat")
 async def chat_endpoint(req: Request):
-    global chat_history
-    
+    session = None
     try:
         data = await req.json()
         user_input = data.get("message", "")
@@ -172,308 +207,399 @@ async def chat_endpoint(req: Request):
         if not user_input:
             return {"reply": "Please provide a message!"}
         
-        # Add user message to chat history
-        chat_history.append({"role": "user", "content": user_input})
-        
-        # Get AI response
-        raw_ai_reply = ask_ai_with_history(chat_history)
-        ai_reply = extract_ai_content(raw_ai_reply)
+        session = await run_in_threadpool(sessions.load, data.get("session_id"))
         
-        # Handle error responses from the AI
-        if isinstance(ai_reply, str) and "⚠️ Error" in ai_reply:
-            chat_history.append({"role": "assistant", "content": ai_reply})
-            return {"reply": "I'm having trouble processing your request. Please try again!"}
-        
-        # Initialize response data
-        activities_data = None
-        flights_data = None
-        final_reply = ai_reply
-        
-        # Check if AI is requesting an activity search
-        if "SEARCH_ACTIVITIES:" in ai_reply:
-            try:
-                # Extract search parameters from AI response
-                search_line = [line for line in ai_reply.split('\n') if 'SEARCH_ACTIVITIES:' in line][0]
-                search_params = search_line.replace('SEARCH_ACTIVITIES:', '').strip()
-                
-                if '|' in search_params:
-                    location, user_query = search_params.split('|', 1)
-                    location = location.strip()
-                    user_query = user_query.strip()
-                else:
-                    location = search_params.strip()
-                    user_query = user_input
-                
-                print(f"🤖 AI requested search for location: '{location}', query: '{user_query}'")
-                print(f"🔍 Initiating Tavily search...")
-                
-                # Validate Tavily API before making request
-                if not validate_tavily_api():
-                    final_reply = ai_reply.replace(search_line, "").strip()
-                    if not final_reply:
-                        final_reply = f"I'd love to help you find activities in {location}! Let me provide some general recommendations."
-                else:
-                    # Perform the search using the imported function
-                    activities_data = search_activities(location, user_query=user_query)
-                    
-                    if activities_data:
-                        print("✅ Search completed successfully!")
-                        print(f"📊 Found {len(activities_data.get('results', []))} results")
-                        
-                        # Format the search results for the AI using the imported function
-                        search_results = format_activities_response(activities_data)
-                        
-                        # Add search results to chat history and get AI's response with the data
-                        chat_history.append({"role": "assistant", "content": ai_reply})
-                        
-                        search_instruction = (
-                            f"Here are the current search results for {location}:\n\n{search_results}\n\n"
-                            f"IMPORTANT: Please respond to the user using ONLY the information from these search results. "
-                            f"Include the specific titles, descriptions, URLs, scores, and images from the search results. "
-                            f"Format your response to show the user exactly what was found, including:\n"
-                            f"- The overview/summary\n"
-                            f"- Each numbered recommendation with its title, score, description, and URL\n"
-                            f"- The available images\n"
-                            f"- The search query that was used\n"
-                            f"Anytime the image url is provided, put it in an image tag so that it can be displayed in the frontend.\n\n"
-                            f"it should look something like this (<img src='the image url' alt='Description of image' style='border-radius: 10px; width: 50vw; height: auto;'>).\n\n"
-                            f"DO NOT add generic information. Use only the data provided above."
-                        )
-                        
-                        chat_history.append({"role": "user", "content": search_instruction})
-                        
-                        # Get AI's final response with the search data
-                        raw_final_reply = ask_ai_with_history(chat_history)
-                        final_reply = extract_ai_content(raw_final_reply)
-                        
-                        # Remove the search-related messages from history to keep it clean
-                        chat_history = chat_history[:-2]
-                    else:
-                        print("❌ Search failed - no results returned")
-                        final_reply = ai_reply.replace(search_line, "").strip()
-                        if not final_reply:
-                            final_reply = f"I'd love to help you find activities in {location}! Let me provide some general recommendations while I work on getting you more specific information."
-                        
-            except Exception as e:
-                print(f"Error processing activity search: {e}")
-                final_reply = ai_reply.split('SEARCH_ACTIVITIES:')[0].strip()
-                if not final_reply:
-                    final_reply = "I'd be happy to help you find activities! Could you tell me more about what you're looking for?"
-        
-        # Check if AI is requesting a flight search
-        elif "SEARCH_FLIGHTS:" in ai_reply:
-            try:
-                # Extract flight search parameters
-                search_line = [line for line in ai_reply.split('\n') if 'SEARCH_FLIGHTS:' in line][0]
-                search_params = search_line.replace('SEARCH_FLIGHTS:', '').strip()
-                
-                # Parse parameters: origin|destination|departure_date|return_date|adults|travel_class
-                params = search_params.split('|')
-                if len(params) >= 3:
-                    origin = params[0].strip()
-                    destination = params[1].strip()
-                    departure_date = params[2].strip()
-                    return_date = params[3].strip() if len(params) > 3 and params[3].strip() else None
-                    adults = int(params[4].strip()) if len(params) > 4 and params[4].strip() else 1
-                    travel_class = params[5].strip() if len(params) > 5 and params[5].strip() else "Economy"
-                    
-                    print(f"🛫 AI requested flight search: {origin} → {destination}")
-                    print(f"📅 Departure: {departure_date}, Return: {return_date}")
-                    print(f"👥 Passengers: {adults}, Class: {travel_class}")
-                    
-                    if not validate_serpapi():
-                        final_reply = ai_reply.replace(search_line, "").strip()
-                        if not final_reply:
-                            final_reply = f"I'd love to help you find flights from {origin} to {destination}! Let me provide some general guidance while I work on getting you specific flight information."
-                    else:
-                        # Perform flight search
-                        flights_data = search_flights(origin, destination, departure_date, return_date, adults, travel_class)
-                        
-                        # Print results to terminal for debugging
-                        if flights_data:
-                            print_flights_to_terminal(flights_data)
-                        
-                        if flights_data and "error" not in flights_data:
-                            print("✅ Flight search completed successfully!")
-                            
-                            # Format search results for AI
-                            search_results = format_flights_response(flights_data)
-                            
-                            # Add search results to chat and get AI response
-                            chat_history.append({"role": "assistant", "content": ai_reply})
-                            
-                            search_instruction = (
-                                f"Here are the flight search results:\n\n{search_results}\n\n"
-                                f"IMPORTANT: Please respond to the user using ONLY the flight information from these search results. "
-                                f"Include specific prices, airlines, flight times, durations, and airport information. "
-                                f"Format your response to show the user exactly what flights were found. "
-                                f"Present the information in a clear, organized way with:\n"
-                                f"- Flight prices and total duration\n"
-                                f"- Airline names and flight numbers\n"
-                                f"- Departure and arrival times with airport codes\n"
-                                f"- Whether flights are direct or have layovers\n"
-                                f"- Carbon emissions if available\n"
-                                f"DO NOT add generic flight information. Use only the data provided above."
-                            )
-                            
-                            chat_history.append({"role": "user", "content": search_instruction})
-                            
-                            # Get AI's final response with flight data
-                            raw_final_reply = ask_ai_with_history(chat_history)
-                            final_reply = extract_ai_content(raw_final_reply)
-                            
-                            # Clean up chat history
-                            chat_history = chat_history[:-2]
-                        else:
-                            print("❌ Flight search failed")
-                            error_msg = flights_data.get("error", "Unknown error") if flights_data else "No results returned"
-                            print(f"Error details: {error_msg}")
-                            
-                            final_reply = ai_reply.replace(search_line, "").strip()
-                            if not final_reply:
-                                final_reply = f"I'm having trouble finding flights from {origin} to {destination} right now. This could be due to:\n\n" \
-                                            f"• Invalid airport codes or city names\n" \
-                                            f"• No flights available for the selected dates\n" \
-                                            f"• API service temporarily unavailable\n\n" \
-                                            f"Please try:\n" \
-                                            f"• Different dates\n" \
-                                            f"• Nearby airports\n" \
-                                            f"• Or let me know if you'd like help with something else!"
-                        
-            except Exception as e:
-                print(f"❌ Error processing flight search: {e}")
-                final_reply = ai_reply.split('SEARCH_FLIGHTS:')[0].strip()
-                if not final_reply:
-                    final_reply = "I'd be happy to help you find flights! Could you tell me your departure and destination cities along with your travel dates?"
-        
-        # Check if data collection is complete and extract JSON if present
-        travel_data = None
-        data_complete = False
-        
-        if "TRAVEL_DATA_COMPLETE" in final_reply:
-            try:
-                # Extract JSON from the response
-                json_start = final_reply.find("{")
-                json_end = final_reply.rfind("}") + 1
-                
-                if json_start != -1 and json_end != -1:
-                    json_str = final_reply[json_start:json_end]
-                    travel_data = json.loads(json_str)
-                    data_complete = True
-                    
-                    print("🎯 Travel data collection complete! Auto-searching for flights and activities...")
-                    
-                    # IMPROVED: Auto-search for flights FIRST, then let AI use the results
-                    if not flights_data and validate_serpapi():
-                        origin = travel_data.get('origin', '')
-                        destination = travel_data.get('destination', '')
-                        departure = travel_data.get('departure', '')
-                        return_date = travel_data.get('return', '')
-                        travelers = travel_data.get('travelers', 1)
-                        
-                        if origin and destination and departure:
-                            print(f"🛫 Auto-searching flights: {origin} → {destination}")
-                            flights_data = search_flights(origin, destination, departure, return_date, travelers)
-                            
-                            if flights_data and "error" not in flights_data:
-                                print("✅ Auto flight search successful!")
-                                print_flights_to_terminal(flights_data)
-                                
-                                # Format flight results and let AI respond with them
-                                flight_results = format_flights_response(flights_data)
-                                
-                                # Add the travel completion message to history
-                                chat_history.append({"role": "assistant", "content": final_reply})
-                                
-                                # Give AI the flight results to incorporate
-                                flight_instruction = (
-                                    f"Great! I found flights for your trip. Here are the results:\n\n{flight_results}\n\n"
-                                    f"Please create a comprehensive trip summary that includes:\n"
-                                    f"1. The travel details you collected\n"
-                                    f"2. The flight options from the search results above (include prices, times, airlines)\n"
-                                    f"3. Offer to help with activities or other trip planning\n\n"
-                                    f"Use ONLY the flight data provided above. Present it in a user-friendly format."
-                                )
-                                
-                                chat_history.append({"role": "user", "content": flight_instruction})
-                                
-                                # Get AI response with flight data
-                                raw_flight_reply = ask_ai_with_history(chat_history)
-                                flight_enhanced_reply = extract_ai_content(raw_flight_reply)
-                                
-                                # Clean up chat history
-                                chat_history = chat_history[:-2]
-                                
-                                # Update final reply with flight-enhanced version
-                                final_reply = flight_enhanced_reply
-                                
-                            else:
-                                print("❌ Auto flight search failed")
-                                
-                    # Auto-search for activities if we haven't already
-                    if not activities_data and validate_tavily_api():
-                        destination = travel_data.get('destination', '')
-                        activities = travel_data.get('activities', '')
-                        
-                        if destination:
-                            print(f"🔍 Auto-searching activities for: {destination}")
-                            activities_data = search_activities(destination, activities)
-                            
-                            if activities_data:
-                                print("✅ Auto activity search successful!")
-                    
-                    # Clean up the response to remove JSON for display
-                    clean_reply = final_reply[:json_start].replace("TRAVEL_DATA_COMPLETE", "").strip()
-                    
-                    # If we don't have a clean reply, create a basic summary
-                    if not clean_reply:
-                        clean_reply = f"Perfect! I have all your travel details."
-                    
-                    # Update chat history with the clean response
-                    chat_history.append({"role": "assistant", "content": clean_reply})
-                    
-                    return {
-                        "reply": final_reply,  # This now includes flight info if found
-                        "travel_data": travel_data,
-                        "activities_data": activities_data,
-                        "flights_data": flights_data,
-                        "data_complete": True
-                    }
-                    
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Error parsing JSON: {e}")
-                # Continue with normal flow if JSON parsing fails
+        # Add user message to chat history
+        session.history.append({"role": "user", "content": user_input})
         
-        # Always add final AI response to chat history (if not already added above)
-        if "TRAVEL_DATA_COMPLETE" not in final_reply:
-            chat_history.append({"role": "assistant", "content": final_reply})
+        # Start searching for the trip described so far while the AI answers
+        prefetch_trip(session, user_input)
         
-        # Keep chat history manageable (last 20 messages)
-        if len(chat_history) > 21:  # 1 system message + 20 conversation messages
-            chat_history = [chat_history[0]] + chat_history[-20:]
+        # Get AI response (text and/or tool calls)
+        ai_reply = await ask_ai_with_history_async(chat_messages(session), TRAVEL_TOOLS)
         
-        return {
-            "reply": final_reply, 
-            "travel_data": travel_data,
-            "activities_data": activities_data,
-            "flights_data": flights_data,
-            "data_complete": data_complete
-        }
+        result = await complete_chat_turn(session, user_input, ai_reply)
+        result["session_id"] = session.id
+        return result
         
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
         return {"reply": "I encountered an unexpected error. Please try again!"}
+    finally:
+        if session is not None:
+            await run_in_threadpool(sessions.save, session)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: Request):
+    """
+    Streaming variant of /chat, sent as server-sent events:
+    - token: {"text": ...} for each piece of the AI reply as it is generated
+    - status: {"text": ...} when the reply asked for a search that is now running
+    - done: the same payload /chat returns; its reply replaces the streamed text
+    
+    Searches start as soon as their tool call has streamed in, while the AI
+    may still be writing further calls.
+    """
+    data = await req.json()
+    user_input = data.get("message", "")
+
+    async def events():
+        if not user_input:
+            yield sse_event("done", {"reply": "Please provide a message!"})
+            return
+
+        session = await run_in_threadpool(sessions.load, data.get("session_id"))
+        try:
+            session.history.append({"role": "user", "content": user_input})
+            prefetch_trip(session, user_input)
+
+            reply_parts, tool_calls, started = [], [], {}
+            async for kind, value in stream_ai_events(chat_messages(session), TRAVEL_TOOLS):
+                if kind == "text":
+                    reply_parts.append(value)
+                    yield sse_event("token", {"text": value})
+                    continue
+                if not tool_calls:
+                    yield sse_event("status", {"text": "🔍 Searching..."})
+                tool_calls.append(value)
+                if value["name"] in SPECULATIVE_TOOLS and not value["error"]:
+                    started[value["id"]] = asyncio.create_task(run_tool_call(value, user_input, set()))
+
+            ai_reply = {"content": "".join(reply_parts), "tool_calls": tool_calls}
+            result = await complete_chat_turn(session, user_input, ai_reply, started)
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            result = {"reply": "I encountered an unexpected error. Please try again!"}
+        finally:
+            await run_in_threadpool(sessions.save, session)
+        result["session_id"] = session.id
+        yield sse_event("done", result)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _bounded_search(name, timeout, search, *args):
+    """Run a blocking search in the threadpool, giving up after `timeout` seconds."""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(run_in_threadpool(search, *args), timeout)
+    except asyncio.TimeoutError:
+        # The thread keeps running and still fills the search cache for the next turn
+        print(f"⌛ {name} search timed out after {timeout:g}s")
+        return None
+    except Exception as e:
+        print(f"❌ {name} search failed: {e}")
+        return None
+    print(f"⏱️ {name} search took {(time.perf_counter() - started) * 1000:.0f} ms")
+    return result
+
+async def run_trip_searches(travel_data, search_for_flights=True, search_for_activities=True):
+    """
+    Search flights and activities for completed travel data concurrently.
+    
+    Both searches start at the same time and are bounded by
+    FLIGHT_SEARCH_TIMEOUT and ACTIVITY_SEARCH_TIMEOUT, so the turn takes
+    about as long as the slower of the two rather than their sum. A search
+    that is skipped, times out or fails yields None.
+    
+    Args:
+        travel_data (dict): The save_travel_details arguments
+        search_for_flights (bool): Whether to run the flight search
+        search_for_activities (bool): Whether to run the activity search
+    
+    Returns:
+        tuple: (flights_data, activities_data)
+    """
+    async def skipped():
+        return None
+    
+    origin = travel_data.get('origin', '')
+    destination = travel_data.get('destination', '')
+    departure = travel_data.get('departure', '')
+    
+    flight_search = activity_search = None
+    if search_for_flights and origin and destination and departure and validate_serpapi():
+        search_check = check_flight_search(
+            origin, destination, departure, travel_data.get('return', ''), travel_data.get('travelers', 1)
+        )
+        if search_check["problems"]:
+            print(f"🚫 Auto flight search skipped: {search_check['problems']}")
+        else:
+            # Activities are still searched for the place name, not the resolved airport code
+            print(f"🛫 Auto-searching flights: {search_check['origin']} → {search_check['destination']}")
+            flight_search = _bounded_search(
+                "Flight", FLIGHT_SEARCH_TIMEOUT, search_flights, search_check["origin"], search_check["destination"],
+                departure, travel_data.get('return', ''), travel_data.get('travelers', 1)
+            )
+    
+    if search_for_activities and destination and validate_tavily_api():
+        # Same place form as the trip prefetch, so a prefetched result is found in the cache
+        place = place_name(destination)
+        print(f"🔍 Auto-searching activities for: {place}")
+        activity_search = _bounded_search(
+            "Activity", ACTIVITY_SEARCH_TIMEOUT, search_activities, place, travel_data.get('activities', '')
+        )
+    
+    flights_data, activities_data = await asyncio.gather(flight_search or skipped(), activity_search or skipped())
+    if flights_data and "error" in flights_data:
+        print(f"❌ Auto flight search failed: {flights_data['error']}")
+    return flights_data, activities_data
+
+async def search_activities_tool(arguments, user_input):
+    """
+    Run a search_activities tool call.
+    
+    Returns:
+        dict: Tool outcome (see run_tool_call)
+    """
+    location = arguments["location"]
+    user_query = arguments.get("query") or user_query_text(user_input).strip()
+    print(f"🤖 AI requested search for location: '{location}', query: '{user_query}'")
+    
+    # Validate Tavily API before making request
+    if not validate_tavily_api():
+        return {"reply": f"I'd love to help you find activities in {location}! Let me provide some general recommendations."}
+    
+    print(f"🔍 Initiating Tavily search...")
+    activities_data = await run_in_threadpool(search_activities, location, user_query=user_query)
+    if not activities_data:
+        print("❌ Search failed - no results returned")
+        return {"reply": f"I'd love to help you find activities in {location}! Let me provide some general recommendations while I work on getting you more specific information."}
+    
+    print("✅ Search completed successfully!")
+    print(f"📊 Found {len(activities_data.get('results', []))} results")
+    return {
+        "content": (
+            f"Search results for {location}:\n\n{format_activities_response(activities_data)}\n"
+            f"Answer using ONLY these results: the overview, then each result's title, score, description and URL, "
+            f"and the search query used. Show each image URL as "
+            f"<img src='the image url' alt='Description of image' style='border-radius: 10px; width: 50vw; height: auto;'>. "
+            f"No generic information."
+        ),
+        "activities_data": activities_data
+    }
+
+async def search_flights_tool(arguments, user_input):
+    """
+    Run a search_flights tool call.
+    
+    Returns:
+        dict: Tool outcome (see run_tool_call)
+    """
+    origin = arguments["origin"]
+    destination = arguments["destination"]
+    departure_date = arguments["departure_date"]
+    return_date = arguments.get("return_date")
+    adults = arguments.get("adults", 1)
+    travel_class = arguments.get("travel_class", "Economy")
+    flex_days = arguments.get("flex_days", 0)
+    
+    print(f"🛫 AI requested flight search: {origin} → {destination}")
+    print(f"📅 Departure: {departure_date}, Return: {return_date}" + (f" (±{flex_days} days)" if flex_days else ""))
+    print(f"👥 Passengers: {adults}, Class: {travel_class}")
+    
+    # Resolve city/airport names and reject impossible searches without calling SerpAPI
+    search_check = await run_in_threadpool(check_flight_search, origin, destination, departure_date, return_date, adults)
+    if search_check["problems"]:
+        print(f"🚫 Flight search rejected locally: {search_check['problems']}")
+        return {"reply": (
+            "I couldn't search for those flights yet:\n\n"
+            + "\n".join(f"• {problem}" for problem in search_check["problems"])
+            + "\n\nCould you check these details for me?"
+        )}
+    if not validate_serpapi():
+        return {"reply": f"I'd love to help you find flights from {origin} to {destination}! Let me provide some general guidance while I work on getting you specific flight information."}
+    
+    origin, destination = search_check["origin"], search_check["destination"]
+    # Perform flight search (a price grid over nearby dates when the user is flexible)
+    if flex_days:
+        flights_data = await run_in_threadpool(
+            search_flight_date_matrix, origin, destination, departure_date, return_date, adults, travel_class, flex_days
+        )
+    else:
+        flights_data = await run_in_threadpool(search_flights, origin, destination, departure_date, return_date, adults, travel_class)
+    
+    # Print results to terminal for debugging
+    if flights_data:
+        print_flights_to_terminal(flights_data)
+    
+    if not flights_data or "error" in flights_data:
+        print("❌ Flight search failed")
+        print(f"Error details: {flights_data.get('error', 'Unknown error') if flights_data else 'No results returned'}")
+        return {"reply": f"I'm having trouble finding flights from {origin} to {destination} right now. This could be due to:\n\n" \
+                         f"• Invalid airport codes or city names\n" \
+                         f"• No flights available for the selected dates\n" \
+                         f"• API service temporarily unavailable\n\n" \
+                         f"Please try:\n" \
+                         f"• Different dates\n" \
+                         f"• Nearby airports\n" \
+                         f"• Or let me know if you'd like help with something else!"}
+    
+    print("✅ Flight search completed successfully!")
+    return {
+        "content": (
+            f"Flight search results:\n\n{format_flights_response(select_flights(flights_data, user_input))}\n"
+            f"Answer using ONLY these flights, clearly organized: price and total duration, airlines and flight numbers, "
+            f"departure and arrival times with airports, direct or layovers, and carbon emissions if given. "
+            f"If there is a PRICE BY DATE grid, compare the cheapest dates with the requested ones. "
+            f"No generic flight information."
+        ),
+        "flights_data": flights_data
+    }
+
+async def save_travel_details_tool(arguments, user_input, requested):
+    """
+    Run a save_travel_details tool call: keep the travel data and search
+    flights and activities for it, except those the same turn already
+    searches itself.
+    
+    Returns:
+        dict: Tool outcome (see run_tool_call)
+    """
+    travel_data = dict(arguments)
+    print("🎯 Travel data collection complete! Auto-searching for flights and activities...")
+    
+    # Run both searches at once; each is bounded by its own timeout
+    found_flights, found_activities = await run_trip_searches(
+        travel_data,
+        search_for_flights="search_flights" not in requested,
+        search_for_activities="search_activities" not in requested
+    )
+    outcome = {"travel_data": travel_data, "activities_data": found_activities}
+    
+    trip_results = []
+    if found_flights and "error" not in found_flights:
+        print_flights_to_terminal(found_flights)
+        outcome["flights_data"] = found_flights
+        trip_results.append(format_flights_response(select_flights(found_flights, user_input)))
+    if found_activities:
+        trip_results.append(format_activities_response(found_activities))
+    
+    if trip_results:
+        outcome["content"] = (
+            f"Travel details saved. Trip search results:\n\n" + "\n".join(trip_results) + "\n"
+            f"Write a trip summary using ONLY these results: the travel details you collected, "
+            f"the flight options (prices, times, airlines), activity recommendations if any, "
+            f"and an offer to help with anything else."
+        )
+    elif requested - {"save_travel_details"}:
+        outcome["content"] = "Travel details saved."
+    else:
+        outcome["reply"] = "Perfect! I have all your travel details."
+    return outcome
+
+TOOL_HANDLERS = {
+    "search_activities": search_activities_tool,
+    "search_flights": search_flights_tool
+}
+
+async def run_tool_call(call, user_input, requested):
+    """
+    Run one tool call from the AI.
+    
+    Args:
+        call (dict): The parsed tool call (see ai_utils.parse_tool_call)
+        user_input (str): The user message the AI replied to
+        requested (set): Names of every tool called in the same turn
+    
+    Returns:
+        dict: The outcome: "content" (the result for the AI to answer from)
+            or "reply" (text for the user that needs no AI answer), plus any
+            "activities_data", "flights_data" and "travel_data" found
+    """
+    if call["error"]:
+        print(f"⚠️ Tool call {call['name']} not run: {call['error']}")
+        return {"content": f"ERROR: {call['error']}. Ask the user for whatever is missing."}
+    try:
+        if call["name"] == "save_travel_details":
+            return await save_travel_details_tool(call["arguments"], user_input, requested)
+        return await TOOL_HANDLERS[call["name"]](call["arguments"], user_input)
+    except Exception as e:
+        print(f"❌ Error running {call['name']}: {e}")
+        return {"content": f"ERROR: {call['name']} failed. Apologise and offer to try again."}
+
+async def complete_chat_turn(session, user_input, ai_reply, started=None):
+    """
+    Act on the AI's reply to the latest user message: run the tools it
+    called (all at once), let it answer from their results and record the
+    turn in the session's chat history.
+    
+    Args:
+        session (Session): The user's conversation session
+        user_input (str): The user message the AI replied to
+        ai_reply (dict): The AI's message: {"content": text, "tool_calls": [...]}
+        started (dict): Tool call id -> task for calls already started while streaming
+    
+    Returns:
+        dict: The /chat response payload
+    """
+    content = ai_reply["content"]
+    tool_calls = ai_reply["tool_calls"]
+    
+    # Handle error responses from the AI
+    if "⚠️ Error" in content:
+        session.history.append({"role": "assistant", "content": content})
+        return {"reply": "I'm having trouble processing your request. Please try again!"}
+    
+    final_reply = content
+    activities_data = flights_data = travel_data = None
+    
+    if tool_calls:
+        started = started or {}
+        requested = {call["name"] for call in tool_calls}
+        outcomes = await asyncio.gather(*(
+            started.get(call["id"]) or run_tool_call(call, user_input, requested) for call in tool_calls
+        ))
+        for outcome in outcomes:
+            activities_data = activities_data or outcome.get("activities_data")
+            flights_data = flights_data or outcome.get("flights_data")
+            travel_data = travel_data or outcome.get("travel_data")
+        
+        replies = [outcome["reply"] for outcome in outcomes if "reply" in outcome]
+        final_reply = "\n\n".join(part for part in [content.strip(), *replies] if part)
+        if len(replies) < len(outcomes):
+            # One AI call answers from every result (they are sent once, not stored in the history)
+            answer = await ask_ai_with_history_async(
+                chat_messages(session) + [tool_call_message(content, tool_calls)] + [
+                    tool_result_message(call, outcome.get("content") or outcome["reply"])
+                    for call, outcome in zip(tool_calls, outcomes)
+                ],
+                TRAVEL_TOOLS,
+                tool_choice="none"
+            )
+            if "⚠️ Error" not in answer["content"] and answer["content"].strip():
+                final_reply = answer["content"]
+            elif not final_reply:
+                final_reply = "I'm having trouble processing your request. Please try again!"
+    
+    session.history.append({"role": "assistant", "content": final_reply})
+    
+    # Keep chat history within its token budget (old turns go into the digest)
+    compact_history(session)
+    
+    return {
+        "reply": final_reply,
+        "travel_data": travel_data,
+        "activities_data": activities_data,
+        "flights_data": flights_to_api(flights_data),
+        "data_complete": travel_data is not None
+    }
+    
 
 @app.get("/")
 async def root():
     return {"message": "AI Travel Agent Backend is running!"}
 
 @app.post("/reset")
-async def reset_chat():
-    """Reset the chat history"""
-    global chat_history
+async def reset_chat(req: Request):
+    """Reset the chat history of the session given as {"session_id": ...}"""
+    data = await req.json() if await req.body() else {}
     
-    chat_history = [chat_history[0]]  # Keep only the system message
+    await run_in_threadpool(sessions.delete, data.get("session_id"))
+    prefetcher.forget(data.get("session_id"))
     
     return {"message": "Chat reset successfully"}
 
@@ -487,6 +613,13 @@ async def health_check():
         "status": "healthy",
         "tavily_api": tavily_status,
         "serpapi": serpapi_status,
+        "llm": get_llm_stats(),
+        "sessions": sessions.stats,
+        "flight_cache": flight_cache.info(),
+        "activity_cache": activity_cache.info(),
+        "trip_prefetch": prefetcher.info(),
+        "upstreams": upstream_stats(),
+        "prompt_tokens": prompt_token_stats(),
         "message": "AI Travel Agent Backend is running!"
     }
 
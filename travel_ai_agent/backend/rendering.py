@@ -0,0 +1,35 @@
+import sys
+
+# Buffered fragments are written out once they add up to this many characters
+WRITE_BUFFER_CHARS = 8192
+
+
+def render_to_string(fragments):
+    """Join rendered fragments into one string."""
+    return "".join(fragments)
+
+
+def write_fragments(fragments, write=None, buffer_chars=WRITE_BUFFER_CHARS):
+    """
+    Stream rendered fragments to `write` (stdout by default) in batches of
+    about `buffer_chars` characters, without building the whole text.
+
+    Returns:
+        int: Characters written
+    """
+    write = write or sys.stdout.write
+    total = 0
+    batch, size = [], 0
+    for fragment in fragments:
+        batch.append(fragment)
+        size += len(fragment)
+        if size >= buffer_chars:
+            chunk = "".join(batch)
+            write(chunk)
+            total += len(chunk)
+            batch, size = [], 0
+    if batch:
+        chunk = "".join(batch)
+        write(chunk)
+        total += len(chunk)
+    return total
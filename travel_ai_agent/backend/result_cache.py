@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """One in-progress load that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU cache for upstream search results.
+
+    Entries are fresh for `ttl` seconds after they were stored; once
+    `maxsize` entries are held the least recently used one is evicted.
+    Loads are single-flight: while one thread runs the loader for a key,
+    other callers asking for the same key wait for its result instead of
+    calling the upstream API themselves.
+
+    With `stale_ttl` set, an entry stays usable for that many seconds
+    after going stale (stale-while-revalidate): it is returned at once
+    and a background thread reloads it for the next caller.
+
+    Cached values are shared between callers and must be treated as read-only.
+
+    Args:
+        maxsize (int): Maximum number of entries
+        ttl (float): Seconds an entry stays fresh
+        name (str): Label used in log output
+        stale_ttl (float): Extra seconds a stale entry may be served while it is refreshed
+    """
+
+    def __init__(self, maxsize, ttl, name="cache", stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "coalesced": 0, "evictions": 0}
+
+    def _lookup(self, key, now):
+        """
+        Return (value, is_stale) for `key`, or (None, False) when it is
+        missing or past its stale window (call with the lock held).
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        value, stored_at = entry
+        age = now - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None, False
+        self._entries.move_to_end(key)
+        return value, age >= self.ttl
+
+    def get(self, key):
+        """Return the fresh cached value for `key`, or None."""
+        with self._lock:
+            value, stale = self._lookup(key, time.monotonic())
+        return None if stale else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_or_load(self, key, loader, cacheable=None):
+        """
+        Return the cached value for `key`, calling `loader()` on a miss.
+
+        Args:
+            key: Hashable cache key
+            loader (callable): Fetches the value from upstream
+            cacheable (callable, optional): Predicate on the loaded value; values
+                it rejects (e.g. error results) are returned but not stored
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        with self._lock:
+            value, stale = self._lookup(key, time.monotonic())
+            if value is not None and not stale:
+                self.stats["hits"] += 1
+                print(f"⚡ {self.name} hit: {key}")
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.stats["refreshes" if stale else "misses"] += 1
+            if stale:
+                self.stats["stale_hits"] += 1
+            elif not leader:
+                self.stats["coalesced"] += 1
+
+        if stale:
+            # Serve the stale value now; refresh it unless another caller already is
+            print(f"♻️ {self.name} stale hit: {key}")
+            if leader:
+                threading.Thread(
+                    target=self._refresh, args=(key, flight, loader, cacheable), daemon=True
+                ).start()
+            return value
+
+        if not leader:
+            print(f"⏳ {self.name}: waiting for identical in-flight request {key}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        return self._load(key, flight, loader, cacheable)
+
+    def _refresh(self, key, flight, loader, cacheable):
+        try:
+            self._load(key, flight, loader, cacheable)
+        except Exception as e:
+            print(f"⚠️ {self.name}: background refresh of {key} failed: {e}")
+
+    def _load(self, key, flight, loader, cacheable):
+        """Run the loader as the single flight for `key` and store a cacheable result."""
+        try:
+            flight.value = loader()
+            if cacheable is None or cacheable(flight.value):
+                self.set(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Hit/miss counters plus the current size."""
+        with self._lock:
+            return {**self.stats, "size": len(self._entries)}
@@ -1,40 +1,298 @@
+import math
 import os
+import re
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from datetime import date, timedelta
 from serpapi import GoogleSearch
 from dotenv import load_dotenv
+from result_cache import TTLCache
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.resilience import get_upstream, retryable_status
+from airport_index import load_metro_areas, resolve_airport, suggest_airports
+from flight_models import FlightOption
+from shared.context_window import PROMPT_FORMAT, measure_prompt
+from rendering import render_to_string, write_fragments
 
 # Load environment variables
 load_dotenv()
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com")
+
+# Searches are read-only, so failed ones are retried; SERPAPI_TIMEOUT/RETRIES/BREAKER_* override these.
+# One retry at most: a search already bounded by FLIGHT_SEARCH_TIMEOUT gains little from more
+serpapi_upstream = get_upstream("serpapi", timeout=12.0, retries=1)
+
+# Flight results are cached per normalized search; fares move, so keep the TTL short
+FLIGHT_CACHE_TTL = float(os.getenv("FLIGHT_CACHE_TTL", "900"))
+FLIGHT_CACHE_SIZE = int(os.getenv("FLIGHT_CACHE_SIZE", "256"))
+flight_cache = TTLCache(FLIGHT_CACHE_SIZE, FLIGHT_CACHE_TTL, name="Flight cache")
+
+# Airport-pair and flexible-date searches share one pool, so at most
+# FLIGHT_SEARCH_CONCURRENCY SerpAPI calls run at once however they are nested
+FLIGHT_SEARCH_CONCURRENCY = int(os.getenv("FLIGHT_SEARCH_CONCURRENCY", "6"))
+flight_search_pool = ThreadPoolExecutor(max_workers=FLIGHT_SEARCH_CONCURRENCY, thread_name_prefix="flight-search")
+
+# Flexible-date searches: at most ±MAX_FLEX_DAYS and MAX_MATRIX_SEARCHES SerpAPI
+# calls per grid, one airport pair only
+MAX_FLEX_DAYS = 3
+MAX_MATRIX_SEARCHES = int(os.getenv("MAX_MATRIX_SEARCHES", "25"))
+
+# Multi-airport searches: one SerpAPI call per airport pair, merging whatever has
+# arrived after MULTI_AIRPORT_TIMEOUT seconds. Only the first MAX_AIRPORTS_PER_SIDE
+# airports of each side are searched (metro areas list theirs busiest first), so
+# LON↔NYC costs 9 calls rather than 18
+MULTI_AIRPORT_TIMEOUT = float(os.getenv("MULTI_AIRPORT_TIMEOUT", "20"))
+MAX_AIRPORTS_PER_SIDE = int(os.getenv("MAX_AIRPORTS_PER_SIDE", "3"))
+MERGED_BEST_FLIGHTS = 5
+MERGED_OTHER_FLIGHTS = 10
+
+# IATA metropolitan area codes and the airports they cover (data/metro_areas.csv)
+METRO_AIRPORTS = load_metro_areas()
+
+# Google Flights accepts at most 9 passengers per search
+MAX_ADULTS = 9
+
+AIRPORT_SET_SPLIT_RE = re.compile(r"[,/\s]+")
+
+# Map travel class to SerpAPI format
+TRAVEL_CLASS_CODES = {
+    "economy": "1",
+    "premium economy": "2", 
+    "business": "3",
+    "first": "4"
+}
+
+def _normalize_date(value):
+    """Return a YYYY-MM-DD date string, or the stripped input if it does not parse."""
+    value = (value or "").strip()
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        return value
+
+def flight_search_key(origin, destination, departure_date, return_date=None, adults=1, travel_class="Economy"):
+    """
+    Normalize flight search parameters into a cache key, so that e.g.
+    "jfk"/"JFK", "business"/"Business " and 2/"2" share one cache entry.
+    
+    Returns:
+        tuple: (origin, destination, departure_date, return_date, adults, travel_class_code)
+    """
+    return (
+        origin.strip().upper(),
+        destination.strip().upper(),
+        _normalize_date(departure_date),
+        _normalize_date(return_date) or None,
+        int(adults or 1),
+        TRAVEL_CLASS_CODES.get(" ".join((travel_class or "").lower().split()), "1")
+    )
+
+def expand_airports(code):
+    """
+    Expand a metro-area code ("NYC") or an airport set ("JFK,EWR" or "JFK/EWR")
+    into a de-duplicated list of airport codes. A single airport code is
+    returned as a one-item list.
+    """
+    airports = []
+    for part in AIRPORT_SET_SPLIT_RE.split(code.strip().upper()):
+        for airport in METRO_AIRPORTS.get(part, [part] if part else []):
+            if airport not in airports:
+                airports.append(airport)
+    return airports
+
+def check_flight_search(origin, destination, departure_date, return_date=None, adults=1):
+    """
+    Resolve and validate a flight search locally, before any SerpAPI call.
+    
+    Origin and destination may be codes, cities, airport names or aliases;
+    they are resolved against the bundled airport index. Dates must be
+    YYYY-MM-DD, not in the past, with the return after the departure.
+    
+    Args:
+        origin (str): Origin as given by the AI or user
+        destination (str): Destination as given by the AI or user
+        departure_date (str): Departure date
+        return_date (str, optional): Return date for a round trip
+        adults (int): Number of adult passengers
+    
+    Returns:
+        dict: Resolved "origin" and "destination" codes, and a list of
+            "problems" (empty when the search can run)
+    """
+    problems = []
+    resolved = {}
+    for field, text in (("origin", origin), ("destination", destination)):
+        code = resolve_airport(text) if text and text.strip() else None
+        resolved[field] = code
+        if code is None:
+            suggestions = suggest_airports(text) if text and text.strip() else []
+            hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+            problems.append(f"I couldn't find an airport for the {field} '{(text or '').strip()}'.{hint}")
+        elif code.upper() != (text or "").strip().upper():
+            print(f"📍 Resolved {field} '{text.strip()}' → {code}")
+    
+    if resolved["origin"] and resolved["origin"] == resolved["destination"]:
+        problems.append(f"The origin and destination are the same ({resolved['origin']}).")
+    
+    today = date.today()
+    try:
+        departure = date.fromisoformat((departure_date or "").strip())
+        if departure < today:
+            problems.append(f"The departure date {departure.isoformat()} is in the past.")
+    except ValueError:
+        departure = None
+        problems.append(f"The departure date '{departure_date}' is not a valid YYYY-MM-DD date.")
+    if return_date and str(return_date).strip():
+        try:
+            returning = date.fromisoformat(str(return_date).strip())
+            if departure and returning < departure:
+                problems.append(f"The return date {returning.isoformat()} is before the departure date.")
+        except ValueError:
+            problems.append(f"The return date '{return_date}' is not a valid YYYY-MM-DD date.")
+    
+    try:
+        if not 1 <= int(adults or 1) <= MAX_ADULTS:
+            problems.append(f"Flights can be searched for 1 to {MAX_ADULTS} passengers at a time.")
+    except (TypeError, ValueError):
+        problems.append(f"'{adults}' is not a valid number of passengers.")
+    
+    return {**resolved, "problems": problems}
 
 def search_flights(origin, destination, departure_date, return_date=None, adults=1, travel_class="Economy"):
     """
     Search for flights using SerpAPI Google Flights
     
+    Results are cached for FLIGHT_CACHE_TTL seconds per normalized search,
+    and concurrent identical searches share a single SerpAPI call. Errors
+    are never cached.
+    
+    Origin and destination may be metro-area codes or airport sets; every
+    airport pair is then searched concurrently and the results merged
+    (see search_airport_sets).
+    
     Args:
-        origin (str): Origin airport code (e.g., "JFK")
-        destination (str): Destination airport code (e.g., "LAX")
+        origin (str): Origin airport code, metro code or set (e.g., "JFK", "NYC", "JFK,EWR")
+        destination (str): Destination airport code, metro code or set (e.g., "LAX")
         departure_date (str): Departure date in YYYY-MM-DD format
         return_date (str, optional): Return date in YYYY-MM-DD format for round trip
         adults (int): Number of adult passengers
         travel_class (str): Travel class (Economy, Premium Economy, Business, First)
     
     Returns:
-        dict: Flight search results or error info
+        dict: Flight search results or error info (shared with other callers; do not modify)
     """
+    try:
+        origins = expand_airports(origin)
+        destinations = expand_airports(destination)
+        key = flight_search_key(origin, destination, departure_date, return_date, adults, travel_class)
+    except (AttributeError, TypeError, ValueError) as e:
+        print(f"❌ Invalid flight search parameters: {e}")
+        return {"error": f"Invalid flight search parameters: {e}"}
+    
+    if not origins or not destinations:
+        return {"error": "Missing origin or destination airport"}
+    if len(origins) > 1 or len(destinations) > 1:
+        return search_airport_sets(origins, destinations, departure_date, return_date, adults, travel_class)
+    
+    return flight_cache.get_or_load(
+        key,
+        lambda: _search_flights_upstream(*key[:5], travel_class or "Economy"),
+        cacheable=lambda result: "error" not in result
+    )
+
+def _option_signature(option):
+    """Identify a flight option by its segments' flight numbers and departure times."""
+    return tuple((segment.flight_number, segment.departure_time) for segment in option.segments)
+
+def _option_rank(option):
+    """Sort key: cheapest first, then shortest; unknown prices and durations last."""
+    return (
+        option.price if option.price is not None else math.inf,
+        option.total_duration if option.total_duration is not None else math.inf
+    )
+
+def search_airport_sets(origins, destinations, departure_date, return_date=None, adults=1, travel_class="Economy"):
+    """
+    Search every origin/destination airport pair concurrently and merge the results.
+    
+    Each pair is an ordinary cached search_flights call run on the shared
+    flight_search_pool, so at most FLIGHT_SEARCH_CONCURRENCY run at once
+    across all searches. Only the first MAX_AIRPORTS_PER_SIDE origins and
+    destinations are used. Pairs still running after MULTI_AIRPORT_TIMEOUT
+    seconds are left out (their results still land in the cache). Options found by several pairs are kept once; the merged
+    lists are ranked by price, then duration.
+    
+    Args:
+        origins (list): Origin airport codes, most important first
+        destinations (list): Destination airport codes, most important first
+        departure_date (str): Departure date in YYYY-MM-DD format
+        return_date (str, optional): Return date for round trips
+        adults (int): Number of adult passengers
+        travel_class (str): Travel class
+    
+    Returns:
+        dict: Merged flight search results, or error info if no pair succeeded
+    """
+    if len(origins) > MAX_AIRPORTS_PER_SIDE or len(destinations) > MAX_AIRPORTS_PER_SIDE:
+        print(f"✂️ Searching only the first {MAX_AIRPORTS_PER_SIDE} airports on each side")
+        origins, destinations = origins[:MAX_AIRPORTS_PER_SIDE], destinations[:MAX_AIRPORTS_PER_SIDE]
+    pairs = [(out, back) for out in origins for back in destinations if out != back]
+    print(f"🛫 Multi-airport search: {len(pairs)} airport pairs ({', '.join(origins)} → {', '.join(destinations)})")
+    
+    futures = {
+        flight_search_pool.submit(search_flights, out, back, departure_date, return_date, adults, travel_class): (out, back)
+        for out, back in pairs
+    }
+    # Do not wait for stragglers; they finish in the background and fill the cache
+    done, pending = wait(futures, timeout=MULTI_AIRPORT_TIMEOUT)
+    if pending:
+        print(f"⌛ {len(pending)} airport pair(s) did not answer within {MULTI_AIRPORT_TIMEOUT:g}s")
+    
+    best, other, seen = [], [], set()
+    searched, errors = [], []
+    for future in done:
+        result = future.result()
+        if "error" in result:
+            errors.append(result["error"])
+            continue
+        searched.append("→".join(futures[future]))
+        for target, options in ((best, result.get("best_flights", [])), (other, result.get("other_flights", []))):
+            for option in options:
+                signature = _option_signature(option)
+                if signature not in seen:
+                    seen.add(signature)
+                    target.append(option)
+    
+    if not searched:
+        return {"error": errors[0] if errors else "No airport pair answered in time"}
+    
+    # The best options of each pair compete for the merged best list; the rest become other options
+    best.sort(key=_option_rank)
+    other = sorted(best[MERGED_BEST_FLIGHTS:] + other, key=_option_rank)
+    
+    return {
+        "search_info": {
+            "origin": "/".join(origins),
+            "destination": "/".join(destinations),
+            "departure_date": departure_date,
+            "return_date": return_date,
+            "adults": adults,
+            "travel_class": travel_class,
+            "airport_pairs": sorted(searched)
+        },
+        "best_flights": best[:MERGED_BEST_FLIGHTS],
+        "other_flights": other[:MERGED_OTHER_FLIGHTS]
+    }
+
+def _search_flights_upstream(origin, destination, departure_date, return_date, adults, travel_class):
+    """Run one Google Flights search on SerpAPI (uncached; see search_flights)."""
     try:
         print(f"🛫 Searching flights: {origin} → {destination}, Departure: {departure_date}, Return: {return_date}")
         
-        # Map travel class to SerpAPI format
-        class_mapping = {
-            "economy": "1",
-            "premium economy": "2", 
-            "business": "3",
-            "first": "4"
-        }
-        
         # Get the correct travel class code
-        travel_class_code = class_mapping.get(travel_class.lower(), "1")  # Default to Economy
+        travel_class_code = TRAVEL_CLASS_CODES.get(" ".join(travel_class.lower().split()), "1")  # Default to Economy
         print(f"🎫 Travel class: {travel_class} → Code: {travel_class_code}")
         
         # Build search parameters
@@ -57,8 +315,11 @@ def search_flights(origin, destination, departure_date, return_date=None, adults
         else:
             params["type"] = "2"  # FIXED: One way should be "2", not "1"
         
-        search = GoogleSearch(params)
-        result = search.get_dict()
+        search = GoogleSearch({**params, "output": "json"})
+        search.BACKEND = SERPAPI_URL
+        search.timeout = serpapi_upstream.timeout
+        response = serpapi_upstream.call(search.get_response, retry_if=retryable_status)
+        result = response.json()
         
         if "error" in result:
             print(f"❌ SerpAPI Error: {result['error']}")
@@ -78,8 +339,7 @@ def search_flights(origin, destination, departure_date, return_date=None, adults
                 "travel_class": travel_class
             },
             "best_flights": [],
-            "other_flights": [],
-            "search_metadata": result.get("search_metadata", {})
+            "other_flights": []
         }
         
         # Process best flights
@@ -105,6 +365,132 @@ def search_flights(origin, destination, departure_date, return_date=None, adults
         print(f"❌ Flight search error: {e}")
         return {"error": str(e)}
 
+def _cheapest_option(flights_data):
+    """Return the cheapest priced option of a search result, or None."""
+    options = [
+        flight for flight in flights_data.get("best_flights", []) + flights_data.get("other_flights", [])
+        if flight.price is not None
+    ]
+    return min(options, key=lambda flight: flight.price) if options else None
+
+def search_flight_date_matrix(origin, destination, departure_date, return_date=None, adults=1,
+                              travel_class="Economy", flex_days=1):
+    """
+    Search flights for every departure (and return) date within ±flex_days
+    of the requested ones and build a price grid.
+    
+    Each cell is an ordinary search_flights call, so cells already in the
+    flight cache cost nothing and identical concurrent cells share a call.
+    Cells run on the shared flight_search_pool. Date pairs where the return
+    would precede the departure are skipped.
+    
+    A grid never fans out per airport pair: metro codes and airport sets are
+    narrowed to their first (busiest) airport, and the window shrinks until
+    at most MAX_MATRIX_SEARCHES cells remain (a ±3 day round trip would
+    otherwise be 49 searches).
+    
+    Args:
+        origin (str): Origin airport code, metro code or set (only the first airport is searched)
+        destination (str): Destination airport code, metro code or set (only the first airport is searched)
+        departure_date (str): Requested departure date (YYYY-MM-DD)
+        return_date (str, optional): Requested return date (YYYY-MM-DD) for round trips
+        adults (int): Number of adult passengers
+        travel_class (str): Travel class
+        flex_days (int): Days to try either side of each date (1 to MAX_FLEX_DAYS)
+    
+    Returns:
+        dict: The search_flights result for the requested dates plus a "date_matrix"
+              with the cheapest price per date pair, or error info
+    """
+    flex_days = max(1, min(int(flex_days), MAX_FLEX_DAYS))
+    try:
+        departure = date.fromisoformat(departure_date.strip())
+        returning = date.fromisoformat(return_date.strip()) if return_date and return_date.strip() else None
+    except ValueError as e:
+        return {"error": f"Invalid date for flexible search: {e}"}
+    
+    try:
+        origin_airports, destination_airports = expand_airports(origin), expand_airports(destination)
+    except AttributeError as e:
+        return {"error": f"Invalid flight search parameters: {e}"}
+    if not origin_airports or not destination_airports:
+        return {"error": "Missing origin or destination airport"}
+    if len(origin_airports) > 1 or len(destination_airports) > 1:
+        print(f"✂️ Flexible search covers one airport pair: {origin_airports[0]} → {destination_airports[0]}")
+    origin, destination = origin_airports[0], destination_airports[0]
+    
+    while True:
+        offsets = range(-flex_days, flex_days + 1)
+        departure_dates = [departure + timedelta(days=offset) for offset in offsets]
+        return_dates = [returning + timedelta(days=offset) for offset in offsets] if returning else [None]
+        cells = [
+            (out, back) for out in departure_dates for back in return_dates
+            if out >= date.today() and (back is None or back >= out)
+        ]
+        if len(cells) <= MAX_MATRIX_SEARCHES or flex_days == 1:
+            break
+        flex_days -= 1
+    if not cells:
+        return {"error": "None of the flexible dates are in the future"}
+    # Hard cap even at ±1 day: keep the dates closest to the requested ones
+    cells = sorted(
+        cells, key=lambda cell: abs((cell[0] - departure).days) + (abs((cell[1] - returning).days) if returning else 0)
+    )[:MAX_MATRIX_SEARCHES]
+    
+    print(f"📅 Flexible search {origin} → {destination}: {len(cells)} date combinations (±{flex_days} days)")
+    
+    def search_cell(cell):
+        out, back = cell
+        return search_flights(origin, destination, out.isoformat(), back.isoformat() if back else None, adults, travel_class)
+    
+    results = dict(zip(cells, flight_search_pool.map(search_cell, cells)))
+    
+    prices = []
+    cheapest = None
+    for out in departure_dates:
+        row = []
+        for back in return_dates:
+            result = results.get((out, back))
+            option = _cheapest_option(result) if result and "error" not in result else None
+            row.append(option.price if option else None)
+            if option and (cheapest is None or option.price < cheapest["price"]):
+                cheapest = {
+                    "price": option.price,
+                    "departure_date": out.isoformat(),
+                    "return_date": back.isoformat() if back else None,
+                    "airline": option.airline,
+                    "stops": option.stops
+                }
+        prices.append(row)
+    
+    requested = results.get((departure, returning))
+    if requested is None or "error" in requested:
+        if cheapest is None:
+            return requested or {"error": "No flights found for any of the flexible dates"}
+        requested = {
+            "search_info": {
+                "origin": origin,
+                "destination": destination,
+                "departure_date": departure_date,
+                "return_date": return_date,
+                "adults": adults,
+                "travel_class": travel_class
+            },
+            "best_flights": [],
+            "other_flights": []
+        }
+    
+    # Copy the top level so the cached result for the requested dates is left untouched
+    matrix_data = dict(requested)
+    matrix_data["date_matrix"] = {
+        "flex_days": flex_days,
+        "departure_dates": [out.isoformat() for out in departure_dates],
+        "return_dates": [back.isoformat() for back in return_dates] if returning else [],
+        "prices": prices,
+        "cheapest": cheapest
+    }
+    return matrix_data
+
 def format_flight_data(flight_option):
     """
     Format individual flight data from SerpAPI response
@@ -113,150 +499,61 @@ def format_flight_data(flight_option):
         flight_option (dict): Raw flight option from SerpAPI
     
     Returns:
-        dict: Formatted flight data
+        FlightOption: Compact flight option, or None if it has no flights
     """
     try:
-        flights = flight_option.get("flights", [])
-        if not flights:
+        formatted = FlightOption.from_serpapi(flight_option)
+        if formatted is None:
             print("⚠️ No flights in flight option")
-            return None
-        
-        # Extract basic info
-        total_duration = flight_option.get("total_duration", "N/A")
-        price = flight_option.get("price", "N/A")
-        carbon_emissions = flight_option.get("carbon_emissions", {})
-        
-        # Format flight segments
-        segments = []
-        for flight in flights:
-            segment = {
-                "airline": flight.get("airline", "Unknown"),
-                "airline_logo": flight.get("airline_logo", ""),
-                "flight_number": flight.get("flight_number", "N/A"),
-                "departure_airport": {
-                    "name": flight.get("departure_airport", {}).get("name", "N/A"),
-                    "id": flight.get("departure_airport", {}).get("id", "N/A"),
-                    "time": flight.get("departure_airport", {}).get("time", "N/A")
-                },
-                "arrival_airport": {
-                    "name": flight.get("arrival_airport", {}).get("name", "N/A"),
-                    "id": flight.get("arrival_airport", {}).get("id", "N/A"),
-                    "time": flight.get("arrival_airport", {}).get("time", "N/A")
-                },
-                "duration": flight.get("duration", "N/A"),
-                "airplane": flight.get("airplane", "N/A"),
-                "travel_class": flight.get("travel_class", "N/A")
-            }
-            segments.append(segment)
-        
-        return {
-            "price": price,
-            "total_duration": total_duration,
-            "carbon_emissions": {
-                "this_flight": carbon_emissions.get("this_flight", "N/A"),
-                "typical_for_this_route": carbon_emissions.get("typical_for_this_route", "N/A"),
-                "difference_percent": carbon_emissions.get("difference_percent", "N/A")
-            },
-            "segments": segments,
-            "layovers": flight_option.get("layovers", []),
-            "booking_token": flight_option.get("booking_token", ""),
-            "extensions": flight_option.get("extensions", [])
-        }
-        
+        return formatted
     except Exception as e:
         print(f"❌ Error formatting flight data: {e}")
         return None
 
-def format_flights_response(flights_data):
+def flights_to_api(flights_data):
+    """
+    Serialize flight search results for an API response: flight options in
+    their lean form (see FlightOption.to_api), everything else unchanged.
+    
+    Args:
+        flights_data (dict): Flight search results, error info or None
+    
+    Returns:
+        dict: JSON-ready flight results (or the input if there are none)
+    """
+    if not flights_data or "error" in flights_data:
+        return flights_data
+    return {
+        **flights_data,
+        "best_flights": [flight.to_api() for flight in flights_data.get("best_flights", [])],
+        "other_flights": [flight.to_api() for flight in flights_data.get("other_flights", [])]
+    }
+
+def _or_na(value):
+    return "N/A" if value is None else value
+
+# Legend sent once at the top of each compact flight block
+FLIGHT_ROW_LEGEND = (
+    "n|price_usd|duration_min|stops|segments (airline flight_no from>to aircraft min; ...)"
+    "|depart|arrive|layovers (min@airport)|co2_kg|co2_vs_typical_%"
+)
+
+def format_flights_response(flights_data, prompt_format=PROMPT_FORMAT):
     """
     Format flight search results for AI consumption
     
     Args:
         flights_data (dict): Formatted flight search results
+        prompt_format (str): "compact" for one table row per option under a
+            legend, "markdown" for labelled blocks
     
     Returns:
         str: Formatted flight results for AI
     """
     if "error" in flights_data:
         return f"FLIGHT_SEARCH_ERROR: {flights_data['error']}"
-    
-    search_info = flights_data.get("search_info", {})
-    best_flights = flights_data.get("best_flights", [])
-    other_flights = flights_data.get("other_flights", [])
-    
-    formatted_response = "FLIGHT_SEARCH_RESULTS:\n\n"
-    formatted_response += f"**SEARCH DETAILS:**\n"
-    formatted_response += f"Route: {search_info.get('origin')} → {search_info.get('destination')}\n"
-    formatted_response += f"Departure: {search_info.get('departure_date')}\n"
-    
-    if search_info.get('return_date'):
-        formatted_response += f"Return: {search_info.get('return_date')}\n"
-        formatted_response += f"Trip Type: Round Trip\n"
-    else:
-        formatted_response += f"Trip Type: One Way\n"
-    
-    formatted_response += f"Passengers: {search_info.get('adults')} adult(s)\n"
-    formatted_response += f"Class: {search_info.get('travel_class')}\n\n"
-    
-    # Best flights
-    if best_flights:
-        formatted_response += f"**BEST FLIGHT OPTIONS ({len(best_flights)} found):**\n\n"
-        for i, flight in enumerate(best_flights, 1):
-            formatted_response += format_single_flight_for_ai(flight, i)
-    
-    # Other flights (limit to 5 for brevity)
-    if other_flights:
-        formatted_response += f"\n**OTHER FLIGHT OPTIONS (showing first 5 of {len(other_flights)}):**\n\n"
-        for i, flight in enumerate(other_flights[:5], len(best_flights) + 1):
-            formatted_response += format_single_flight_for_ai(flight, i)
-    
-    if not best_flights and not other_flights:
-        formatted_response += "**NO FLIGHTS FOUND**\n"
-        formatted_response += "No flights were found for the specified route and dates. Please try different dates or airports.\n"
-    
-    formatted_response += "\n**INSTRUCTION FOR AI:** Use only the flight information provided above. Include prices, airlines, times, and duration. Format this information in a user-friendly way with clear pricing and timing details."
-    
-    return formatted_response
-
-def format_single_flight_for_ai(flight, index):
-    """Format a single flight for AI consumption"""
-    segments = flight.get("segments", [])
-    price = flight.get("price", "N/A")
-    duration = flight.get("total_duration", "N/A")
-    carbon = flight.get("carbon_emissions", {}).get("this_flight", "N/A")
-    layovers = flight.get("layovers", [])
-    
-    flight_text = f"**{index}. FLIGHT OPTION - {price}**\n"
-    flight_text += f"   Total Duration: {duration}\n"
-    
-    if carbon != "N/A":
-        flight_text += f"   Carbon Emissions: {carbon}\n"
-    
-    if layovers:
-        layover_info = ", ".join([f"{layover.get('duration', 'N/A')} in {layover.get('name', 'Unknown')}" for layover in layovers])
-        flight_text += f"   Layovers: {layover_info}\n"
-    else:
-        flight_text += f"   Direct Flight: Yes\n"
-    
-    for j, segment in enumerate(segments, 1):
-        airline = segment.get("airline", "Unknown")
-        flight_num = segment.get("flight_number", "N/A")
-        dep_airport = segment.get("departure_airport", {})
-        arr_airport = segment.get("arrival_airport", {})
-        seg_duration = segment.get("duration", "N/A")
-        airplane = segment.get("airplane", "N/A")
-        
-        if len(segments) > 1:
-            flight_text += f"\n   === SEGMENT {j} ===\n"
-        
-        flight_text += f"   Airline: {airline} {flight_num}\n"
-        flight_text += f"   Aircraft: {airplane}\n"
-        flight_text += f"   Departure: {dep_airport.get('name', 'N/A')} ({dep_airport.get('id', 'N/A')}) at {dep_airport.get('time', 'N/A')}\n"
-        flight_text += f"   Arrival: {arr_airport.get('name', 'N/A')} ({arr_airport.get('id', 'N/A')}) at {arr_airport.get('time', 'N/A')}\n"
-        flight_text += f"   Flight Duration: {seg_duration}\n"
-    
-    flight_text += "\n"
-    return flight_text
+    fragments = render_flights_compact(flights_data) if prompt_format == "compact" else render_flights(flights_data, "ai")
+    return measure_prompt(f"format_flights_response:{prompt_format}", render_to_string(fragments))
 
 def format_flights_for_user(flights_data):
     """
@@ -268,122 +565,322 @@ def format_flights_for_user(flights_data):
     Returns:
         str: User-friendly formatted flights section
     """
-    if "error" in flights_data:
-        return f"\n\n✈️ **Flight Search Error:** {flights_data['error']}"
-    
-    search_info = flights_data.get("search_info", {})
-    best_flights = flights_data.get("best_flights", [])
-    
-    if not best_flights:
-        return f"\n\n✈️ **Flight Search:** No flights found for {search_info.get('origin')} → {search_info.get('destination')}"
-    
-    flights_section = f"\n\n✈️ **Flight Options for {search_info.get('origin')} → {search_info.get('destination')}:**\n"
-    
-    # Show top 3 flight options
-    for i, flight in enumerate(best_flights[:3], 1):
-        price = flight.get("price", "N/A")
-        duration = flight.get("total_duration", "N/A")
-        segments = flight.get("segments", [])
-        
-        flights_section += f"\n**Option {i}: {price}** (Duration: {duration})\n"
-        
-        if segments:
-            first_segment = segments[0]
-            last_segment = segments[-1] if len(segments) > 1 else first_segment
-            
-            dep_time = first_segment.get("departure_airport", {}).get("time", "N/A")
-            arr_time = last_segment.get("arrival_airport", {}).get("time", "N/A")
-            airline = first_segment.get("airline", "Unknown")
-            
-            flights_section += f"📅 {dep_time} → {arr_time} ({airline}"
-            
-            if len(segments) > 1:
-                flights_section += f" + {len(segments) - 1} stop(s)"
-            
-            flights_section += ")\n"
-    
-    if len(best_flights) > 3:
-        flights_section += f"\n... and {len(best_flights) - 3} more options available\n"
-    
-    return flights_section
+    return render_to_string(render_flights(flights_data, "user"))
 
-def validate_serpapi():
+def print_flights_to_terminal(flights_data):
     """
-    Validate that SerpAPI key is available
+    Print flight search results to terminal in a nice format
     
-    Returns:
-        bool: True if API key is available, False otherwise
+    Args:
+        flights_data (dict): Formatted flight search results
     """
-    if not SERPAPI_API_KEY:
-        print("⚠️ Warning: SERPAPI_API_KEY not found in environment variables")
-        return False
-    
-    print("✅ SerpAPI key found")
-    return True
+    write_fragments(render_flights(flights_data, "terminal"))
 
-def print_flights_to_terminal(flights_data):
+def format_single_flight_for_ai(flight, index):
+    """Format a single flight for AI consumption"""
+    return render_to_string(_render_ai_flight(flight, index))
+
+def print_single_flight_to_terminal(flight, index):
+    """Print a single flight to terminal"""
+    write_fragments(_render_terminal_flight(flight, index))
+
+def render_flights(flights_data, audience="ai"):
     """
-    Print flight search results to terminal in a nice format
+    Yield flight search results as text fragments for one audience.
+    
+    The AI prompt ("ai"), the travel summary shown to the user ("user") and
+    the terminal log ("terminal") share this path and differ only in their
+    FLIGHT_LAYOUTS entry: the error line, the header, the sections listed
+    (each with how many options it shows), how one option is drawn and the
+    footer. Options beyond a section's limit are never rendered, and
+    nothing is joined until the caller asks for a string.
     
     Args:
         flights_data (dict): Formatted flight search results
-    """
-    print("\n" + "="*80)
-    print(f"🛫 FLIGHT SEARCH RESULTS")
-    print("="*80)
+        audience (str): "ai", "user" or "terminal"
     
+    Yields:
+        str: Text fragments
+    """
+    layout = FLIGHT_LAYOUTS[audience]
     if "error" in flights_data:
-        print(f"❌ Error: {flights_data['error']}")
-        print("="*80 + "\n")
+        yield layout["error"].format(error=flights_data["error"])
         return
     
+    yield from layout["header"](flights_data)
+    number = 1
+    for title, options, limit in layout["sections"](flights_data):
+        if not options:
+            continue
+        yield title
+        for index, flight in enumerate(islice(options, limit), number):
+            yield from layout["flight"](flight, index)
+        number += len(options)
+    yield from layout["footer"](flights_data)
+
+def _render_ai_header(flights_data):
     search_info = flights_data.get("search_info", {})
-    print(f"Route: {search_info.get('origin')} → {search_info.get('destination')}")
-    print(f"Departure: {search_info.get('departure_date')}")
+    yield "FLIGHT_SEARCH_RESULTS:\n\n**SEARCH DETAILS:**\n"
+    yield f"Route: {search_info.get('origin')} → {search_info.get('destination')}\n"
+    if search_info.get('airport_pairs'):
+        yield f"Airport pairs searched: {', '.join(search_info['airport_pairs'])}\n"
+    yield f"Departure: {search_info.get('departure_date')}\n"
     if search_info.get('return_date'):
-        print(f"Return: {search_info.get('return_date')}")
-    print(f"Passengers: {search_info.get('adults')} adult(s)")
-    print(f"Class: {search_info.get('travel_class')}")
+        yield f"Return: {search_info.get('return_date')}\nTrip Type: Round Trip\n"
+    else:
+        yield "Trip Type: One Way\n"
+    yield f"Passengers: {search_info.get('adults')} adult(s)\n"
+    yield f"Class: {search_info.get('travel_class')}\n\n"
+    if flights_data.get("date_matrix"):
+        yield from render_date_matrix(flights_data["date_matrix"])
+    if search_info.get("preferences_relaxed") and flights_data.get("best_flights"):
+        yield f"Note: no option matched the requested {' and '.join(search_info['preferences_relaxed'])}, so that preference was dropped.\n\n"
+
+def _ai_sections(flights_data):
+    search_info = flights_data.get("search_info", {})
+    best_flights = flights_data.get("best_flights", [])
+    other_flights = flights_data.get("other_flights", [])
+    # The top options when they were ranked locally (see flight_ranking.select_flights)
+    if search_info.get("options_found"):
+        best_title = f"**TOP {len(best_flights)} OF {search_info['options_found']} FLIGHT OPTIONS (best match first):**\n\n"
+    else:
+        best_title = f"**BEST FLIGHT OPTIONS ({len(best_flights)} found):**\n\n"
+    return [
+        (best_title, best_flights, None),
+        # Other flights (limit to 5 for brevity)
+        (f"\n**OTHER FLIGHT OPTIONS (showing first 5 of {len(other_flights)}):**\n\n", other_flights, 5)
+    ]
+
+def _render_ai_flight(flight, index):
+    segments = flight.segments
+    yield f"**{index}. FLIGHT OPTION - {_or_na(flight.price)}**\n"
+    yield f"   Total Duration: {_or_na(flight.total_duration)}\n"
+    if flight.emissions is not None:
+        yield f"   Carbon Emissions: {flight.emissions}\n"
+    if flight.layovers:
+        yield "   Layovers: "
+        yield ", ".join(f"{_or_na(layover.duration)} in {layover.name or 'Unknown'}" for layover in flight.layovers)
+        yield "\n"
+    else:
+        yield "   Direct Flight: Yes\n"
     
+    for j, segment in enumerate(segments, 1):
+        if len(segments) > 1:
+            yield f"\n   === SEGMENT {j} ===\n"
+        yield f"   Airline: {segment.airline} {_or_na(segment.flight_number)}\n"
+        yield f"   Aircraft: {_or_na(segment.airplane)}\n"
+        yield f"   Departure: {_or_na(segment.departure_name)} ({_or_na(segment.departure_id)}) at {_or_na(segment.departure_time)}\n"
+        yield f"   Arrival: {_or_na(segment.arrival_name)} ({_or_na(segment.arrival_id)}) at {_or_na(segment.arrival_time)}\n"
+        yield f"   Flight Duration: {_or_na(segment.duration)}\n"
+    yield "\n"
+
+def _render_ai_footer(flights_data):
+    if not flights_data.get("best_flights") and not flights_data.get("other_flights"):
+        yield "**NO FLIGHTS FOUND**\n"
+        yield "No flights were found for the specified route and dates. Please try different dates or airports.\n"
+    yield "\n**INSTRUCTION FOR AI:** Use only the flight information provided above. Include prices, airlines, times, and duration. Format this information in a user-friendly way with clear pricing and timing details."
+
+def _render_user_header(flights_data):
+    search_info = flights_data.get("search_info", {})
+    route = f"{search_info.get('origin')} → {search_info.get('destination')}"
+    if flights_data.get("best_flights"):
+        yield f"\n\n✈️ **Flight Options for {route}:**\n"
+    else:
+        yield f"\n\n✈️ **Flight Search:** No flights found for {route}"
+
+def _user_sections(flights_data):
+    # Show top 3 flight options
+    return [("", flights_data.get("best_flights", []), 3)]
+
+def _render_user_flight(flight, index):
+    segments = flight.segments
+    yield f"\n**Option {index}: {_or_na(flight.price)}** (Duration: {_or_na(flight.total_duration)})\n"
+    if segments:
+        yield f"📅 {_or_na(segments[0].departure_time)} → {_or_na(segments[-1].arrival_time)} ({flight.airline}"
+        if len(segments) > 1:
+            yield f" + {len(segments) - 1} stop(s)"
+        yield ")\n"
+
+def _render_user_footer(flights_data):
+    best_flights = flights_data.get("best_flights", [])
+    if len(best_flights) > 3:
+        yield f"\n... and {len(best_flights) - 3} more options available\n"
+
+def _render_terminal_header(flights_data):
+    search_info = flights_data.get("search_info", {})
+    yield "\n" + "=" * 80 + "\n🛫 FLIGHT SEARCH RESULTS\n" + "=" * 80 + "\n"
+    yield f"Route: {search_info.get('origin')} → {search_info.get('destination')}\n"
+    yield f"Departure: {search_info.get('departure_date')}\n"
+    if search_info.get('return_date'):
+        yield f"Return: {search_info.get('return_date')}\n"
+    yield f"Passengers: {search_info.get('adults')} adult(s)\n"
+    yield f"Class: {search_info.get('travel_class')}\n"
+
+def _terminal_sections(flights_data):
     best_flights = flights_data.get("best_flights", [])
     other_flights = flights_data.get("other_flights", [])
+    return [
+        (f"\n🌟 BEST FLIGHTS ({len(best_flights)}):\n" + "-" * 40 + "\n", best_flights, None),
+        (f"\n✈️ OTHER OPTIONS (showing first 3 of {len(other_flights)}):\n" + "-" * 40 + "\n", other_flights, 3)
+    ]
+
+def _render_terminal_flight(flight, index):
+    segments = flight.segments
+    yield f"\n{index}. {_or_na(flight.price)} - {_or_na(flight.total_duration)}\n"
+    for j, segment in enumerate(segments, 1):
+        flight_num = _or_na(segment.flight_number)
+        if len(segments) > 1:
+            yield f"   Segment {j}: {segment.airline} {flight_num}\n"
+        else:
+            yield f"   {segment.airline} {flight_num}\n"
+        yield f"   {_or_na(segment.departure_time)} {_or_na(segment.departure_id)} → {_or_na(segment.arrival_time)} {_or_na(segment.arrival_id)}\n"
+
+def _render_terminal_footer(flights_data):
+    yield "\n" + "=" * 80 + "\n\n"
+
+FLIGHT_LAYOUTS = {
+    "ai": {
+        "error": "FLIGHT_SEARCH_ERROR: {error}",
+        "header": _render_ai_header,
+        "sections": _ai_sections,
+        "flight": _render_ai_flight,
+        "footer": _render_ai_footer
+    },
+    "user": {
+        "error": "\n\n✈️ **Flight Search Error:** {error}",
+        "header": _render_user_header,
+        "sections": _user_sections,
+        "flight": _render_user_flight,
+        "footer": _render_user_footer
+    },
+    "terminal": {
+        "error": "\n" + "=" * 80 + "\n🛫 FLIGHT SEARCH RESULTS\n" + "=" * 80 + "\n❌ Error: {error}\n" + "=" * 80 + "\n\n",
+        "header": _render_terminal_header,
+        "sections": _terminal_sections,
+        "flight": _render_terminal_flight,
+        "footer": _render_terminal_footer
+    }
+}
+
+def _cell(value):
+    """A table cell: "-" when missing, with the column separator escaped."""
+    return "-" if value is None or value == "" else str(value).replace("|", "/")
+
+def format_flight_row(flight, index):
+    """One compact table row for a flight option (columns in FLIGHT_ROW_LEGEND)."""
+    segments = "; ".join(
+        " ".join(part for part in (
+            segment.airline, segment.flight_number,
+            f"{segment.departure_id or '?'}>{segment.arrival_id or '?'}",
+            segment.airplane, f"{segment.duration}" if segment.duration is not None else None
+        ) if part)
+        for segment in flight.segments
+    )
+    layovers = ", ".join(
+        f"{_cell(layover.duration)}@{layover.airport_id or layover.name or '?'}" + (" overnight" if layover.overnight else "")
+        for layover in flight.layovers
+    )
+    difference = flight.emissions_difference_percent
+    return "|".join(_cell(value) for value in (
+        index,
+        flight.price,
+        flight.total_duration,
+        flight.stops,
+        segments,
+        flight.segments[0].departure_time if flight.segments else None,
+        flight.segments[-1].arrival_time if flight.segments else None,
+        layovers,
+        round(flight.emissions / 1000) if flight.emissions is not None else None,
+        f"{difference:+d}" if isinstance(difference, int) else difference
+    ))
+
+def render_flights_compact(flights_data):
+    """
+    Yield compact flight results for the AI: a header line, the column
+    legend, one row per option and an airport-name legend, with every
+    field the markdown layout carries.
+    """
+    search_info = flights_data.get("search_info", {})
+    flights = flights_data.get("best_flights", []) + flights_data.get("other_flights", [])[:5]
+    
+    header = [
+        f"route={search_info.get('origin')}>{search_info.get('destination')}",
+        f"depart={search_info.get('departure_date')}",
+        f"return={search_info.get('return_date') or 'one-way'}",
+        f"adults={search_info.get('adults')}",
+        f"class={search_info.get('travel_class')}"
+    ]
+    if search_info.get("options_found"):
+        header.append(f"showing={len(flights)} best of {search_info['options_found']}")
+    if search_info.get("airport_pairs"):
+        header.append(f"pairs={','.join(search_info['airport_pairs'])}")
+    yield "FLIGHT_SEARCH_RESULTS\n" + " ".join(header) + "\n"
+    if search_info.get("preferences_relaxed"):
+        yield f"note: nothing matched the requested {' and '.join(search_info['preferences_relaxed'])}; that preference was dropped\n"
+    if flights_data.get("date_matrix"):
+        yield from render_date_matrix(flights_data["date_matrix"])
+    
+    if not flights:
+        yield "NO FLIGHTS FOUND for this route and dates\n"
+        return
     
-    if best_flights:
-        print(f"\n🌟 BEST FLIGHTS ({len(best_flights)}):")
-        print("-" * 40)
-        for i, flight in enumerate(best_flights, 1):
-            print_single_flight_to_terminal(flight, i)
+    yield FLIGHT_ROW_LEGEND + "\n"
+    airports = {}
+    for i, flight in enumerate(flights, 1):
+        yield format_flight_row(flight, i) + "\n"
+        for segment in flight.segments:
+            for code, name in ((segment.departure_id, segment.departure_name), (segment.arrival_id, segment.arrival_name)):
+                if code and name:
+                    airports.setdefault(code, name)
+    if airports:
+        yield "airports: " + "; ".join(f"{code}={name}" for code, name in airports.items()) + "\n"
+
+def render_date_matrix(date_matrix):
+    """
+    Yield a flexible-date price grid as a compact table for the AI.
     
-    if other_flights:
-        print(f"\n✈️ OTHER OPTIONS (showing first 3 of {len(other_flights)}):")
-        print("-" * 40)
-        for i, flight in enumerate(other_flights[:3], len(best_flights) + 1):
-            print_single_flight_to_terminal(flight, i)
+    Args:
+        date_matrix (dict): The "date_matrix" part of search_flight_date_matrix results
     
-    print("\n" + "="*80 + "\n")
+    Yields:
+        str: Price grid section (rows are departure dates, columns return dates)
+    """
+    def price_cell(price):
+        return f"${price}" if price is not None else "-"
+    
+    departure_dates = date_matrix.get("departure_dates", [])
+    return_dates = date_matrix.get("return_dates", [])
+    prices = date_matrix.get("prices", [])
+    
+    yield f"**PRICE BY DATE (cheapest fare, ±{date_matrix.get('flex_days')} days, '-' = no fare found):**\n"
+    if return_dates:
+        yield "Depart \\ Return | " + " | ".join(return_dates) + "\n"
+        for departure, row in zip(departure_dates, prices):
+            yield f"{departure} | " + " | ".join(price_cell(price) for price in row) + "\n"
+    else:
+        for departure, row in zip(departure_dates, prices):
+            yield f"{departure}: {price_cell(row[0])}\n"
+    
+    cheapest = date_matrix.get("cheapest")
+    if cheapest:
+        stops = "nonstop" if not cheapest["stops"] else f"{cheapest['stops']} stop(s)"
+        yield f"Cheapest: ${cheapest['price']} departing {cheapest['departure_date']}"
+        if cheapest.get("return_date"):
+            yield f", returning {cheapest['return_date']}"
+        yield f" ({cheapest['airline']}, {stops})\n"
+    
+    yield "\nFlight details below are for the requested dates.\n\n"
 
-def print_single_flight_to_terminal(flight, index):
-    """Print a single flight to terminal"""
-    price = flight.get("price", "N/A")
-    duration = flight.get("total_duration", "N/A")
-    segments = flight.get("segments", [])
+def validate_serpapi():
+    """
+    Validate that SerpAPI key is available
     
-    print(f"\n{index}. {price} - {duration}")
+    Returns:
+        bool: True if API key is available, False otherwise
+    """
+    if not SERPAPI_API_KEY:
+        print("⚠️ Warning: SERPAPI_API_KEY not found in environment variables")
+        return False
     
-    for j, segment in enumerate(segments, 1):
-        airline = segment.get("airline", "Unknown")
-        flight_num = segment.get("flight_number", "N/A")
-        dep_airport = segment.get("departure_airport", {})
-        arr_airport = segment.get("arrival_airport", {})
-        
-        dep_time = dep_airport.get("time", "N/A")
-        arr_time = arr_airport.get("time", "N/A")
-        dep_code = dep_airport.get("id", "N/A")
-        arr_code = arr_airport.get("id", "N/A")
-        
-        if len(segments) > 1:
-            print(f"   Segment {j}: {airline} {flight_num}")
-        else:
-            print(f"   {airline} {flight_num}")
-        
-        print(f"   {dep_time} {dep_code} → {arr_time} {arr_code}")
\ No newline at end of file
+    print("✅ SerpAPI key found")
+    return True
\ No newline at end of file
@@ -1,36 +1,130 @@
 import os
+import re
 import requests
+from itertools import islice
 from dotenv import load_dotenv
+from result_cache import TTLCache
+import bootstrap  # noqa: F401  (puts the shared package on sys.path)
+from shared.resilience import get_upstream, retryable_status
+from shared.context_window import PROMPT_FORMAT, measure_prompt
+from rendering import render_to_string, write_fragments
 
 # Load environment variables
 load_dotenv()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+TAVILY_URL = os.getenv("TAVILY_URL", "https://api.tavily.com/search")
+
+# Searches are read-only, so failed ones are retried; TAVILY_TIMEOUT/RETRIES/BREAKER_* override these
+tavily_upstream = get_upstream("tavily", timeout=10.0, retries=2)
+
+# Activity results change slowly: serve them for hours, and for a further
+# stale window while a background refresh runs
+ACTIVITY_CACHE_TTL = float(os.getenv("ACTIVITY_CACHE_TTL", str(6 * 3600)))
+ACTIVITY_CACHE_STALE_TTL = float(os.getenv("ACTIVITY_CACHE_STALE_TTL", str(24 * 3600)))
+ACTIVITY_CACHE_SIZE = int(os.getenv("ACTIVITY_CACHE_SIZE", "512"))
+activity_cache = TTLCache(
+    ACTIVITY_CACHE_SIZE, ACTIVITY_CACHE_TTL, name="Activity cache", stale_ttl=ACTIVITY_CACHE_STALE_TTL
+)
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# Words that do not change what is being searched for: filler, question words
+# and the generic terms every activity query already includes
+INTENT_STOPWORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "around", "at", "best", "can", "could", "do", "does",
+    "find", "for", "from", "get", "give", "good", "great", "guide", "have", "help", "how", "i", "in", "into",
+    "is", "it", "like", "list", "looking", "me", "my", "near", "need", "of", "on", "or", "our", "place",
+    "please", "recommend", "recommendation", "show", "some", "suggest", "suggestion", "tell", "the", "there",
+    "thing", "things", "this", "to", "top", "travel", "trip", "us", "visit", "visiting", "want", "we",
+    "what", "where", "which", "while", "with", "would", "you",
+    "activity", "activities", "attraction", "attractions", "sightseeing", "tourist", "none", "n",
+    "preference", "preferences"
+}
+
+# Words that negate the next meaningful word, so "no museums" and "museums" differ
+NEGATIONS = {"no", "not", "without", "avoid", "except", "never", "don't", "dont"}
+
+def _stem(word):
+    """Fold simple plurals so "museums"/"museum" and "families"/"family" match."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def activity_search_key(destination, activities="", user_query=""):
+    """
+    Normalize an activity search into a (destination, intent) cache key.
+    
+    The destination is case-folded and whitespace-collapsed. The intent is
+    the sorted set of meaningful words from the user's query (or, failing
+    that, their activity preferences), without filler words, the destination
+    itself and simple plurals, so "What are the best things to do in Paris?"
+    and "things to do in paris" share an entry. A negated word is kept as
+    "-word", so "no museums" does not share an entry with "museums".
+    
+    The key is only used for caching; Tavily is sent the user's own wording
+    (see build_activity_query).
+    
+    Returns:
+        tuple: (destination, intent words)
+    """
+    place = " ".join(WORD_RE.findall(destination.casefold()))
+    place_words = set(place.split())
+    text = user_query or activities or ""
+    intent = set()
+    negated = False
+    for word in WORD_RE.findall(text.casefold()):
+        if word in NEGATIONS:
+            negated = True
+        elif word not in INTENT_STOPWORDS and word not in place_words:
+            word = _stem(word)
+            if word not in INTENT_STOPWORDS:
+                intent.add(f"-{word}" if negated else word)
+            negated = False
+    return place, tuple(sorted(intent))
+
+def build_activity_query(destination, activities="", user_query=""):
+    """Build the Tavily query from the user's own wording, or their activity preferences."""
+    if user_query and user_query.strip():
+        return f"{user_query.strip()} {destination} travel guide attractions activities"
+    if activities and activities.strip().lower() not in ("none", "n/a", "no preference"):
+        return f"best {activities.strip()} and attractions in {destination} travel guide"
+    return f"top tourist attractions and activities in {destination} travel guide sightseeing"
 
 def search_activities(destination: str, activities: str = "", user_query: str = ""):
     """
     Search for activities and attractions using Tavily API
     
+    Results are cached per normalized (destination, intent) for
+    ACTIVITY_CACHE_TTL seconds. After that they are still served for
+    ACTIVITY_CACHE_STALE_TTL seconds while being refreshed in the
+    background, and concurrent identical searches share one Tavily call.
+    
     Args:
         destination (str): The destination to search for
         activities (str): Specific activity preferences (optional)
-        user_query (str): The original user query (optional)
+        user_query (str): The user's own query, without the frontend's instructions (optional)
     
     Returns:
-        dict: Tavily API response with search results, or None if error
+        dict: Tavily API response with search results, or None if error (shared; do not modify)
     """
+    if not destination or not destination.strip():
+        print("Tavily search skipped: no destination given")
+        return None
+    
+    key = activity_search_key(destination, activities, user_query)
+    return activity_cache.get_or_load(
+        key,
+        lambda: _search_activities_upstream(build_activity_query(destination, activities, user_query), destination),
+        cacheable=lambda result: result is not None
+    )
+
+def _search_activities_upstream(query, destination):
+    """Run one Tavily search (uncached; see search_activities)."""
     try:
-        # Create a comprehensive search query based on user input
-        if user_query and destination:
-            # Use the user's specific query with the destination
-            query = f"{user_query} {destination} travel guide attractions activities"
-        elif activities and activities.lower() not in ['none', 'n/a', 'no preference']:
-            query = f"best {activities} and attractions in {destination} travel guide"
-        else:
-            query = f"top tourist attractions and activities in {destination} travel guide sightseeing"
-        
         print(f"Tavily search query: {query}")
         
-        url = "https://api.tavily.com/search"
         headers = {
             "Authorization": f"Bearer {TAVILY_API_KEY}",
             "Content-Type": "application/json"
@@ -44,7 +138,10 @@ def search_activities(destination: str, activities: str = "", user_query: str =
             "include_raw_content": False
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = tavily_upstream.call(
+            requests.post, TAVILY_URL, headers=headers, json=data, timeout=tavily_upstream.timeout,
+            retry_if=retryable_status
+        )
         
         if response.status_code == 200:
             result = response.json()
@@ -58,61 +155,22 @@ def search_activities(destination: str, activities: str = "", user_query: str =
         print(f"Error in Tavily search: {e}")
         return None
 
-def format_activities_response(activities_data):
+def format_activities_response(activities_data, prompt_format=PROMPT_FORMAT):
     """
     Format the activities search results for the AI to use - IMPROVED VERSION
     
     Args:
         activities_data (dict): Raw Tavily API response
+        prompt_format (str): "compact" for one table row per result under a
+            legend, "markdown" for labelled blocks
     
     Returns:
         str: Formatted search results for AI consumption
     """
     if not activities_data or not activities_data.get('results'):
         return "No detailed activity results found."
-    
-    formatted_results = "ACTIVITY_SEARCH_RESULTS:\n\n"
-    
-    # Add the AI-generated answer if available
-    if activities_data.get('answer'):
-        formatted_results += f"**OVERVIEW:** {activities_data['answer']}\n\n"
-    
-    formatted_results += "**TOP RECOMMENDATIONS FROM SEARCH:**\n\n"
-    
-    for i, result in enumerate(activities_data['results'][:5], 1):
-        title = result.get('title', 'Activity')
-        url = result.get('url', '')
-        content = result.get('content', '')
-        score = result.get('score', 'N/A')
-        
-        # Clean and truncate content but keep it substantial
-        if content:
-            content = content[:400] + "..." if len(content) > 400 else content
-        else:
-            content = "Great place to visit!"
-        
-        formatted_results += f"**{i}. {title}**\n"
-        formatted_results += f"   **Score:** {score}\n"
-        formatted_results += f"   **Description:** {content}\n"
-        if url:
-            formatted_results += f"   **URL:** {url}\n"
-        formatted_results += "\n"
-    
-    # Add images info if available
-    if activities_data.get('images'):
-        formatted_results += f"**AVAILABLE IMAGES:** {len(activities_data['images'])} photos\n"
-        for i, image_url in enumerate(activities_data['images'][:3], 1):
-            formatted_results += f"   {i}. {image_url}\n"
-        formatted_results += "\n"
-    
-    # Add search query info
-    if activities_data.get('query'):
-        formatted_results += f"**SEARCH QUERY USED:** {activities_data['query']}\n\n"
-    
-    # IMPORTANT: Add specific instruction for AI
-    formatted_results += "**INSTRUCTION FOR AI:** Please use the above search results to provide specific recommendations to the user. Include the actual titles, descriptions, URLs, and images from the search results. Do not generate generic information - use only the data provided above."
-    
-    return formatted_results
+    fragments = render_activities_compact(activities_data) if prompt_format == "compact" else render_activities(activities_data, "ai")
+    return measure_prompt(f"format_activities_response:{prompt_format}", render_to_string(fragments))
 
 def format_activities_for_user(activities_data, destination):
     """
@@ -125,41 +183,7 @@ def format_activities_for_user(activities_data, destination):
     Returns:
         str: User-friendly formatted activities section
     """
-    if not activities_data or not activities_data.get('results'):
-        return f"\n\n🎯 **Activities for {destination}:**\nI'll help you find amazing activities once we start planning your itinerary!"
-    
-    activities_section = f"\n\n🎯 **Recommended Activities & Attractions in {destination}:**\n"
-    
-    # Add overview if available
-    if activities_data.get('answer'):
-        activities_section += f"\n📋 **Overview:** {activities_data['answer']}\n"
-    
-    activities_section += "\n🌟 **Top Recommendations:**\n"
-    
-    for i, result in enumerate(activities_data['results'][:5], 1):
-        title = result.get('title', 'Activity')
-        url = result.get('url', '')
-        content = result.get('content', '')
-        score = result.get('score', 'N/A')
-        
-        # Clean and truncate content
-        if content:
-            content = content[:300] + "..." if len(content) > 300 else content
-        else:
-            content = "Great destination to explore!"
-        
-        activities_section += f"\n**{i}. {title}** (Score: {score})\n"
-        activities_section += f"📝 {content}\n"
-        if url:
-            activities_section += f"🔗 [Learn more]({url})\n"
-    
-    # Add images if available
-    if activities_data.get('images'):
-        activities_section += f"\n📸 **Destination Images:** {len(activities_data['images'])} photos available\n"
-        for i, image_url in enumerate(activities_data['images'][:3], 1):
-            activities_section += f"   {i}. ![Image {i}]({image_url})\n"
-    
-    return activities_section
+    return render_to_string(render_activities(activities_data, "user", destination))
 
 def print_search_results_to_terminal(activities_data, destination):
     """
@@ -169,54 +193,170 @@ def print_search_results_to_terminal(activities_data, destination):
         activities_data (dict): Raw Tavily API response
         destination (str): The destination that was searched
     """
-    print("\n" + "="*80)
-    print(f"🔍 TAVILY SEARCH RESULTS FOR: {destination.upper()}")
-    print("="*80)
+    write_fragments(render_activities(activities_data, "terminal", destination))
+
+def render_activities(activities_data, audience="ai", destination=""):
+    """
+    Yield activity search results as text fragments for one audience.
     
+    The AI prompt ("ai"), the travel summary shown to the user ("user") and
+    the terminal log ("terminal") share this path and differ only in their
+    ACTIVITY_LAYOUTS entry: the header, the overview, how many results are
+    listed and how one is drawn, the images and the footer.
+    
+    Args:
+        activities_data (dict): Raw Tavily API response
+        audience (str): "ai", "user" or "terminal"
+        destination (str): The destination that was searched
+    
+    Yields:
+        str: Text fragments
+    """
+    layout = ACTIVITY_LAYOUTS[audience]
     if not activities_data or not activities_data.get('results'):
-        print("❌ No results found")
-        print("="*80 + "\n")
+        yield layout["empty"].format(destination=destination, upper=destination.upper())
         return
     
-    # Print overview/answer if available
+    yield layout["header"].format(destination=destination, upper=destination.upper())
     if activities_data.get('answer'):
-        print(f"\n📋 OVERVIEW:")
-        print("-" * 40)
-        print(f"{activities_data['answer']}")
-    
-    # Print search results
-    results = activities_data.get('results', [])
-    print(f"\n🌟 TOP {len(results)} RECOMMENDATIONS:")
-    print("-" * 40)
-    
-    for i, result in enumerate(results, 1):
-        title = result.get('title', 'Unknown Activity')
-        url = result.get('url', 'No URL')
-        content = result.get('content', 'No description available')
-        score = result.get('score', 'N/A')
-        
-        print(f"\n{i}. {title}")
-        print(f"   Score: {score}")
-        print(f"   URL: {url}")
-        print(f"   Description: {content[:200]}{'...' if len(content) > 200 else ''}")
+        yield layout["overview"].format(answer=activities_data['answer'])
     
-    # Print additional info
-    if activities_data.get('images'):
-        print(f"\n📸 IMAGES AVAILABLE: {len(activities_data['images'])} photos")
-        for i, image in enumerate(activities_data['images'][:3], 1):  # Show first 3 image URLs
-            print(f"   {i}. {image}")
+    results = activities_data['results']
+    yield layout["results"].format(count=len(results))
+    for i, result in enumerate(islice(results, layout["limit"]), 1):
+        yield from layout["result"](result, i)
+    
+    images = activities_data.get('images')
+    if images:
+        yield layout["images"].format(count=len(images))
+        for i, image_url in enumerate(images[:3], 1):
+            yield layout["image"].format(i=i, url=image_url)
+    yield from layout["footer"](activities_data)
+
+def _render_ai_activity(result, i):
+    content = result.get('content', '')
+    # Clean and truncate content but keep it substantial
+    if content:
+        content = content[:400] + "..." if len(content) > 400 else content
+    else:
+        content = "Great place to visit!"
     
-    # Print query info
+    yield f"**{i}. {result.get('title', 'Activity')}**\n"
+    yield f"   **Score:** {result.get('score', 'N/A')}\n"
+    yield f"   **Description:** {content}\n"
+    if result.get('url', ''):
+        yield f"   **URL:** {result['url']}\n"
+    yield "\n"
+
+def _render_ai_activities_footer(activities_data):
+    if activities_data.get('images'):
+        yield "\n"
+    # Add search query info
     if activities_data.get('query'):
-        print(f"\n🔎 SEARCH QUERY USED: {activities_data['query']}")
+        yield f"**SEARCH QUERY USED:** {activities_data['query']}\n\n"
+    # IMPORTANT: Add specific instruction for AI
+    yield "**INSTRUCTION FOR AI:** Please use the above search results to provide specific recommendations to the user. Include the actual titles, descriptions, URLs, and images from the search results. Do not generate generic information - use only the data provided above."
+
+def _render_user_activity(result, i):
+    content = result.get('content', '')
+    # Clean and truncate content
+    if content:
+        content = content[:300] + "..." if len(content) > 300 else content
+    else:
+        content = "Great destination to explore!"
     
-    # Print response time and follow-up URLs if available
+    yield f"\n**{i}. {result.get('title', 'Activity')}** (Score: {result.get('score', 'N/A')})\n"
+    yield f"📝 {content}\n"
+    if result.get('url', ''):
+        yield f"🔗 [Learn more]({result['url']})\n"
+
+def _render_terminal_activity(result, i):
+    content = result.get('content', 'No description available')
+    yield f"\n{i}. {result.get('title', 'Unknown Activity')}\n"
+    yield f"   Score: {result.get('score', 'N/A')}\n"
+    yield f"   URL: {result.get('url', 'No URL')}\n"
+    yield f"   Description: {content[:200]}{'...' if len(content) > 200 else ''}\n"
+
+def _render_terminal_activities_footer(activities_data):
+    if activities_data.get('query'):
+        yield f"\n🔎 SEARCH QUERY USED: {activities_data['query']}\n"
     if activities_data.get('follow_up_questions'):
-        print(f"\n❓ SUGGESTED FOLLOW-UP QUESTIONS:")
+        yield "\n❓ SUGGESTED FOLLOW-UP QUESTIONS:\n"
         for i, question in enumerate(activities_data['follow_up_questions'][:3], 1):
-            print(f"   {i}. {question}")
+            yield f"   {i}. {question}\n"
+    yield "\n" + "=" * 80 + "\n\n"
+
+_TERMINAL_BANNER = "\n" + "=" * 80 + "\n🔍 TAVILY SEARCH RESULTS FOR: {upper}\n" + "=" * 80 + "\n"
+
+def _no_footer(activities_data):
+    return iter(())
+
+ACTIVITY_LAYOUTS = {
+    "ai": {
+        "empty": "No detailed activity results found.",
+        "header": "ACTIVITY_SEARCH_RESULTS:\n\n",
+        "overview": "**OVERVIEW:** {answer}\n\n",
+        "results": "**TOP RECOMMENDATIONS FROM SEARCH:**\n\n",
+        "limit": 5,
+        "result": _render_ai_activity,
+        "images": "**AVAILABLE IMAGES:** {count} photos\n",
+        "image": "   {i}. {url}\n",
+        "footer": _render_ai_activities_footer
+    },
+    "user": {
+        "empty": "\n\n🎯 **Activities for {destination}:**\nI'll help you find amazing activities once we start planning your itinerary!",
+        "header": "\n\n🎯 **Recommended Activities & Attractions in {destination}:**\n",
+        "overview": "\n📋 **Overview:** {answer}\n",
+        "results": "\n🌟 **Top Recommendations:**\n",
+        "limit": 5,
+        "result": _render_user_activity,
+        "images": "\n📸 **Destination Images:** {count} photos available\n",
+        "image": "   {i}. ![Image {i}]({url})\n",
+        "footer": _no_footer
+    },
+    "terminal": {
+        "empty": _TERMINAL_BANNER + "❌ No results found\n" + "=" * 80 + "\n\n",
+        "header": _TERMINAL_BANNER,
+        "overview": "\n📋 OVERVIEW:\n" + "-" * 40 + "\n{answer}\n",
+        "results": "\n🌟 TOP {count} RECOMMENDATIONS:\n" + "-" * 40 + "\n",
+        "limit": None,
+        "result": _render_terminal_activity,
+        "images": "\n📸 IMAGES AVAILABLE: {count} photos\n",
+        "image": "   {i}. {url}\n",
+        "footer": _render_terminal_activities_footer
+    }
+}
+
+def render_activities_compact(activities_data):
+    """
+    Yield compact activity results for the AI: overview, the column legend,
+    one row per result (whitespace collapsed, descriptions cut at 400
+    characters as in the markdown layout) and the image URLs.
+    """
+    def cell(value):
+        return " ".join(str(value).split()).replace("|", "/") if value not in (None, "") else "-"
+    
+    yield "ACTIVITY_SEARCH_RESULTS\n"
+    if activities_data.get('query'):
+        yield f"query: {cell(activities_data['query'])}\n"
+    if activities_data.get('answer'):
+        yield f"overview: {cell(activities_data['answer'])}\n"
     
-    print("\n" + "="*80 + "\n")
+    yield "n|title|score|url|description\n"
+    for i, result in enumerate(activities_data['results'][:5], 1):
+        content = result.get('content') or ''
+        content = content[:400] + "..." if len(content) > 400 else content
+        score = result.get('score')
+        yield "|".join((
+            str(i),
+            cell(result.get('title')),
+            f"{score:.2f}" if isinstance(score, float) else cell(score),
+            cell(result.get('url')),
+            cell(content)
+        )) + "\n"
+    
+    if activities_data.get('images'):
+        yield "images: " + " ".join(activities_data['images'][:3]) + "\n"
 
 def validate_tavily_api():
     """
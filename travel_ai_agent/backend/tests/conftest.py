@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tests import the backend's flat modules, and the shared package through its bootstrap
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bootstrap  # noqa: E402,F401  (puts the shared package on sys.path)
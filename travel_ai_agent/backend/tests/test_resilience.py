@@ -0,0 +1,160 @@
+"""Retries, timeouts, circuit breaking and hedging of shared/resilience.py against the fault stub."""
+import asyncio
+import time
+
+import httpx
+import pytest
+import requests
+
+from fault_stub import FaultPlan, start_stub
+from shared.resilience import CircuitBreaker, CircuitOpenError, Upstream, retryable_status
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = start_stub(FaultPlan(slow_seconds=1.5))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_script(stub):
+    stub.plan.script.clear()
+    yield
+    stub.plan.script.clear()
+
+
+def post_search(stub, upstream, **kwargs):
+    return upstream.call(requests.post, f"{stub.url}/search", json={"query": "x"}, timeout=upstream.timeout, **kwargs)
+
+
+def test_retries_transient_status_then_succeeds(stub):
+    stub.plan.script.extend(["503", "503", "ok"])
+    upstream = Upstream("retry", timeout=2, retries=2, backoff_base=0.01)
+
+    response = post_search(stub, upstream, retry_if=retryable_status)
+
+    assert response.status_code == 200
+    assert upstream.stats == {"calls": 1, "failures": 2, "retries": 2, "hedges": 0, "hedge_wins": 0}
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_returns_last_response_once_retries_run_out(stub):
+    stub.plan.script.extend(["503", "503"])
+    upstream = Upstream("exhausted", timeout=2, retries=1, backoff_base=0.01)
+
+    response = post_search(stub, upstream, retry_if=retryable_status)
+
+    assert response.status_code == 503
+    assert upstream.stats["retries"] == 1
+    assert upstream.stats["failures"] == 2
+
+
+def test_hung_attempt_costs_one_timeout(stub):
+    stub.plan.script.extend(["hang", "ok"])
+    upstream = Upstream("timeout", timeout=0.3, retries=1, backoff_base=0.01)
+
+    started = time.perf_counter()
+    response = post_search(stub, upstream)
+
+    assert response.ok
+    assert time.perf_counter() - started < 1.0
+    assert upstream.stats["retries"] == 1
+
+
+def test_non_idempotent_send_is_not_retried_after_read_timeout(stub):
+    stub.plan.script.extend(["hang", "ok"])
+    upstream = Upstream("telegram", timeout=0.3, retries=3, backoff_base=0.01)
+
+    with pytest.raises(requests.Timeout):
+        upstream.call(requests.post, f"{stub.url}/botX/sendMessage", data={"text": "x"}, timeout=upstream.timeout,
+                      idempotent=False)
+
+    assert upstream.stats["retries"] == 0
+
+
+def test_breaker_opens_fails_fast_and_recovers_through_half_open_probe(stub):
+    upstream = Upstream("breaker", timeout=1, retries=0, failure_threshold=3, reset_timeout=0.2)
+    breaker = upstream.breaker
+    states = []
+
+    def probe(*args, **kwargs):
+        states.append(breaker.state)
+        return requests.post(*args, **kwargs)
+
+    stub.plan.script.extend(["503", "503", "503"])
+    for _ in range(3):
+        post_search(stub, upstream, retry_if=retryable_status)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats["opened"] == 1
+
+    # Open: rejected without reaching the stub
+    hits = sum(stub.hits.values())
+    with pytest.raises(CircuitOpenError):
+        post_search(stub, upstream)
+    assert sum(stub.hits.values()) == hits
+    assert breaker.stats["rejected"] == 1
+
+    # Half-open: a failed probe opens it again
+    time.sleep(0.25)
+    stub.plan.script.append("503")
+    upstream.call(probe, f"{stub.url}/search", json={}, timeout=upstream.timeout, retry_if=retryable_status)
+    assert states == [CircuitBreaker.HALF_OPEN]
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats["opened"] == 2
+
+    # Half-open again: a successful probe closes it
+    time.sleep(0.25)
+    response = upstream.call(probe, f"{stub.url}/search", json={}, timeout=upstream.timeout, retry_if=retryable_status)
+    assert response.ok
+    assert states == [CircuitBreaker.HALF_OPEN, CircuitBreaker.HALF_OPEN]
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_hedged_request_wins_over_slow_first_attempt(stub):
+    stub.plan.script.extend(["slow", "ok"])
+    upstream = Upstream("hedge", timeout=5, retries=0, hedge_delay=0.2)
+
+    async def hedged_call():
+        async with httpx.AsyncClient() as client:
+            return await upstream.acall(client.post, f"{stub.url}/api/v1/chat/completions", json={}, hedge=True)
+
+    started = time.perf_counter()
+    response = asyncio.run(hedged_call())
+
+    assert response.status_code == 200
+    assert time.perf_counter() - started < stub.plan.slow_seconds
+    assert upstream.stats["hedges"] == 1
+    assert upstream.stats["hedge_wins"] == 1
+
+
+def test_cancelled_half_open_probe_lets_the_next_call_probe(stub):
+    upstream = Upstream("cancelled-probe", timeout=5, retries=0, failure_threshold=1, reset_timeout=0.2)
+    breaker = upstream.breaker
+    url = f"{stub.url}/api/v1/chat/completions"
+
+    async def scenario():
+        async with httpx.AsyncClient() as client:
+            stub.plan.script.append("503")
+            await upstream.acall(client.post, url, json={}, retry_if=retryable_status)
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # Half-open: the probe hangs and is cancelled, as when a streaming client disconnects
+            await asyncio.sleep(0.25)
+            stub.plan.script.append("hang")
+            probe = asyncio.ensure_future(upstream.acall(client.post, url, json={}))
+            await asyncio.sleep(0.1)
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+
+            # The next call is the new probe instead of being rejected forever
+            stub.plan.script.append("ok")
+            return await upstream.acall(client.post, url, json={}, retry_if=retryable_status)
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats["rejected"] == 0
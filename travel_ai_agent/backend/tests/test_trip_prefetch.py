@@ -0,0 +1,51 @@
+"""Trip slots read by trip_prefetch.prefetch_trip from messages shaped as the frontend sends them."""
+import pytest
+
+import trip_prefetch
+from shared.session_store import Session
+
+# index.html puts these instructions before every message
+FRONTEND_PREFIX = (
+    "You are a helpful AI travel assistant. Help plan trips, suggest destinations, activities, hotels, "
+    "and provide travel advice. User query: "
+)
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    """The slots handed to the prefetcher, without starting any search."""
+    seen = []
+    monkeypatch.setattr(trip_prefetch, "TRIP_PREFETCH", True)
+    monkeypatch.setattr(trip_prefetch.prefetcher, "update", lambda session_id, slots: seen.append(dict(slots)))
+    return seen
+
+
+def say(session, assistant, user):
+    """Add an assistant question and the user's answer, then prefetch as main.py does."""
+    if assistant:
+        session.history.append({"role": "assistant", "content": assistant})
+    session.history.append({"role": "user", "content": FRONTEND_PREFIX + user})
+    trip_prefetch.prefetch_trip(session, FRONTEND_PREFIX + user)
+
+
+def test_one_word_answers_fill_slots(updates):
+    session = Session("s1")
+    say(session, "", "I want to plan a trip")
+    say(session, "Great! Where would you like to go?", "London")
+    say(session, "Where will you be flying from?", "Paris")
+    say(session, "How many travelers will there be?", "2")
+    say(session, "What activities are you interested in?", "museums")
+
+    slots = session.state["trip_slots"]
+    assert slots["destination"] == "London"
+    assert slots["origin"] == "Paris"
+    assert slots["travelers"] == 2
+    assert "museum" in slots["activities"]
+    assert updates[-1] == slots
+
+
+def test_prefix_words_are_not_read_as_slots(updates):
+    session = Session("s2")
+    say(session, "", "hello")
+
+    assert session.state["trip_slots"] == {}
@@ -0,0 +1,361 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from datetime import date
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from airport_index import get_airport_index, place_name, CODE_RE
+from ai_utils import user_query_text
+from tavily_utils import search_activities, validate_tavily_api
+from serpapi_utils import search_flights, check_flight_search, expand_airports, validate_serpapi
+
+load_dotenv()
+
+# Warm the flight and activity caches while the trip details are still being collected ("0" turns it off)
+TRIP_PREFETCH = os.getenv("TRIP_PREFETCH", "1") != "0"
+# Seconds a prefetch waits before calling upstream, so a slot corrected in the next message cancels it for free
+TRIP_PREFETCH_DELAY = float(os.getenv("TRIP_PREFETCH_DELAY", "0.75"))
+# Prefetches allowed to call upstream at once, across all sessions
+TRIP_PREFETCH_CONCURRENCY = int(os.getenv("TRIP_PREFETCH_CONCURRENCY", "4"))
+# Sessions whose prefetch targets are remembered
+TRIP_PREFETCH_SESSIONS = int(os.getenv("TRIP_PREFETCH_SESSIONS", "1000"))
+
+MONTHS = {
+    name: number for number, names in enumerate((
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+        ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+        ("november", "nov"), ("december", "dec")
+    ), start=1) for name in names
+}
+MONTH_RE = "|".join(sorted(MONTHS, key=len, reverse=True))
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9}
+
+ISO_DATE_RE = r"(?P<iso>\d{4}-\d{1,2}-\d{1,2})"
+US_DATE_RE = r"(?P<us_month>\d{1,2})/(?P<us_day>\d{1,2})/(?P<us_year>\d{4})"
+MONTH_DAY_RE = rf"(?P<md_month>{MONTH_RE})\.?\s+(?P<md_day>\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(?P<md_year>\d{{4}}))?"
+DAY_MONTH_RE = rf"(?P<dm_day>\d{{1,2}})(?:st|nd|rd|th)?(?:\s+of)?\s+(?P<dm_month>{MONTH_RE})\.?(?:,?\s+(?P<dm_year>\d{{4}}))?"
+DATE_RE = re.compile(rf"\b(?:{ISO_DATE_RE}|{US_DATE_RE}|{MONTH_DAY_RE}|{DAY_MONTH_RE})\b", re.IGNORECASE)
+# Words just before a date that make it the return date
+RETURN_CUE_RE = re.compile(r"\b(?:return\w*|back|until|till|til|home|through|thru|to|-)\s*(?:on\s+)?$", re.IGNORECASE)
+
+# A place ends at a connecting word, punctuation or a date
+PLACE_RE = r"(?P<place>[A-Za-z][A-Za-z.'-]*(?:\s+[A-Za-z][A-Za-z.'-]*){0,3}?)"
+PLACE_END_RE = (
+    r"(?=\s+(?:to|on|in|for|and|with|from|leaving|departing|returning|around|next|this|at|by|via|between|"
+    rf"{MONTH_RE}|\d)\b|\s*[,.!?;:)]|\s*$)"
+)
+FROM_RE = re.compile(rf"\b(?:from|leaving|departing|out\s+of)\s+{PLACE_RE}{PLACE_END_RE}", re.IGNORECASE)
+TO_RE = re.compile(rf"\b(?:to|visit|visiting|in|towards?|for)\s+{PLACE_RE}{PLACE_END_RE}", re.IGNORECASE)
+
+TRAVELERS_RE = re.compile(
+    r"\b(?P<count>\d{1,2}|one|two|three|four|five|six|seven|eight|nine)\s+"
+    r"(?:of\s+us|people|persons|travell?ers|adults|passengers|guests|pax|tickets|seats)\b",
+    re.IGNORECASE
+)
+SOLO_RE = re.compile(r"\b(?:just\s+me|only\s+me|solo|by\s+myself|alone|on\s+my\s+own|myself)\b", re.IGNORECASE)
+COUPLE_RE = re.compile(
+    r"\b(?:me\s+and\s+my\s+(?:wife|husband|partner|girlfriend|boyfriend|friend|mom|mum|dad|son|daughter)|"
+    r"my\s+(?:wife|husband|partner|girlfriend|boyfriend)\s+and\s+(?:me|i)|a\s+couple|the\s+two\s+of\s+us|both\s+of\s+us)\b",
+    re.IGNORECASE
+)
+# "I love museums and street food", "we're into hiking": the activity preferences
+INTERESTS_RE = re.compile(
+    r"\b(?:i|we)(?:'m|'re|\s+am|\s+are)?\s+(?:really\s+|mostly\s+)?"
+    r"(?:like|love|enjoy|into|interested\s+in|fans?\s+of)\s+(?!to\b|going\b|visiting\b)(?P<activities>[^.!?;]+)",
+    re.IGNORECASE
+)
+NO_PREFERENCE_RE = re.compile(
+    r"\b(?:no\s+preferences?|anything|whatever|not\s+sure|surprise\s+me|nothing\s+(?:in\s+)?particular|no\s+idea)\b",
+    re.IGNORECASE
+)
+BARE_NUMBER_RE = re.compile(r"^\s*(?:we\s+are\s+|we're\s+|just\s+)?(\d{1,2}|one|two|three|four|five|six|seven|eight|nine)\s*[.!]?\s*$",
+                            re.IGNORECASE)
+
+# Words a place capture must not be ("to go", "in May", "for a week")
+NOT_PLACE_WORDS = {
+    "a", "an", "the", "my", "our", "me", "us", "you", "it", "go", "fly", "travel", "visit", "see", "be", "get",
+    "book", "find", "stay", "leave", "return", "come", "know", "do", "make", "have", "plan", "take", "there",
+    "here", "home", "back", "week", "weeks", "month", "months", "day", "days", "weekend", "holiday", "vacation",
+    "trip", "flight", "flights", "family", "friends", "work", "business", "people", "adults", "travelers",
+    "today", "tomorrow", "yes", "no", "ok", "okay", "sure", "thanks", "please", "next", "this", "that",
+    *MONTHS, *NUMBER_WORDS
+}
+
+# What the assistant's last question was asking, for one-word answers like "London" or "2"
+ASKED_ORIGIN_RE = re.compile(r"\b(?:from|origin|departing|leaving|fly(?:ing)?\s+out\s+of|start(?:ing)?)\b", re.IGNORECASE)
+ASKED_DESTINATION_RE = re.compile(r"\b(?:where\s+to|destination|go|going|head(?:ing|ed)|visit\w*)\b", re.IGNORECASE)
+ASKED_TRAVELERS_RE = re.compile(r"\bhow\s+many\b|\btravell?ers\b|\bpassengers\b", re.IGNORECASE)
+ASKED_RETURN_RE = re.compile(r"\breturn\w*\b|\bcome\s+back\b|\bback\b", re.IGNORECASE)
+ASKED_ACTIVITIES_RE = re.compile(r"\bactivit\w*|\binterest\w*|\bthings\s+to\s+do\b|\benjoy\b", re.IGNORECASE)
+
+
+def _known_place(text):
+    """
+    The place `text` names exactly (no prefix or typo matches): leading
+    filler words are skipped and shorter word runs tried; None if nothing
+    matches.
+
+    A wrong guess only costs a wasted prefetch, but only exact matches are
+    taken so that ordinary words are never searched for.
+    """
+    words = text.split()
+    while words and words[0].casefold() in NOT_PLACE_WORDS:
+        words = words[1:]
+    for end in range(len(words), 0, -1):
+        candidate = " ".join(words[:end])
+        if candidate.casefold() in NOT_PLACE_WORDS:
+            continue
+        if CODE_RE.fullmatch(candidate) and candidate.isupper():
+            if get_airport_index().entry(candidate):
+                return candidate
+            continue
+        matches = get_airport_index().lookup(candidate, limit=1)
+        if matches and matches[0]["match"] == "exact":
+            return candidate
+    return None
+
+
+def _parse_date(match, today):
+    """YYYY-MM-DD for a DATE_RE match; a date without a year is the next one from today."""
+    groups = match.groupdict()
+    try:
+        if groups["iso"]:
+            return date.fromisoformat("-".join(part.zfill(2) for part in groups["iso"].split("-"))).isoformat()
+        if groups["us_month"]:
+            return date(int(groups["us_year"]), int(groups["us_month"]), int(groups["us_day"])).isoformat()
+        prefix = "md" if groups["md_month"] else "dm"
+        month = MONTHS[groups[f"{prefix}_month"].lower()]
+        day = int(groups[f"{prefix}_day"])
+        year = groups[f"{prefix}_year"]
+        if year:
+            return date(int(year), month, day).isoformat()
+        found = date(today.year, month, day)
+        return (found if found >= today else date(today.year + 1, month, day)).isoformat()
+    except ValueError:
+        return None
+
+
+def _travelers(text, previous_question):
+    match = TRAVELERS_RE.search(text)
+    if match:
+        count = match.group("count").lower()
+        return NUMBER_WORDS.get(count) or int(count)
+    if SOLO_RE.search(text):
+        return 1
+    if COUPLE_RE.search(text):
+        return 2
+    match = BARE_NUMBER_RE.match(text)
+    if match and ASKED_TRAVELERS_RE.search(previous_question):
+        count = match.group(1).lower()
+        return NUMBER_WORDS.get(count) or int(count)
+    return None
+
+
+def extract_trip_slots(text, previous_question="", today=None):
+    """
+    Pick trip details out of one user message with local patterns.
+
+    Places must match the airport index exactly; dates may be YYYY-MM-DD,
+    MM/DD/YYYY, "May 8" or "8 May" (with or without a year). A message
+    that is only a place or a number answers the assistant's previous
+    question. Anything unclear is left out: the AI still collects the
+    details itself, this only guesses them early.
+
+    Args:
+        text (str): The user's message
+        previous_question (str): The assistant message it answers
+        today (date, optional): Reference date for dates without a year
+
+    Returns:
+        dict: The slots found: origin, destination, departure, return, travelers, activities
+    """
+    today = today or date.today()
+    text = " ".join((text or "").split())
+    slots = {}
+
+    dates = []
+    for match in DATE_RE.finditer(text):
+        value = _parse_date(match, today)
+        if value:
+            dates.append((value, bool(RETURN_CUE_RE.search(text[:match.start()][-24:]))))
+    if len(dates) >= 2:
+        slots["departure"], slots["return"] = dates[0][0], dates[1][0]
+    elif dates:
+        value, is_return = dates[0]
+        slots["return" if is_return or ASKED_RETURN_RE.search(previous_question) else "departure"] = value
+
+    # Dates are blanked out so "from May 1" is not read as a place
+    place_text = DATE_RE.sub(lambda match: "," + " " * (len(match.group()) - 1), text)
+    for slot, pattern in (("origin", FROM_RE), ("destination", TO_RE)):
+        for match in pattern.finditer(place_text):
+            place = _known_place(match.group("place"))
+            if place:
+                slots[slot] = place
+                break
+
+    if not {"origin", "destination"} & slots.keys():
+        bare = text.strip(" .!?")
+        asked_origin = ASKED_ORIGIN_RE.search(previous_question)
+        asked_destination = ASKED_DESTINATION_RE.search(previous_question)
+        if bare and len(bare.split()) <= 4 and bool(asked_origin) != bool(asked_destination):
+            place = _known_place(bare)
+            if place and len(place) >= len(bare) - 1:
+                slots["origin" if asked_origin else "destination"] = place
+
+    travelers = _travelers(text, previous_question)
+    if travelers:
+        slots["travelers"] = travelers
+
+    match = INTERESTS_RE.search(text)
+    if match:
+        slots["activities"] = match.group("activities").strip(" ,")
+    elif ASKED_ACTIVITIES_RE.search(previous_question):
+        # An answer to "what do you enjoy?": no preference, or the whole reply if it holds no other detail
+        if NO_PREFERENCE_RE.search(text):
+            slots["activities"] = ""
+        elif not slots and len(text.split()) <= 8 and not _known_place(text.strip(" .!?")):
+            slots["activities"] = text.strip(" .!?")
+    return slots
+
+
+def _flight_target(slots):
+    """The flight search the trip will need, once route and dates are known."""
+    if not all(slots.get(slot) for slot in ("origin", "destination", "departure", "return")):
+        return None
+    return slots["origin"], slots["destination"], slots["departure"], slots["return"], slots.get("travelers", 1)
+
+
+def _activity_target(slots):
+    """
+    The activity search the trip will need, once the destination and the
+    activity preferences (possibly none) are known: the same place form and
+    preferences main.run_trip_searches searches with, so the cache keys match.
+    """
+    if not slots.get("destination") or "activities" not in slots:
+        return None
+    return place_name(slots["destination"]), slots["activities"]
+
+
+class TripPrefetcher:
+    """
+    Warms the flight and activity caches for trips still being described.
+
+    For each session it remembers the search the current slots call for
+    (see _flight_target and _activity_target). A new target cancels the
+    previous prefetch and starts another in the background; the same
+    target is never prefetched twice. Each prefetch first waits `delay`
+    seconds, so a slot corrected in the next message cancels it before any
+    upstream call, and at most `concurrency` prefetches call upstream at
+    once. A search already running in a thread cannot be stopped, but its
+    result only fills the cache.
+
+    The searches are the ordinary cached ones the confirmed trip runs
+    (see main.run_trip_searches), so the confirmation finds the results in
+    the cache, or waits on the prefetch still in flight (single-flight).
+
+    Args:
+        delay (float): Seconds to wait before calling upstream
+        concurrency (int): Maximum prefetches calling upstream at once
+        max_sessions (int): Sessions whose targets are remembered
+    """
+
+    def __init__(self, delay=TRIP_PREFETCH_DELAY, concurrency=TRIP_PREFETCH_CONCURRENCY,
+                 max_sessions=TRIP_PREFETCH_SESSIONS):
+        self.delay = delay
+        self.max_sessions = max_sessions
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs = OrderedDict()
+        self.stats = {"started": 0, "cancelled": 0, "completed": 0, "skipped": 0, "failed": 0}
+
+    def update(self, session_id, slots):
+        """Start, keep or cancel the session's prefetches to match its current slots (call from the event loop)."""
+        jobs = self._jobs.setdefault(session_id, {})
+        self._jobs.move_to_end(session_id)
+        for kind, target in (("flights", _flight_target(slots)), ("activities", _activity_target(slots))):
+            current = jobs.get(kind)
+            if current and current[0] == target:
+                continue
+            if current and current[1] and not current[1].done():
+                current[1].cancel()
+                self.stats["cancelled"] += 1
+                print(f"🔮 Trip prefetch cancelled ({kind}): slots changed")
+            if target is None:
+                jobs.pop(kind, None)
+                continue
+            task = asyncio.create_task(self._prefetch(kind, target))
+            jobs[kind] = (target, task)
+            self.stats["started"] += 1
+        while len(self._jobs) > self.max_sessions:
+            self._jobs.popitem(last=False)
+
+    def forget(self, session_id):
+        """Cancel and drop the session's prefetches (e.g. on reset)."""
+        for _, task in self._jobs.pop(session_id, {}).values():
+            if task and not task.done():
+                task.cancel()
+                self.stats["cancelled"] += 1
+
+    async def _prefetch(self, kind, target):
+        await asyncio.sleep(self.delay)
+        async with self._semaphore:
+            try:
+                if kind == "activities":
+                    if not validate_tavily_api():
+                        self.stats["skipped"] += 1
+                        return
+                    print(f"🔮 Prefetching activities for: {target[0]}" + (f" ({target[1]})" if target[1] else ""))
+                    result = await run_in_threadpool(search_activities, *target)
+                    ok = result is not None
+                else:
+                    origin, destination, departure, returning, travelers = target
+                    search_check = await run_in_threadpool(
+                        check_flight_search, origin, destination, departure, returning, travelers
+                    )
+                    # A metro code or airport set fans out to one search per airport pair;
+                    # too costly on a guess, so only single airports are prefetched
+                    fans_out = not search_check["problems"] and any(
+                        len(expand_airports(search_check[field])) > 1 for field in ("origin", "destination")
+                    )
+                    if search_check["problems"] or fans_out or not validate_serpapi():
+                        self.stats["skipped"] += 1
+                        return
+                    print(f"🔮 Prefetching flights: {search_check['origin']} → {search_check['destination']}")
+                    result = await run_in_threadpool(
+                        search_flights, search_check["origin"], search_check["destination"], departure, returning, travelers
+                    )
+                    ok = "error" not in result
+            except Exception as e:
+                print(f"⚠️ Trip prefetch ({kind}) failed: {e}")
+                ok = False
+        self.stats["completed" if ok else "failed"] += 1
+
+    def info(self):
+        """Prefetch counters plus the number of prefetches still running."""
+        running = sum(1 for jobs in self._jobs.values() for _, task in jobs.values() if task and not task.done())
+        return {**self.stats, "running": running, "sessions": len(self._jobs)}
+
+
+prefetcher = TripPrefetcher()
+
+
+def prefetch_trip(session, user_input):
+    """
+    Fold the trip details in the user's latest message into the session's
+    slots (session.state["trip_slots"]) and prefetch the searches they
+    call for. Call after the message is added to the history, before the
+    AI is asked, so the prefetch runs alongside the AI call.
+    """
+    if not TRIP_PREFETCH:
+        return
+    previous_question = next(
+        (message.get("content") or "" for message in reversed(session.history[:-1]) if message.get("role") == "assistant"),
+        ""
+    )
+    # Slots are read from the user's own words, not the instructions the frontend puts before them
+    found = extract_trip_slots(user_query_text(user_input).strip(), previous_question)
+    slots = {**session.state.get("trip_slots", {}), **found}
+    if found:
+        print(f"🧩 Trip slots: {slots}")
+    session.state["trip_slots"] = slots
+    prefetcher.update(session.id, slots)
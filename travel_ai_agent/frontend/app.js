@@ -5,6 +5,9 @@ const sendButton = document.getElementById('send-button');
 // API Configuration - Replace with your backend URL
 const API_BASE_URL = 'http://localhost:8000'; // Change this to your backend URL
 
+// The backend keeps one conversation per session id; remember ours across reloads
+let sessionId = localStorage.getItem('tripaiSessionId');
+
 function autoResize(element) {
     element.style.height = 'auto';
     element.style.height = Math.min(element.scrollHeight, 300) + 'px';
@@ -63,6 +66,38 @@ function disableInput(disabled) {
     sendButton.disabled = disabled;
 }
 
+function setMessageContent(messageDiv, markdown) {
+    messageDiv.querySelector('.message-content').innerHTML = marked.parse(markdown);
+    chatContainer.scrollTop = chatContainer.scrollHeight;
+}
+
+// Read a server-sent event stream from a fetch() response, calling onEvent(name, data) per event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(eventName, JSON.parse(data));
+        }
+    }
+}
+
 async function sendMessage() {
     const message = userInput.value.trim();
     if (!message) return;
@@ -79,14 +114,15 @@ async function sendMessage() {
     const loadingMessage = addMessage('', '', 'loading');
 
     try {
-        // Make API call to your backend
-        const response = await fetch(`${API_BASE_URL}/chat`, {
+        // Make API call to your backend; the reply is streamed back token by token
+        const response = await fetch(`${API_BASE_URL}/chat/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({ 
-                message: message 
+                message: message,
+                session_id: sessionId
             })
         });
 
@@ -94,26 +130,46 @@ async function sendMessage() {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        const data = await response.json();
+        let aiMessage = null;
+        let streamedText = '';
 
-        // Remove loading message
-        chatContainer.removeChild(loadingMessage);
+        // Swap the loading dots for the AI message on the first token
+        const showAiMessage = (markdown) => {
+            if (!aiMessage) {
+                chatContainer.removeChild(loadingMessage);
+                aiMessage = addMessage('AI', markdown, 'ai');
+            } else {
+                setMessageContent(aiMessage, markdown);
+            }
+        };
 
-        if (Array.isArray(data.reply)) {
-            // If flight details are returned, display them
-            data.reply.forEach(flight => {
-                addMessage('AI', `Flight: ${flight.airline} | ${flight.route} | Price: $${flight.price}`, 'ai');
-            });
-        } else {
-            // Display AI reply (non-flight related)
-            addMessage('AI', data.reply || 'I apologize, but I encountered an issue. Please try again.', 'ai');
+        await readEventStream(response, (eventName, data) => {
+            if (eventName === 'token') {
+                streamedText += data.text;
+                showAiMessage(streamedText);
+            } else if (eventName === 'status') {
+                showAiMessage(streamedText ? `${streamedText}\n\n_${data.text}_` : `_${data.text}_`);
+            } else if (eventName === 'done') {
+                if (data.session_id && data.session_id !== sessionId) {
+                    sessionId = data.session_id;
+                    localStorage.setItem('tripaiSessionId', sessionId);
+                }
+                // The final reply replaces the streamed text (it includes any search results)
+                showAiMessage(data.reply || 'I apologize, but I encountered an issue. Please try again.');
+            }
+        });
+
+        if (!aiMessage) {
+            throw new Error('Stream ended without a reply');
         }
         
     } catch (error) {
         console.error('Error:', error);
         
         // Remove loading message
-        chatContainer.removeChild(loadingMessage);
+        if (loadingMessage.parentNode) {
+            chatContainer.removeChild(loadingMessage);
+        }
         
         // Add error message
         addMessage('AI', '🔧 I\'m having trouble connecting to my travel database right now. Please check that the backend server is running and try again!', 'ai');